@@ -1,100 +1,138 @@
-import re
+import math
 import sqlite3
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 
 import textstat
-import language_tool_python
-from textblob import TextBlob
 
-# ── служебные объекты ──────────────────────────────────────────
-tool_ru = language_tool_python.LanguageTool("ru-RU")
-tool_en = language_tool_python.LanguageTool("en-US")
+import Grammar   # LanguageTool: по языку фрагмента, пул, GRAMMAR_MODE
+import Sentiment # словарь ru/en (NumPy, пачками) или TextBlob — SENTIMENT_BACKEND
+import Rules     # шаблоны / отказы / хеджи / даты из rules.json, один проход
 
-TEMPLATE_PATTERNS = [
-    r"(?i)as an ai language model",
-    r"(?i)как (?:модель|искусственный интеллект)",
-    r"(?i)я не могу (?:ответить|предоставить)",
-]
-REFUSAL_PATTERNS = [
-    r"(?i)извините[, ]+но я не могу",
-    r"(?i)i'?m sorry[, ]+but i cannot",
-    r"(?i)к сожалению[, ]+я не могу",
-]
-REFERENCE_HINT = re.compile(r"\d{1,2}\s*[а-яa-z]{3,}")  # упоминание дат
+# Версия логики analyse: увеличить при любом изменении метрик, и
+# Backfill.py пересчитает строки со старой версией.
+ANALYSIS_VERSION = 2
 
 # ── helpers ────────────────────────────────────────────────────
-def _match_any(text: str, patterns) -> bool:
-    return any(re.search(p, text) for p in patterns)
-
-def _sentiment(text: str) -> float:
-    """Полярность: –1…+1 (TextBlob)."""
-    try:
-        return TextBlob(text).sentiment.polarity
-    except Exception:
-        return 0.0
+def _logprob_confidence(logprobs: Optional[list]) -> Optional[float]:
+    """exp(среднего logprob) токенов ответа; None — logprobs нет или не разобрать."""
+    nums = []
+    for item in logprobs or ():
+        if isinstance(item, (int, float)):
+            nums.append(float(item))
+        elif isinstance(item, (list, tuple)) and isinstance(item[-1], (int, float)):
+            nums.append(float(item[-1]))  # (token, logprob)
+        elif isinstance(item, dict) and "logprob" in item:
+            nums.append(float(item["logprob"]))  # {'logprob': …}
+    return round(math.exp(sum(nums) / len(nums)), 4) if nums else None
 
 # ── public API ─────────────────────────────────────────────────
-UNCERTAIN = [
-    "возможно", "может", "полагаю", "кажется", "вероятно",
-    "maybe", "probably", "perhaps", "i think"
-]
-
-def _confidence(text: str, logprobs: Optional[list] = None) -> float:
+def _confidence(text: str, logprobs: Optional[list] = None,
+                hedges: Optional[int] = None) -> float:
     """
     Возвращает 0‒1:
-    • если передан список чисел/кортежей/словарей — усредняем,
-    • иначе эвристика по числу «неуверенных» слов в тексте.
+    • если переданы logprobs токенов ответа (числа, (token, logprob) или
+      {'logprob': …}) — средняя вероятность токена: exp(среднего logprob),
+    • иначе эвристика по числу «неуверенных» слов в тексте
+      (hedges — уже посчитанное Rules число совпадений семейства hedge).
     """
     # ── 1. пробуем использовать числовые logprobs (если пришли) ─────────
-    if logprobs:
-        nums = []
-        for item in logprobs:
-            if isinstance(item, (int, float)):
-                nums.append(float(item))
-            elif isinstance(item, (list, tuple)) and isinstance(item[-1], (int, float)):
-                nums.append(float(item[-1]))  # (token, prob)
-            elif isinstance(item, dict) and "logprob" in item:
-                nums.append(float(item["logprob"]))  # {'logprob': …}
-        if nums:
-            return round(sum(nums) / len(nums), 4)
+    conf = _logprob_confidence(logprobs)
+    if conf is not None:
+        return conf
 
     # ── 2. эвристика: чем больше «хеджей», тем ниже уверенность ─────────
-    words = text.lower().split()
-    total = len(words) or 1
-    hedges = sum(text.lower().count(w) for w in UNCERTAIN)
+    total = len(text.split()) or 1
+    if hedges is None:
+        hedges = Rules.current().counts(text).get("hedge", 0)
     conf = max(0.0, 1 - (hedges / total) * 5)   # линейно понижает, 0–1
     return round(conf, 2)
 
 def analyse(question: str, answer: str, gen_time: float, logprobs: Optional[list] = None) -> Dict[str, Any]:
     clean = answer.strip()
+    return _metrics(question, clean, gen_time, logprobs,
+                    Grammar.count_errors(clean), Sentiment.score(clean))
+
+def analyse_many(rows: Iterable[tuple]) -> List[Dict[str, Any]]:
+    """analyse для пачки (question, answer, gen_time[, logprobs]): грамматика и
+    тональность считаются одним вызовом на всю пачку. Для Backfill и Pipeline."""
+    rows = [(r[0], (r[1] or "").strip(), r[2], r[3] if len(r) > 3 else None) for r in rows]
+    answers = [a for _, a, _, _ in rows]
+    grammar = Grammar.count_errors_many(answers)
+    sentiment = Sentiment.score_many(answers)
+    return [_metrics(q or "", a, t, lp, g, s)
+            for (q, a, t, lp), g, s in zip(rows, grammar, sentiment)]
+
+def _metrics(question: str, clean: str, gen_time: Optional[float],
+             logprobs: Optional[list], grammar_errors: Optional[int],
+             sentiment: float) -> Dict[str, Any]:
+    hits = Rules.current().scan(clean)
     return {
-        "confidence": _confidence(clean, logprobs),
-        "sentiment": _sentiment(clean),
-        "template_flag": int(_match_any(clean, TEMPLATE_PATTERNS)),
+        "confidence": _confidence(clean, logprobs, len(hits.get("hedge", ()))),
+        "confidence_source": "heuristic" if _logprob_confidence(logprobs) is None else "logprobs",
+        "sentiment": sentiment,
+        "template_flag": int(bool(hits.get("template"))),
         "word_count": len(clean.split()),
         "response_time": gen_time,
-        "reference_flag": int(bool(REFERENCE_HINT.search(clean))),
-        "refusal_flag": int(_match_any(clean, REFUSAL_PATTERNS)),
+        "reference_flag": int(bool(hits.get("reference"))),
+        "refusal_flag": int(bool(hits.get("refusal"))),
         "readability": textstat.flesch_reading_ease(clean),
-        "grammar_errors": len(tool_ru.check(clean)) + len(tool_en.check(clean)),
+        "grammar_errors": grammar_errors,
         "complex_words": textstat.difficult_words(clean),
         "question_repeat": int(clean.lower().startswith(question.lower()[:50])),
         "user_feedback": None,
         "category": None,
+        "category_source": None,   # llm | local | cache
+        "analysis_version": ANALYSIS_VERSION,
     }
 
-def save(conn: sqlite3.Connection, log_id: int, m: Dict[str, Any]) -> None:
-    """Вставка одной строки анализа по foreign-key log_id."""
-    conn.execute("""
-        INSERT OR REPLACE INTO analysis
-        (log_id, confidence, sentiment, template_flag, word_count,
-         response_time, reference_flag, refusal_flag, readability,
-         grammar_errors, complex_words, question_repeat, user_feedback, category)
-        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-    """, (
+# Вставка/обновление строки анализа по foreign-key log_id.
+# Анализ пишется в фоне, поэтому оценка пользователя могла прийти раньше —
+# уже сохранённый user_feedback не затираем; пустые response_time и
+# category (пересчёт в Backfill) тоже не затирают сохранённые, а
+# confidence по logprobs не заменяется эвристикой (пересчёт без logprobs).
+_UPSERT = """
+    INSERT INTO analysis
+    (log_id, confidence, sentiment, template_flag, word_count,
+     response_time, reference_flag, refusal_flag, readability,
+     grammar_errors, complex_words, question_repeat, user_feedback, category,
+     category_source, analysis_version, confidence_source)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+    ON CONFLICT(log_id) DO UPDATE SET
+        confidence=CASE WHEN analysis.confidence_source = 'logprobs'
+                         AND excluded.confidence_source = 'heuristic'
+                        THEN analysis.confidence ELSE excluded.confidence END,
+        confidence_source=CASE WHEN analysis.confidence_source = 'logprobs'
+                                AND excluded.confidence_source = 'heuristic'
+                               THEN analysis.confidence_source ELSE excluded.confidence_source END,
+        sentiment=excluded.sentiment,
+        template_flag=excluded.template_flag, word_count=excluded.word_count,
+        response_time=COALESCE(excluded.response_time, analysis.response_time),
+        reference_flag=excluded.reference_flag, refusal_flag=excluded.refusal_flag,
+        readability=excluded.readability, grammar_errors=excluded.grammar_errors,
+        complex_words=excluded.complex_words, question_repeat=excluded.question_repeat,
+        user_feedback=COALESCE(analysis.user_feedback, excluded.user_feedback),
+        category=COALESCE(excluded.category, analysis.category),
+        category_source=COALESCE(excluded.category_source, analysis.category_source),
+        analysis_version=excluded.analysis_version
+"""
+
+def _params(log_id: int, m: Dict[str, Any]) -> tuple:
+    return (
         log_id, m["confidence"], m["sentiment"], m["template_flag"], m["word_count"],
         m["response_time"], m["reference_flag"], m["refusal_flag"], m["readability"],
         m["grammar_errors"], m["complex_words"], m["question_repeat"],
-        m["user_feedback"], m["category"]
-    ))
-    conn.commit()
\ No newline at end of file
+        m["user_feedback"], m["category"], m.get("category_source"),
+        m.get("analysis_version", ANALYSIS_VERSION), m.get("confidence_source"),
+    )
+
+def save(conn: sqlite3.Connection, log_id: int, m: Dict[str, Any],
+         commit: bool = True) -> None:
+    """Вставка одной строки анализа.
+    commit=False — когда транзакцией управляет вызывающий (Db.Database)."""
+    conn.execute(_UPSERT, _params(log_id, m))
+    if commit:
+        conn.commit()
+
+def save_many(conn: sqlite3.Connection, items: Iterable[Tuple[int, Dict[str, Any]]]) -> None:
+    """Пачка строк одним executemany; транзакцией управляет вызывающий."""
+    conn.executemany(_UPSERT, [_params(log_id, m) for log_id, m in items])
@@ -0,0 +1,341 @@
+# Anomaly.py  ──────────────────────────────────────────────────────────
+# Обнаружение аномалий прямо в боте (Dashboard.py только показывает
+# таблицу alerts, тревоги не зависят от того, открыт ли он).
+#
+#   • Задержки (время ответа и до первого токена, только вызовы LLM) —
+#     потоковые квантильные скетчи TDigest: поминутные за окно
+#     ANOMALY_WINDOW_MIN и почасовые за ANOMALY_BASELINE_HOURS (база).
+#     Тревога — если в окне значимо больше ответов медленнее базового
+#     P{ANOMALY_QUANTILE}, чем ожидается (биномиальный тест: при норме
+#     доля таких ответов = 1 − q), и квантиль окна выше базового хотя бы
+#     в ANOMALY_MIN_EFFECT раз.
+#   • Дизлайки — оценки за окно по сегментам кампус × уровень × тип
+#     (профиль на момент вопроса, как в rollup). Ожидаемая доля 👎 —
+#     по всем сегментам за ANOMALY_BASELINE_DAYS (из rollup). Тревога —
+#     если 👎 сегмента значимо больше (биномиальный тест, поправка
+#     Бонферрони на число сегментов) и доля выше базы в ANOMALY_MIN_EFFECT раз.
+#
+# Тревоги пишутся в alerts (не чаще раза в ANOMALY_COOLDOWN_MIN на
+# метрику/сегмент), в лог и, если задан ANOMALY_CHAT_ID, в Telegram.
+import os, math, time, asyncio, logging
+from bisect import bisect_left
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from dotenv import load_dotenv
+
+from Db import Database, connect
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_CHECK_SEC      = float(os.getenv("ANOMALY_CHECK_SEC", "60"))
+ANOMALY_WINDOW_MIN     = int(os.getenv("ANOMALY_WINDOW_MIN", "15"))
+ANOMALY_BASELINE_HOURS = int(os.getenv("ANOMALY_BASELINE_HOURS", "24"))
+ANOMALY_BASELINE_DAYS  = float(os.getenv("ANOMALY_BASELINE_DAYS", "7"))
+ANOMALY_QUANTILE       = float(os.getenv("ANOMALY_QUANTILE", "0.95"))
+ANOMALY_ALPHA          = float(os.getenv("ANOMALY_ALPHA", "0.001"))   # на одну проверку
+ANOMALY_MIN_EFFECT     = float(os.getenv("ANOMALY_MIN_EFFECT", "1.25"))
+ANOMALY_MIN_N          = int(os.getenv("ANOMALY_MIN_N", "20"))        # ответов в окне
+ANOMALY_MIN_VOTES      = int(os.getenv("ANOMALY_MIN_VOTES", "5"))     # оценок сегмента в окне
+ANOMALY_DISLIKE_BASE   = float(os.getenv("ANOMALY_DISLIKE_BASE", "0.10"))  # пока оценок нет
+ANOMALY_COOLDOWN_MIN   = float(os.getenv("ANOMALY_COOLDOWN_MIN", "30"))
+ANOMALY_CHAT_ID        = os.getenv("ANOMALY_CHAT_ID", "")             # пусто — без Telegram
+
+LATENCY = ("response_time", "first_token_time")
+LATENCY_NAMES = {"response_time": "время ответа", "first_token_time": "до первого токена"}
+
+
+# ── квантильный скетч ──────────────────────────────────────────
+class TDigest:
+    """Merging t-digest (Dunning): центроиды (среднее, вес), у хвостов
+    мелкие, в середине крупные — точные крайние квантили при памяти
+    O(compression) независимо от числа наблюдений."""
+
+    def __init__(self, compression: float = 100):
+        self.compression = compression
+        self.means: list[float] = []
+        self.weights: list[float] = []
+        self._buf: list[tuple[float, float]] = []
+        self.count = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x: float, w: float = 1.0) -> None:
+        self._buf.append((x, w))
+        self.count += w
+        self.min, self.max = min(self.min, x), max(self.max, x)
+        if len(self._buf) >= 5 * self.compression:
+            self._compress()
+
+    def merge(self, other: "TDigest") -> None:
+        other._compress()
+        self._buf.extend(zip(other.means, other.weights))
+        self.count += other.count
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        self._compress()
+
+    def _k(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * min(1.0, max(0.0, q)) - 1)
+
+    def _compress(self) -> None:
+        if not self._buf:
+            return
+        items = sorted([*zip(self.means, self.weights), *self._buf])
+        self._buf = []
+        means, weights = [], []
+        m, w = items[0]
+        done, k_lo = 0.0, self._k(0.0)
+        for x, wx in items[1:]:
+            if self._k((done + w + wx) / self.count) - k_lo <= 1:
+                w += wx
+                m += (x - m) * wx / w
+            else:
+                means.append(m); weights.append(w)
+                done += w
+                k_lo = self._k(done / self.count)
+                m, w = x, wx
+        means.append(m); weights.append(w)
+        self.means, self.weights = means, weights
+
+    def _centers(self) -> list[float]:
+        """Накопленный вес до середины каждого центроида."""
+        self._compress()
+        out, acc = [], 0.0
+        for w in self.weights:
+            out.append(acc + w / 2)
+            acc += w
+        return out
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        centers = self._centers()
+        target = q * self.count
+        i = bisect_left(centers, target)
+        if i == 0:
+            lo_x, lo_c, hi_x, hi_c = self.min, 0.0, self.means[0], centers[0]
+        elif i == len(centers):
+            lo_x, lo_c, hi_x, hi_c = self.means[-1], centers[-1], self.max, self.count
+        else:
+            lo_x, lo_c, hi_x, hi_c = self.means[i - 1], centers[i - 1], self.means[i], centers[i]
+        if hi_c <= lo_c:
+            return hi_x
+        return lo_x + (hi_x - lo_x) * (target - lo_c) / (hi_c - lo_c)
+
+    def cdf(self, x: float) -> float:
+        """Доля наблюдений ≤ x."""
+        if not self.count or x < self.min:
+            return 0.0
+        if x >= self.max:
+            return 1.0
+        centers = self._centers()
+        xs = [self.min, *self.means, self.max]
+        cs = [0.0, *centers, self.count]
+        i = bisect_left(xs, x)
+        lo, hi = max(i - 1, 0), min(i, len(xs) - 1)
+        if xs[hi] <= xs[lo]:
+            return cs[hi] / self.count
+        return (cs[lo] + (cs[hi] - cs[lo]) * (x - xs[lo]) / (xs[hi] - xs[lo])) / self.count
+
+
+# ── окна из корзин ─────────────────────────────────────────────
+class Ring:
+    """Скользящее окно из size корзин по width секунд; корзина — make()."""
+
+    def __init__(self, width: float, size: int, make: Callable[[], object]):
+        self.width, self.size, self.make = width, size, make
+        self.buckets: deque[tuple[int, object]] = deque()
+
+    def at(self, now: float):
+        """Корзина для наблюдения в момент now."""
+        slot = int(now // self.width)
+        if not self.buckets or self.buckets[-1][0] != slot:
+            self.buckets.append((slot, self.make()))
+        self._evict(slot)
+        return self.buckets[-1][1]
+
+    def live(self, now: float) -> list:
+        self._evict(int(now // self.width))
+        return [b for _, b in self.buckets]
+
+    def _evict(self, slot: int) -> None:
+        while self.buckets and self.buckets[0][0] <= slot - self.size:
+            self.buckets.popleft()
+
+
+def merged(digests: list[TDigest]) -> TDigest:
+    out = TDigest()
+    for d in digests:
+        out.merge(d)
+    return out
+
+
+# ── статистика ─────────────────────────────────────────────────
+def binom_sf(k: int, n: int, p: float) -> float:
+    """P(X ≥ k) для X ~ Bin(n, p) — точно, суммой в логарифмах."""
+    if k <= 0:
+        return 1.0
+    if k > n or p <= 0:
+        return 0.0
+    if p >= 1:
+        return 1.0
+    lp, lq, ln = math.log(p), math.log1p(-p), math.lgamma(n + 1)
+    terms = [ln - math.lgamma(i + 1) - math.lgamma(n - i + 1) + i * lp + (n - i) * lq
+             for i in range(k, n + 1)]
+    top = max(terms)
+    return min(1.0, math.exp(top) * sum(math.exp(t - top) for t in terms))
+
+
+@dataclass
+class Alert:
+    kind: str                       # latency | dislikes
+    metric: str                     # response_time | first_token_time | user_feedback
+    value: float                    # квантиль / доля 👎 в окне
+    baseline: float
+    n: int                          # наблюдений (оценок) в окне
+    p_value: float
+    segment: tuple = (None, None, None)     # кампус, уровень, тип
+
+    @property
+    def message(self) -> str:
+        if self.kind == "latency":
+            return (f"P{ANOMALY_QUANTILE * 100:.0f} ({LATENCY_NAMES[self.metric]}) за "
+                    f"{ANOMALY_WINDOW_MIN} мин: {self.value:.1f} с против {self.baseline:.1f} с "
+                    f"(n={self.n}, p={self.p_value:.1g})")
+        seg = " | ".join(s or "—" for s in self.segment)
+        return (f"Дизлайки {seg} за {ANOMALY_WINDOW_MIN} мин: {self.value:.0%} "
+                f"против {self.baseline:.0%} (оценок {self.n}, p={self.p_value:.1g})")
+
+
+# ── детектор ───────────────────────────────────────────────────
+class AnomalyDetector:
+    def __init__(self, db: Database):
+        self.db = db
+        self.window = {m: Ring(60, ANOMALY_WINDOW_MIN, TDigest) for m in LATENCY}
+        self.base = {m: Ring(3600, ANOMALY_BASELINE_HOURS, TDigest) for m in LATENCY}
+        # сегмент → [👎, всего оценок] по минутам
+        self.votes = Ring(60, ANOMALY_WINDOW_MIN, lambda: defaultdict(lambda: [0, 0]))
+        self.dislike_base = ANOMALY_DISLIKE_BASE
+        self._last: dict[tuple, float] = {}      # (метрика, сегмент) → время тревоги
+
+    # ── наблюдения (из Handlers, в event loop) ─────────────────
+    def observe_latency(self, metric: str, seconds: Optional[float],
+                        now: Optional[float] = None) -> None:
+        if seconds is None:
+            return
+        now = time.time() if now is None else now
+        self.window[metric].at(now).add(seconds)
+        self.base[metric].at(now).add(seconds)
+
+    def observe_vote(self, segment: tuple, fb: int, now: Optional[float] = None) -> None:
+        counts = self.votes.at(time.time() if now is None else now)[tuple(segment)]
+        counts[0] += fb == -1
+        counts[1] += 1
+
+    # ── проверка ───────────────────────────────────────────────
+    def check(self, now: Optional[float] = None) -> list[Alert]:
+        now = time.time() if now is None else now
+        alerts = [a for m in LATENCY if (a := self._check_latency(m, now))]
+        alerts += self._check_votes(now)
+        fresh = []
+        for a in alerts:
+            key = (a.metric, a.segment)
+            if now - self._last.get(key, -math.inf) >= ANOMALY_COOLDOWN_MIN * 60:
+                self._last[key] = now
+                fresh.append(a)
+        return fresh
+
+    def _check_latency(self, metric: str, now: float) -> Optional[Alert]:
+        cur = merged(self.window[metric].live(now))
+        if cur.count < ANOMALY_MIN_N:
+            return None
+        base = merged(self.base[metric].live(now))
+        b = base.quantile(ANOMALY_QUANTILE)
+        if not b or base.count < 5 * cur.count:
+            return None
+        value = cur.quantile(ANOMALY_QUANTILE)
+        if value < b * ANOMALY_MIN_EFFECT:
+            return None
+        n = round(cur.count)
+        slow = round(n * (1 - cur.cdf(b)))
+        p = binom_sf(slow, n, 1 - ANOMALY_QUANTILE)
+        if p >= ANOMALY_ALPHA:
+            return None
+        return Alert("latency", metric, value, b, n, p)
+
+    def _check_votes(self, now: float) -> list[Alert]:
+        total: dict[tuple, list[int]] = defaultdict(lambda: [0, 0])
+        for bucket in self.votes.live(now):
+            for seg, (neg, n) in bucket.items():
+                total[seg][0] += neg
+                total[seg][1] += n
+        p0 = self.dislike_base
+        alpha = ANOMALY_ALPHA / max(1, len(total))       # поправка Бонферрони
+        out = []
+        for seg, (neg, n) in total.items():
+            if n < ANOMALY_MIN_VOTES or neg / n < p0 * ANOMALY_MIN_EFFECT:
+                continue
+            p = binom_sf(neg, n, p0)
+            if p < alpha:
+                out.append(Alert("dislikes", "user_feedback", neg / n, p0, n, p, seg))
+        return out
+
+    # ── база и фоновая задача ──────────────────────────────────
+    def _read_baseline(self) -> tuple[Optional[float], dict[str, list[tuple[float, float]]]]:
+        """Доля 👎 за ANOMALY_BASELINE_DAYS (rollup) и — при seed — задержки
+        вызовов LLM за ANOMALY_BASELINE_HOURS; отдельное соединение (в потоке)."""
+        c = connect(self.db.path)
+        try:
+            since = (datetime.utcnow() - timedelta(days=ANOMALY_BASELINE_DAYS)).date().isoformat()
+            neg, pos = c.execute("SELECT SUM(fb_neg), SUM(fb_pos) FROM rollup "
+                                 "WHERE grain = 'd' AND bucket >= ?", (since,)).fetchone()
+            ratio = (neg + 1) / (neg + pos + 2) if neg is not None and neg + pos else None
+            seed = {}
+            if not any(r.buckets for r in self.base.values()):
+                since = (datetime.utcnow() - timedelta(hours=ANOMALY_BASELINE_HOURS)).isoformat()
+                rows = c.execute(
+                    "SELECT a.response_time, a.first_token_time FROM logs l "
+                    "JOIN analysis a ON a.log_id = l.id WHERE l.timestamp >= ? "
+                    "AND l.admission IN ('direct', 'queued')", (since,)).fetchall()
+                seed = {m: [r[i] for r in rows if r[i] is not None]
+                        for i, m in enumerate(LATENCY)}
+        finally:
+            c.close()
+        return ratio, seed
+
+    async def save(self, alerts: list[Alert]) -> None:
+        ts = datetime.utcnow().isoformat()
+        await self.db.executemany(
+            """INSERT INTO alerts (timestamp, kind, metric, campus, education_level,
+                                   education_type, value, baseline, n, p_value, message)
+               VALUES (?,?,?,?,?,?,?,?,?,?,?)""",
+            [(ts, a.kind, a.metric, *a.segment, a.value, a.baseline, a.n, a.p_value,
+              a.message) for a in alerts])
+
+    async def run(self, notify: Optional[Callable[[str], Awaitable]] = None,
+                  interval: float = ANOMALY_CHECK_SEC) -> None:
+        """Раз в interval: обновить базу 👎, проверить окна, записать тревоги."""
+        while True:
+            try:
+                ratio, seed = await asyncio.to_thread(self._read_baseline)
+                if ratio is not None:
+                    self.dislike_base = ratio
+                now = time.time()
+                for metric, values in seed.items():   # база задержек после перезапуска
+                    digest = self.base[metric].at(now)
+                    for v in values:
+                        digest.add(v)
+                alerts = self.check()
+                if alerts:
+                    await self.save(alerts)
+                for a in alerts:
+                    logger.warning(f"Anomaly: {a.message}")
+                    if notify:
+                        await notify(f"⚠️ {a.message}")
+            except Exception as e:
+                logger.error(f"Anomaly check error: {e}")
+            await asyncio.sleep(interval)
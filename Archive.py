@@ -0,0 +1,213 @@
+# Archive.py  ──────────────────────────────────────────────────────────
+# Холодное хранение: диалоги (logs + analysis) старше ARCHIVE_AFTER_DAYS
+# переезжают из bot_logs.db в Parquet (zstd), разбитый по дням:
+#
+#   ARCHIVE_DIR/dialogs/date=YYYY-MM-DD/part-<первый id>-<последний id>.parquet
+#
+# Одна строка архива — строка logs с колонками её analysis. Перенос идёт
+# порциями по id: в одной транзакции BEGIN IMMEDIATE порция читается,
+# файл пишется во временный и переименовывается, строки удаляются, COMMIT.
+# Бот в это время пишет как обычно — его транзакции ждут (busy_timeout)
+# только одну порцию, а между порциями перенос уступает запись на
+# ARCHIVE_PAUSE_MS (иначе писатель бота, опрашивающий блокировку с
+# паузами, может раз за разом её не застать). Если COMMIT не прошёл,
+# файл удаляется; если процесс
+# упал между переименованием и COMMIT, следующий запуск удалит файлы, чьи
+# строки остались в базе. Графики не меняются: rollup при удалении не
+# вычитается, а Rollup.rebuild() дочитывает архив; полнотекстовый индекс
+# (Search.py) ищет только в базе.
+#
+# Dashboard читает архив через read(): нужные колонки и только каталоги
+# дней, попавших в период, — когда период уходит раньше первой строки logs.
+#
+#   python Archive.py [--db bot_logs.db] [--days 90] [--batch 500]
+#   python Archive.py --dry-run        # только посчитать, сколько строк старше
+import os, time, argparse, sqlite3
+from datetime import datetime, timedelta
+from typing import Optional, Sequence
+
+from dotenv import load_dotenv
+
+from Db import DB_PATH, connect, init_schema
+
+load_dotenv()
+
+ARCHIVE_DIR        = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(DB_PATH), "archive"))
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_BATCH      = int(os.getenv("ARCHIVE_BATCH", "500"))      # строк на транзакцию
+ARCHIVE_PAUSE_MS   = float(os.getenv("ARCHIVE_PAUSE_MS", "100"))  # пауза между порциями
+
+_TYPES = {"INTEGER": "int64", "REAL": "float64", "TEXT": "string"}
+
+
+def _columns(c: sqlite3.Connection) -> dict[str, str]:
+    """Колонки строки архива → тип Arrow; по текущей схеме базы, поэтому
+    колонки, добавленные позже, в старых файлах читаются как NULL."""
+    cols = {}
+    for table, skip in (("logs", ()), ("analysis", ("log_id",))):
+        for _, name, decl, *_ in c.execute(f"PRAGMA table_info({table})"):
+            if name not in skip:
+                cols[name] = _TYPES.get(decl.upper(), "string")
+    return cols
+
+
+def _schema(c: sqlite3.Connection):
+    import pyarrow as pa
+    return pa.schema([(n, getattr(pa, t)()) for n, t in _columns(c).items()])
+
+
+def _dir(root: str) -> str:
+    return os.path.join(root, "dialogs")
+
+
+# ── перенос ────────────────────────────────────────────────────
+def _write(rows: list[tuple], schema, root: str) -> list[str]:
+    """Порция → по файлу на день; возвращает пути готовых файлов."""
+    import pyarrow as pa, pyarrow.parquet as pq
+    by_day: dict[str, list[tuple]] = {}
+    ts = schema.get_field_index("timestamp")
+    for r in rows:
+        by_day.setdefault((r[ts] or "")[:10] or "unknown", []).append(r)
+    paths = []
+    try:
+        for day, part in by_day.items():
+            folder = os.path.join(_dir(root), f"date={day}")
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, f"part-{part[0][0]}-{part[-1][0]}.parquet")
+            table = pa.Table.from_arrays(
+                [pa.array([r[i] for r in part], type=f.type) for i, f in enumerate(schema)],
+                schema=schema)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                pq.write_table(table, f, compression="zstd")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+            paths.append(path)
+    except Exception:
+        for p in paths:
+            os.remove(p)
+        raise
+    return paths
+
+
+def cleanup(c: sqlite3.Connection, root: str = ARCHIVE_DIR) -> int:
+    """Удаляет файлы прерванных порций: их строки так и остались в logs."""
+    removed = 0
+    for folder, _, files in os.walk(_dir(root)):
+        for name in files:
+            path = os.path.join(folder, name)
+            if name.endswith(".tmp"):
+                os.remove(path); removed += 1
+            elif name.startswith("part-"):
+                first = int(name.split("-")[1])
+                if c.execute("SELECT 1 FROM logs WHERE id = ?", (first,)).fetchone():
+                    os.remove(path); removed += 1
+    return removed
+
+
+def archive(c: sqlite3.Connection, cutoff: str, root: str = ARCHIVE_DIR,
+            batch: int = ARCHIVE_BATCH, pause: float = ARCHIVE_PAUSE_MS / 1000,
+            progress=None) -> int:
+    """Переносит строки с timestamp < cutoff; c — с isolation_level=None."""
+    import pyarrow.parquet    # импорт — до первой блокировки, не внутри неё
+    schema = _schema(c)
+    logs = {r[1] for r in c.execute("PRAGMA table_info(logs)")}
+    cols = ", ".join(f"l.{n}" if n in logs else f"a.{n}" for n in schema.names)
+    done = 0
+    while True:
+        c.execute("BEGIN IMMEDIATE")
+        paths = []
+        try:
+            rows = c.execute(f"SELECT {cols} FROM logs l LEFT JOIN analysis a ON a.log_id = l.id "
+                             f"WHERE l.timestamp < ? ORDER BY l.id LIMIT ?",
+                             (cutoff, batch)).fetchall()
+            if not rows:
+                c.execute("ROLLBACK")
+                return done
+            paths = _write(rows, schema, root)
+            ids = [(r[0],) for r in rows]
+            c.executemany("DELETE FROM analysis WHERE log_id = ?", ids)
+            c.executemany("DELETE FROM logs WHERE id = ?", ids)
+            c.execute("COMMIT")
+        except BaseException:
+            if c.in_transaction:
+                c.execute("ROLLBACK")
+            for p in paths:
+                os.remove(p)
+            raise
+        done += len(rows)
+        if progress:
+            progress(done)
+        time.sleep(pause)
+
+
+# ── чтение (Dashboard) ─────────────────────────────────────────
+def hot_start(c: sqlite3.Connection) -> Optional[str]:
+    """Время первой строки в базе: всё раньше — только в архиве."""
+    row = c.execute("SELECT timestamp FROM logs ORDER BY id LIMIT 1").fetchone()
+    return row[0] if row else None
+
+
+def read(c: sqlite3.Connection, since: Optional[str] = None, until: Optional[str] = None,
+         columns: Optional[Sequence[str]] = None, *, ids: Optional[Sequence[int]] = None,
+         root: str = ARCHIVE_DIR):
+    """Строки архива за [since, until) (и/или с id из ids) — DataFrame только
+    с колонками columns; читаются только каталоги нужных дней. None — архива нет."""
+    if not os.path.isdir(_dir(root)):
+        return None
+    import pyarrow as pa, pyarrow.dataset as ds
+    schema = _schema(c)
+    data = ds.dataset(_dir(root), format="parquet",
+                      schema=schema.append(pa.field("date", pa.string())),
+                      partitioning=ds.partitioning(pa.schema([("date", pa.string())]),
+                                                   flavor="hive"))
+    cond = []
+    if since:
+        cond += [ds.field("date") >= since[:10], ds.field("timestamp") >= since]
+    if until:
+        cond += [ds.field("date") <= until[:10], ds.field("timestamp") < until]
+    if ids is not None:
+        ids = [int(i) for i in ids]
+        if not ids:
+            return None
+        # диапазон — по статистике групп строк, isin — точный отбор
+        cond += [ds.field("id") >= min(ids), ds.field("id") <= max(ids),
+                 ds.field("id").isin(ids)]
+    flt = None
+    for e in cond:
+        flt = e if flt is None else flt & e
+    return data.to_table(columns=list(columns) if columns else schema.names,
+                         filter=flt).to_pandas()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Перенос старых диалогов в Parquet")
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--dir", default=ARCHIVE_DIR, help="каталог архива")
+    ap.add_argument("--days", type=float, default=ARCHIVE_AFTER_DAYS,
+                    help="переносить диалоги старше стольких дней (целыми днями)")
+    ap.add_argument("--batch", type=int, default=ARCHIVE_BATCH, help="строк на транзакцию")
+    ap.add_argument("--pause", type=float, default=ARCHIVE_PAUSE_MS,
+                    help="мс между порциями — окно для записей бота")
+    ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--vacuum", action="store_true",
+                    help="после переноса сжать файл базы (на время VACUUM запись ждёт)")
+    args = ap.parse_args()
+
+    init_schema(args.db)
+    conn = connect(args.db, isolation_level=None)        # транзакции — вручную
+    cutoff = (datetime.utcnow() - timedelta(days=args.days)).date().isoformat()
+    total = conn.execute("SELECT COUNT(*) FROM logs WHERE timestamp < ?", (cutoff,)).fetchone()[0]
+    print(f"Диалогов до {cutoff}: {total}")
+    if args.dry_run or not total:
+        raise SystemExit
+    if n := cleanup(conn, args.dir):
+        print(f"Удалено файлов прерванного запуска: {n}")
+    t0 = time.perf_counter()
+    moved = archive(conn, cutoff, args.dir, args.batch, args.pause / 1000,
+                    progress=lambda d: print(f"\r{d}/{total}", end="", flush=True))
+    print(f"\nПеренесено: {moved} за {time.perf_counter() - t0:.1f} с → {args.dir}")
+    if args.vacuum:
+        conn.execute("VACUUM")
+        print(f"Размер базы: {os.path.getsize(args.db) / 2**20:.1f} МБ")
@@ -0,0 +1,99 @@
+# Backfill.py  ─────────────────────────────────────────────────────────
+# Пересчёт analysis для старых логов после изменения Analysis.analyse.
+# Пересчитываются только строки, у которых analysis_version меньше
+# Analysis.ANALYSIS_VERSION (или анализа нет вовсе). logs читается
+# порциями по id (keyset), порции считаются в пуле процессов на всех
+# ядрах, результаты пишутся executemany — одна транзакция на порцию.
+# Прерванный запуск можно просто повторить: сделанные порции уже
+# помечены новой версией и второй раз не считаются.
+#
+#   python Backfill.py [--db bot_logs.db] [--chunk 500] [--processes 8]
+#   python Backfill.py --dry-run        # только посчитать, сколько строк устарело
+import os, sys, time, argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterator
+
+import Analysis
+from Db import DB_PATH, connect, init_schema
+
+_STALE = """
+    SELECT l.id, l.question, l.answer, a.response_time
+    FROM logs l LEFT JOIN analysis a ON a.log_id = l.id
+    WHERE l.id > ? AND (a.analysis_version IS NULL OR a.analysis_version < ?)
+    ORDER BY l.id LIMIT ?
+"""
+
+
+def count_stale(conn, version: int) -> int:
+    return conn.execute(
+        "SELECT COUNT(*) FROM logs l LEFT JOIN analysis a ON a.log_id = l.id "
+        "WHERE a.analysis_version IS NULL OR a.analysis_version < ?", (version,)).fetchone()[0]
+
+
+def chunks(conn, version: int, size: int) -> Iterator[list[tuple]]:
+    last = 0
+    while True:
+        rows = conn.execute(_STALE, (last, version, size)).fetchall()
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield rows
+
+
+def analyse_chunk(rows: list[tuple]) -> list[tuple[int, dict]]:
+    """Выполняется в процессе пула."""
+    metrics = Analysis.analyse_many([(q, a, rt) for _, q, a, rt in rows])
+    return [(row[0], m) for row, m in zip(rows, metrics)]
+
+
+def run(args) -> None:
+    init_schema(args.db)          # analysis_version — если бот ещё не обновлялся
+    conn = connect(args.db)
+    version = Analysis.ANALYSIS_VERSION
+    total = count_stale(conn, version)
+    print(f"Устаревших строк: {total} (версия анализа {version})")
+    if args.dry_run or not total:
+        return
+
+    done, t0 = 0, time.perf_counter()
+
+    def write(results: list[tuple[int, dict]]) -> None:
+        nonlocal done
+        with conn:                                  # одна транзакция на порцию
+            Analysis.save_many(conn, results)
+        done += len(results)
+        rate = done / (time.perf_counter() - t0)
+        eta = (total - done) / rate if rate else 0
+        sys.stderr.write(f"\r{done}/{total} ({done / total:.1%})  "
+                         f"{rate:,.0f} строк/с  осталось ~{eta:,.0f} с   ")
+        sys.stderr.flush()
+
+    # в полёте не больше 2 порций на процесс — память не растёт с размером logs
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        pending = set()
+        try:
+            for rows in chunks(conn, version, args.chunk):
+                pending.add(pool.submit(analyse_chunk, rows))
+                if len(pending) >= args.processes * 2:
+                    ready, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in ready:
+                        write(f.result())
+            for f in pending:
+                write(f.result())
+        except KeyboardInterrupt:
+            for f in pending:
+                f.cancel()
+            print(f"\nПрервано: пересчитано {done}, повторный запуск продолжит")
+            return
+
+    elapsed = time.perf_counter() - t0
+    print(f"\nГотово: {done} строк за {elapsed:.1f} с → {done / elapsed:,.0f} строк/с")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Пересчёт analysis для старых логов")
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--chunk", type=int, default=500, help="строк в порции")
+    ap.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--dry-run", action="store_true")
+    run(ap.parse_args())
@@ -0,0 +1,730 @@
+# Bench.py  ────────────────────────────────────────────────────────────
+# Замеры горячих участков бота.
+#
+# suite — набор микробенчмарков: этапы ask_gpt (профиль, ключ и поиск в
+# кэше, вызов LLM обычный и потоковый — против FakeLLM в этом же процессе,
+# запись в БД, confirm_kb), Analysis.analyse / save / save_many и
+# Dashboard.load на синтетической bot_logs.db нужных размеров. Печатает
+# перцентили и память, сохраняет JSON; compare сравнивает два прогона.
+#
+#   python Bench.py suite --sizes 1000,10000,100000 [--out bench_results/abc123.json]
+#   python Bench.py compare bench_results/old.json bench_results/new.json
+#   python Bench.py history --sizes 20000,100000,500000 --per-day 2000
+#   python Bench.py memory --size 100000 --sessions 10
+#
+# Остальные команды — отдельные сравнения «было / стало» на реальных
+# ответах из bot_logs.db (или на встроенных примерах, если база пуста):
+#
+#   python Bench.py grammar --limit 200 --batch 20
+#   python Bench.py rules   --limit 5000
+#   python Bench.py sentiment-sample --n 300     # ответы из bot_logs.db на разметку
+#   python Bench.py sentiment --limit 5000
+#   python Bench.py knowledge --limit 1000 --copies 1,10,100
+import os, re, csv, json, time, random, asyncio, sqlite3, argparse, platform
+import resource, statistics, subprocess, tracemalloc
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+import Grammar
+import Rules
+import Sentiment
+from Db import DB_PATH, connect, init_schema
+
+SAMPLES = [
+    "Сессия начинается 10 января. Расписание экзаменов публикуется в LMS за две недели.",
+    "Для академического отпуска подайте заявление в учебный офис. Deadline — 1 марта.",
+    "Стипендия начисляется до 25 числа. If you are an international student, contact the office.",
+    "Пересдачи проходят в феврале; точные даты смотрите на сайте факультета.",
+]
+
+
+def load_answers(limit: int) -> list[str]:
+    try:
+        with sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True) as conn:
+            rows = conn.execute("SELECT answer FROM logs WHERE answer IS NOT NULL "
+                                "ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        texts = [r[0] for r in rows if r[0]]
+    except sqlite3.Error:
+        texts = []
+    return texts or (SAMPLES * (limit // len(SAMPLES) + 1))[:limit]
+
+
+def report(name: str, times: list[float], n: int) -> None:
+    """times — длительность каждого вызова; n — сколько ответов обработано."""
+    total = sum(times)
+    per = [t * 1000 for t in times]
+    q = statistics.quantiles(per, n=100) if len(per) > 1 else per * 99
+    print(f"{name:<28} {total:7.2f} с  {n / total:7.1f} отв/с  "
+          f"p50 {q[49]:7.1f} мс  p95 {q[94]:7.1f} мс (на вызов)")
+
+
+# ── grammar ────────────────────────────────────────────────────
+def bench_grammar(args) -> None:
+    Grammar.GRAMMAR_MODE = "on"
+    texts = load_answers(args.limit)
+    ru, en = Grammar.pool("ru"), Grammar.pool("en")
+    ru.check("Прогрев."), en.check("Warm up.")       # запуск LanguageTool не считаем
+
+    old_t, old_n = [], []
+    for t in texts:                                   # как было: весь текст дважды
+        t0 = time.perf_counter()
+        old_n.append(len(ru.check(t)) + len(en.check(t)))
+        old_t.append(time.perf_counter() - t0)
+
+    new_t, new_n = [], []
+    for t in texts:
+        t0 = time.perf_counter()
+        new_n.append(Grammar.count_errors(t))
+        new_t.append(time.perf_counter() - t0)
+
+    batch_t, batch_n = [], []
+    for k in range(0, len(texts), args.batch):
+        chunk = texts[k:k + args.batch]
+        t0 = time.perf_counter()
+        batch_n.extend(Grammar.count_errors_many(chunk))
+        batch_t.append(time.perf_counter() - t0)
+
+    print(f"Ответов: {len(texts)}, пул: {Grammar.GRAMMAR_POOL_SIZE} на язык")
+    report("ru+en целиком (было)", old_t, len(texts))
+    report("по языку фрагмента", new_t, len(texts))
+    report(f"пачками по {args.batch}", batch_t, len(texts))
+    print(f"Ошибок найдено: было {sum(old_n)}, по языку {sum(new_n)}, пачками {sum(batch_n)}")
+
+
+# ── rules ──────────────────────────────────────────────────────
+def _legacy_rules(text: str, families: dict[str, list[str]]) -> dict[str, int]:
+    """Как Analysis считал раньше: re.search по шаблонам каждого семейства,
+    хеджи — text.lower().count() на каждое слово."""
+    out = {}
+    for family, patterns in families.items():
+        if family == "hedge":
+            out[family] = sum(text.lower().count(w) for w in patterns)
+        else:
+            out[family] = int(any(re.search(p, text, re.I) for p in patterns))
+    return out
+
+
+def bench_rules(args) -> None:
+    texts = load_answers(args.limit)
+    engine = Rules.current()
+    families = engine.rules
+    chars = sum(len(t) for t in texts)
+
+    for name, fn in (("по семействам (было)", lambda t: _legacy_rules(t, families)),
+                     ("один проход Rules", engine.scan)):
+        times = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            for t in texts:
+                fn(t)
+            times.append(time.perf_counter() - t0)
+        best = min(times)
+        print(f"{name:<28} {best * 1000:8.1f} мс  {len(texts) / best:9.0f} отв/с  "
+              f"{chars / best / 1e6:6.2f} МБ/с")
+
+    diff = 0
+    for t in texts:
+        old, new = _legacy_rules(t, families), engine.counts(t)
+        diff += any(bool(old[f]) != bool(new[f]) for f in families if f != "hedge")
+    print(f"Ответов: {len(texts)}; флаги разошлись у {diff}")
+
+
+# ── sentiment ──────────────────────────────────────────────────
+# sentiment_eval.tsv — настоящие ответы бота (sentiment-sample), размеченные
+# человеком, который оценок словаря не видел: по нему считается точность.
+# sentiment_cases.tsv — контрольные примеры, написанные вместе со словарём:
+# они ловят поломки, но точности не показывают.
+SENTIMENT_EVAL = "sentiment_eval.tsv"
+SENTIMENT_CASES = "sentiment_cases.tsv"
+LABELS = ("pos", "neu", "neg")
+
+
+def _label(x: float) -> str:
+    return "pos" if x > 0 else "neg" if x < 0 else "neu"
+
+
+def _kappa(a: list[str], b: list[str]) -> float:
+    """Каппа Коэна: согласие двух разметок сверх случайного."""
+    n = len(a)
+    po = sum(x == y for x, y in zip(a, b)) / n
+    pe = sum(a.count(l) * b.count(l) for l in LABELS) / n ** 2
+    return (po - pe) / (1 - pe) if pe < 1 else 1.0
+
+
+def bench_sentiment_sample(args) -> None:
+    """Случайные ответы из bot_logs.db → TSV с пустой колонкой label.
+    Оценки словаря в файл не пишутся, чтобы не подсказывать разметчику."""
+    with sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True) as conn:
+        rows = conn.execute("SELECT id, answer FROM logs WHERE answer IS NOT NULL AND answer != '' "
+                            "ORDER BY random() LIMIT ?", (args.n,)).fetchall()
+    with open(args.out, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f, delimiter="\t")
+        w.writerow(["label", "log_id", "text"])
+        for log_id, answer in rows:
+            w.writerow(["", log_id, " ".join(answer.split())])
+    print(f"{len(rows)} ответов → {args.out}; заполните label (pos / neu / neg) "
+          f"и запустите: python Bench.py sentiment --eval {args.out}")
+
+
+def _evaluate(path: str, backends: list[str]) -> None:
+    with open(path, encoding="utf-8") as f:
+        rows = [r for r in csv.DictReader(f, delimiter="\t") if r["label"] in LABELS]
+    if not rows:
+        print(f"  в {path} нет размеченных строк")
+        return
+    gold = [r["label"] for r in rows]
+    texts = [r["text"] for r in rows]
+    print(f"  ответов: {len(rows)} (pos {gold.count('pos')}, neu {gold.count('neu')}, "
+          f"neg {gold.count('neg')})")
+    preds = {}
+    for backend in backends:
+        pred = preds[backend] = [_label(x) for x in Sentiment.score_many(texts, backend)]
+        ok = sum(p == g for p, g in zip(pred, gold))
+        print(f"  {backend:<10} точность {ok / len(rows):.0%}, κ {_kappa(pred, gold):+.2f}, "
+              f"«нейтрал» у {pred.count('neu') / len(rows):.0%}")
+    if len(preds) == 2:
+        a, b = preds.values()
+        print(f"  lexicon ↔ textblob: совпали {sum(x == y for x, y in zip(a, b)) / len(a):.0%}, "
+              f"κ {_kappa(a, b):+.2f}")
+
+
+def bench_sentiment(args) -> None:
+    backends = ["lexicon"] + (["textblob"] if args.textblob else [])
+    if os.path.exists(args.eval):
+        print(f"Разметка по ответам бота {args.eval}:")
+        _evaluate(args.eval, backends)
+    else:
+        print(f"{args.eval} нет — точность не посчитать. Наберите ответы: "
+              f"python Bench.py sentiment-sample --out {args.eval} и разметьте их")
+    print(f"Контрольные примеры {SENTIMENT_CASES} (писались вместе со словарём — не точность):")
+    _evaluate(SENTIMENT_CASES, backends)
+
+    corpus = load_answers(args.limit)
+    print(f"Скорость на {len(corpus)} ответах:")
+    t0 = time.perf_counter()
+    for t in corpus:
+        Sentiment.score(t, "lexicon")
+    one = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for k in range(0, len(corpus), args.batch):
+        Sentiment.score_many(corpus[k:k + args.batch], "lexicon")
+    batch = time.perf_counter() - t0
+    print(f"  {'lexicon по одному':<24} {len(corpus) / one:9.0f} отв/с")
+    print(f"  {f'lexicon пачками по {args.batch}':<24} {len(corpus) / batch:9.0f} отв/с")
+    if args.textblob:
+        t0 = time.perf_counter()
+        Sentiment.score_many(corpus, "textblob")
+        print(f"  {'textblob (было)':<24} {len(corpus) / (time.perf_counter() - t0):9.0f} отв/с")
+
+
+# ── suite: измерение ───────────────────────────────────────────
+def summary(times: list[float]) -> dict:
+    ms = sorted(t * 1000 for t in times)
+    q = statistics.quantiles(ms, n=100, method="inclusive") if len(ms) > 1 else ms * 99
+    return {"n": len(ms), "mean_ms": round(statistics.fmean(ms), 4),
+            "p50_ms": round(q[49], 4), "p95_ms": round(q[94], 4),
+            "p99_ms": round(q[98], 4), "max_ms": round(ms[-1], 4)}
+
+
+def measure(fn: Callable[[], object], n: int, warmup: int = 2) -> dict:
+    """Времена без tracemalloc (он замедляет), пик памяти — отдельным вызовом."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return summary(times) | {"peak_kb": round(peak / 1024, 1)}
+
+
+async def ameasure(fn: Callable[[], Awaitable[object]], n: int, warmup: int = 2) -> dict:
+    for _ in range(warmup):
+        await fn()
+    times = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        await fn()
+        times.append(time.perf_counter() - t0)
+    return summary(times)
+
+
+def rss_mb() -> float:
+    """Пиковый RSS процесса (ru_maxrss в Linux — КБ)."""
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# ── suite: синтетическая bot_logs.db ───────────────────────────
+CAMPUSES = ["Пермь", "Нижний Новгород", "Москва", "Санкт-Петербург"]
+LEVELS   = ["Бакалавр", "Специалитет", "Магистр", "Аспирант"]
+TYPES    = ["Очный", "Заочный"]
+QUESTIONS = [
+    "Когда начинается сессия?", "Как оформить академический отпуск?",
+    "Когда придёт стипендия?", "Где посмотреть расписание пересдач?",
+    "Как записаться на военную кафедру?", "Как перевестись на другую программу?",
+    "Где взять справку об обучении?", "Как сдать практику заочно?",
+]
+
+
+def make_db(path: str, rows: int, seed: int = 1, days: float = 30) -> None:
+    """bot_logs.db с rows ответами за days дней; повторный вызов дописывает недостающее."""
+    from Classifier import CATEGORIES
+    init_schema(path)
+    rnd = random.Random(seed)
+    c = connect(path)
+    have = c.execute("SELECT COUNT(*) FROM logs").fetchone()[0]
+    users = max(10, rows // 20)
+    if not have:
+        c.executemany(
+            "INSERT OR REPLACE INTO user_profiles VALUES (?,?,?,?)",
+            [(u, rnd.choice(CAMPUSES), rnd.choice(LEVELS), rnd.choice(TYPES))
+             for u in range(1, users + 1)])
+    start = datetime.utcnow() - timedelta(days=days)
+    step = days * 86400 / rows
+    for k in range(have, rows, 10_000):
+        ids = range(k + 1, min(rows, k + 10_000) + 1)
+        logs, analysis = [], []
+        for i in ids:
+            answer = " ".join(rnd.choices(SAMPLES, k=rnd.randint(1, 8)))
+            hit = rnd.random() < 0.2
+            tokens = (None, None, None, None, None) if hit else \
+                (600 + rnd.randint(0, 40), len(answer) // 3, 600 * rnd.randint(0, 1),
+                 "stop", 1024)
+            logs.append((i, (start + timedelta(seconds=i * step)).isoformat(),
+                         rnd.randint(1, users), f"user{i % users}",
+                         rnd.choice(QUESTIONS), answer,
+                         int(hit), 0.0, None, "cache" if hit else "direct", *tokens))
+            analysis.append((i, round(rnd.random(), 2), round(rnd.uniform(-1, 1), 3), 0,
+                             len(answer.split()), round(rnd.lognormvariate(1, 0.5), 3),
+                             int(rnd.random() < 0.3), int(rnd.random() < 0.02),
+                             round(rnd.uniform(0, 80), 1), rnd.randint(0, 5),
+                             rnd.randint(0, 20), 0, rnd.choice([None, None, 0, 1]),
+                             rnd.choice(CATEGORIES), "llm", 2))
+        c.executemany("""INSERT INTO logs (id, timestamp, user_id, username, question, answer,
+                         cache_hit, cache_saved, cache_key, admission,
+                         prompt_tokens, completion_tokens, cached_tokens, finish_reason, max_tokens)
+                         VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", logs)
+        c.executemany("""INSERT INTO analysis (log_id, confidence, sentiment, template_flag,
+                         word_count, response_time, reference_flag, refusal_flag, readability,
+                         grammar_errors, complex_words, question_repeat, user_feedback,
+                         category, category_source, analysis_version)
+                         VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", analysis)
+        c.commit()
+    c.close()
+
+
+# ── suite: группы замеров ──────────────────────────────────────
+def bench_static(args) -> dict:
+    """Не зависят от размера БД: analyse на коротком/длинном ответе, confirm_kb,
+    детектор аномалий (наблюдение и проверка окна с сутками базы)."""
+    import Analysis
+    from Anomaly import AnomalyDetector
+    from Keyboards import confirm_kb
+    short, long_ = SAMPLES[0], " ".join(SAMPLES * 6)
+    detector = AnomalyDetector(None)
+    now = time.time()
+    for i in range(20_000):             # сутки при ~14 ответах LLM в минуту
+        detector.observe_latency("response_time", random.lognormvariate(1, 0.5),
+                                 now - 86400 + i * 4.3)
+        detector.observe_vote(("Пермь", "Бакалавр", "Очный"), random.choice((1, -1)),
+                              now - 86400 + i * 4.3)
+    return {
+        "anomaly.observe": measure(
+            lambda: detector.observe_latency("response_time", 3.0), args.n * 10),
+        "anomaly.check": measure(lambda: detector.check(), max(5, args.n // 10)),
+        "analysis.analyse[short]": measure(lambda: Analysis.analyse("q", short, 1.0), args.n),
+        "analysis.analyse[long]": measure(lambda: Analysis.analyse("q", long_, 1.0), args.n),
+        "analysis.analyse_many[32]": measure(
+            lambda: Analysis.analyse_many([("q", short, 1.0)] * 32), max(5, args.n // 10)),
+        "keyboards.confirm_kb": measure(lambda: confirm_kb(123456), args.n * 10),
+    }
+
+
+def dashboard_page(conn: sqlite3.Connection, days: int = 7) -> None:
+    """Что читает один рендер Dashboard.py за последние days дней без фильтров."""
+    from DashboardData import (highlighted, load_frame, load_hist, load_rollup,
+                               search_page, texts, unique_users)
+    now = datetime.utcnow()
+    since = (now - timedelta(days=days - 1)).date().isoformat()
+    until = (now + timedelta(days=1)).date().isoformat()
+    for col in ("campus", "education_level", "education_type", "category"):
+        load_rollup(conn, "a", by=(col,), measures=("n",))
+    load_rollup(conn, "d", since, until)
+    load_rollup(conn, "d", since, until, by=("campus", "education_level", "education_type"),
+                measures=("n", "fb_neg"))
+    load_rollup(conn, "d", since, until, by=("category", "campus"))
+    load_rollup(conn, "m" if days <= 2 else "h", since, until, by=("bucket",),
+                measures=("n", "response_time_n", "response_time_sum"))
+    load_rollup(conn, "m", (now - timedelta(hours=1)).isoformat()[:16])
+    load_hist(conn, "word_count", since, until)
+    load_hist(conn, "grammar_errors", since, until)
+    unique_users(conn, (now - timedelta(hours=24)).isoformat())
+    frame = load_frame(conn, since, until)
+    frame.select(columns=("id", "timestamp", "category", "confidence", "sentiment",
+                          "refusal_flag"))
+    texts(conn, frame.select(limit=5).id)
+    texts(conn, frame.select(feedback=-1, limit=10).id)
+    highlighted(conn, "", search_page(conn, "", since, until, limit=11).id[:10])
+
+
+def bench_sized(args, path: str) -> dict:
+    """Зависят от размера: Dashboard.load и запись analysis."""
+    import Analysis
+    from DashboardData import (FrameLoader, highlighted, load_frame, load_logs, load_rollup,
+                               search_page)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    rows = conn.execute("SELECT COUNT(*) FROM logs").fetchone()[0]
+    m = Analysis.analyse("q", SAMPLES[0], 1.0)
+
+    def save():
+        Analysis.save(conn, random.randint(1, rows), m)
+
+    def save_many():
+        with conn:
+            Analysis.save_many(conn, [(random.randint(1, rows), m) for _ in range(100)])
+
+    week = (datetime.utcnow() - timedelta(days=7)).date().isoformat()
+    two_days = (datetime.utcnow() - timedelta(days=2)).date().isoformat()
+
+    loader = FrameLoader(path)
+
+    def feedback_and_frame():         # 5 оценок 👍/👎 между обновлениями страницы
+        with conn:
+            conn.executemany("UPDATE analysis SET user_feedback = ? WHERE log_id = ?",
+                             [(random.choice([0, 1]), random.randint(1, rows)) for _ in range(5)])
+        loader.load(week, None)
+
+    df = load_logs(conn)
+    out = {
+        "dashboard.load": measure(lambda: load_logs(conn), max(3, args.n // 20), warmup=1)
+                          | {"frame_mb": round(df.memory_usage(deep=True).sum() / 2**20, 2)},
+        "dashboard.page[7d]": measure(lambda: dashboard_page(conn), args.n // 20 or 1, warmup=1),
+        "dashboard.frame[7d]": measure(lambda: load_frame(conn, week, None), args.n // 10 or 1),
+        "dashboard.frame[7d, incremental idle]": measure(
+            lambda: loader.load(week, None), args.n // 10 or 1, warmup=1),
+        "dashboard.frame[7d, +5 feedback]": measure(feedback_and_frame, args.n // 10 or 1),
+        "dashboard.rollup[7d]": measure(
+            lambda: load_rollup(conn, "d", week, None), args.n // 10 or 1),
+        "dashboard.rollup[2d by minute]": measure(
+            lambda: load_rollup(conn, "m", two_days, None), args.n // 10 or 1),
+        "dashboard.search[7d]": measure(
+            lambda: highlighted(conn, "стипенд", search_page(conn, "стипенд", week, None,
+                                                             limit=21).id[:20]),
+            args.n // 10 or 1),
+        "dashboard.search[7d, rare filter]": measure(
+            lambda: search_page(conn, "стипенд", week, None, {"campus": ["Пермь"]},
+                                feedback=1, limit=21), args.n // 10 or 1),
+        "analysis.save": measure(save, args.n),
+        "analysis.save_many[100]": measure(save_many, max(5, args.n // 10)),
+    }
+    conn.close()
+    return out
+
+
+async def bench_stages(args, path: str) -> dict:
+    """Этапы ask_gpt по отдельности, LLM — FakeLLM на случайном порту."""
+    from aiohttp import web
+    import FakeLLM
+    from Cache import AnswerCache, make_key
+    from Db import Database
+    from Keyboards import confirm_kb
+    from Profiles import ProfileStore
+    from Transport import make_client, ResilientLLM
+
+    runner = web.AppRunner(FakeLLM.make_app(latency=args.llm_latency,
+                                            token_delay=args.token_delay))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    oai = make_client(api_key="bench", base_url=f"http://127.0.0.1:{port}")
+    llm = ResilientLLM()
+    with open("SYSTEM_PROMPT.txt", encoding="utf-8") as f:
+        prompt = f.read()
+    db = Database(path)
+    profiles = ProfileStore(db)
+    cache = AnswerCache(db, prompt)
+    users = db.fetchone("SELECT MAX(user_id) FROM user_profiles")[0] or 1
+    messages = [{"role": "system", "content": prompt},
+                {"role": "user", "content": QUESTIONS[0]}]
+
+    async def call():
+        r = await llm.call(lambda: oai.chat.completions.create(
+            model="deepseek-chat", messages=messages, max_tokens=1024, temperature=0.5))
+        return r.choices[0].message.content
+
+    ttft: list[float] = []
+
+    async def stream():
+        t0 = time.perf_counter()
+        s = await llm.call(lambda: oai.chat.completions.create(
+            model="deepseek-chat", messages=messages, max_tokens=1024,
+            temperature=0.5, stream=True))
+        first = None
+        async for chunk in s:
+            if first is None and chunk.choices and chunk.choices[0].delta.content:
+                first = time.perf_counter() - t0
+        ttft.append(first or 0.0)
+
+    def insert(c):
+        cur = c.execute("""INSERT INTO logs (timestamp, user_id, username, question, answer,
+                           cache_hit, cache_saved, cache_key, admission)
+                           VALUES (?,?,?,?,?,?,?,?,?)""",
+                        (datetime.utcnow().isoformat(), 1, "bench", QUESTIONS[0],
+                         SAMPLES[0], 0, 0.0, None, "direct"))
+        c.execute("INSERT INTO analysis (log_id, response_time, first_token_time) VALUES (?,?,?)",
+                  (cur.lastrowid, 1.0, 0.1))
+        return cur.lastrowid
+
+    async def db_insert():
+        await db.run(insert)
+
+    def cache_get():
+        p = profiles.get(random.randint(1, users))
+        cache.get(make_key(random.choice(QUESTIONS) + str(random.random()), *p))
+
+    try:
+        out = {
+            "stage.profile_get": measure(lambda: profiles.get(random.randint(1, users)), args.n * 10),
+            "stage.cache_key": measure(lambda: make_key(QUESTIONS[0], "Пермь", "Магистр", "Очный"),
+                                       args.n * 10),
+            "stage.cache_get_miss": measure(cache_get, args.n),
+            "stage.llm_call": await ameasure(call, args.n),
+            "stage.llm_stream_total": await ameasure(stream, args.n),
+            "stage.db_insert": await ameasure(db_insert, args.n),
+            "stage.confirm_kb": measure(lambda: confirm_kb(123456), args.n * 10),
+        }
+        out["stage.llm_stream_ttft"] = summary(ttft[-args.n:])
+    finally:
+        await oai.close()
+        db.close()
+        await runner.cleanup()
+    return out
+
+
+def bench_suite(args) -> None:
+    Grammar.GRAMMAR_MODE = "on" if args.grammar else "off"
+    os.makedirs(args.workdir, exist_ok=True)
+    sizes = [int(x) for x in args.sizes.split(",")]
+    result = {"commit": git_rev(), "time": datetime.utcnow().isoformat(timespec="seconds"),
+              "python": platform.python_version(), "grammar": args.grammar,
+              "llm_latency": args.llm_latency, "static": {}, "stages": {}, "sizes": {}}
+
+    result["static"] = bench_static(args)
+    for n in sizes:
+        path = os.path.join(args.workdir, f"bot_logs_{n}.db")
+        make_db(path, n)
+        result["sizes"][str(n)] = bench_sized(args, path)
+    result["stages"] = asyncio.run(bench_stages(args, os.path.join(args.workdir,
+                                                                   f"bot_logs_{sizes[0]}.db")))
+    result["rss_mb"] = rss_mb()
+
+    def show(title: str, group: dict) -> None:
+        print(title)
+        for name, r in group.items():
+            extra = "".join(f"  {k} {r[k]}" for k in ("peak_kb", "frame_mb") if k in r)
+            print(f"  {name:<28} p50 {r['p50_ms']:9.3f}  p95 {r['p95_ms']:9.3f}  "
+                  f"p99 {r['p99_ms']:9.3f} мс{extra}")
+
+    show("Без БД:", result["static"])
+    show(f"Этапы ask_gpt (БД {sizes[0]} строк, LLM {args.llm_latency} с):", result["stages"])
+    for n, group in result["sizes"].items():
+        show(f"БД {n} строк:", group)
+    print(f"Пиковый RSS: {result['rss_mb']} МБ")
+
+    out = args.out or os.path.join("bench_results", f"{result['commit']}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=1)
+    print(f"Сохранено: {out}")
+
+
+def bench_history(args) -> None:
+    """Рост истории при постоянном потоке вопросов: полная загрузка растёт
+    с размером БД, рендер страницы за 7 дней должен оставаться на месте."""
+    from DashboardData import load_logs
+    os.makedirs(args.workdir, exist_ok=True)
+    print(f"{'строк':>9} {'дней':>6}  {'полная загрузка, мс':>20}  {'страница 7 дн., мс':>19}")
+    for n in (int(x) for x in args.sizes.split(",")):
+        days = n / args.per_day
+        path = os.path.join(args.workdir, f"bot_logs_history_{n}_{args.per_day}.db")
+        make_db(path, n, days=days)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        page = measure(lambda: dashboard_page(conn), args.n, warmup=1)
+        full = measure(lambda: load_logs(conn), 3, warmup=0)["p50_ms"] \
+            if n <= args.full_max else float("nan")
+        conn.close()
+        print(f"{n:>9} {days:>6.0f}  {full:>20.1f}  {page['p50_ms']:>19.1f}")
+
+
+def _mb(df) -> float:
+    return df.memory_usage(deep=True).sum() / 2**20
+
+
+def bench_memory(args) -> None:
+    """Память Dashboard на сессию: полная загрузка (каждая сессия — своя
+    копия из st.cache_data), строки периода с текстом (тоже копия на
+    сессию) и общий DialogFrame (один на все сессии) + срезы и текст
+    только показываемых строк."""
+    from DashboardData import dialogs, load_frame, load_logs, texts
+    os.makedirs(args.workdir, exist_ok=True)
+    path = os.path.join(args.workdir, f"bot_logs_{args.size}.db")
+    make_db(path, args.size)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    now = datetime.utcnow()
+    since = (now - timedelta(days=args.days - 1)).date().isoformat()
+    until = (now + timedelta(days=1)).date().isoformat()
+    scatter = ("id", "timestamp", "category", "confidence", "sentiment", "refusal_flag")
+
+    full = _mb(load_logs(conn))
+    rows = (_mb(dialogs(conn, since, until))
+            + _mb(dialogs(conn, since, until, columns=("timestamp", "question", "answer",
+                                                       "confidence", "sentiment",
+                                                       "refusal_flag"))))
+    frame = load_frame(conn, since, until)
+    shared = _mb(frame.df)
+    own = (_mb(frame.select(columns=scatter))
+           + _mb(texts(conn, frame.select(limit=5).id))
+           + _mb(texts(conn, frame.select(feedback=-1, limit=10).id)))
+    shared += sum(m.nbytes for m in frame._masks.values()) / 2**20
+    conn.close()
+
+    k = args.sessions
+    print(f"{args.size} строк, период {args.days} дн. ({len(frame)} строк), сессий: {k}")
+    print(f"{'':<34} {'на сессию, МБ':>14} {f'всего на {k}, МБ':>17}")
+    for name, per, total in (("полная загрузка (load_logs)", full, full * k),
+                             ("строки периода с текстом", rows, rows * k),
+                             ("DialogFrame + срезы", shared / k + own, shared + own * k)):
+        print(f"{name:<34} {per:>14.2f} {total:>17.2f}")
+
+
+# ── knowledge ──────────────────────────────────────────────────
+def bench_knowledge(args) -> None:
+    """Справка кусками против всей базы в промпте: токены на вопрос, время
+    поиска, построение индекса и переиндексация одного файла — на базе
+    KNOWLEDGE_DIR, размноженной в copies раз (рост базы)."""
+    import shutil
+    from Knowledge import KNOWLEDGE_DIR, KnowledgeBase
+    try:
+        with sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True) as conn:
+            rows = conn.execute("SELECT question FROM logs WHERE question IS NOT NULL "
+                                "ORDER BY id DESC LIMIT ?", (args.limit,)).fetchall()
+        questions = [r[0] for r in rows if r[0]]
+    except sqlite3.Error:
+        questions = []
+    questions = questions or (QUESTIONS * (args.limit // len(QUESTIONS) + 1))[:args.limit]
+    files = [f for f in sorted(os.listdir(KNOWLEDGE_DIR)) if f.endswith((".md", ".txt"))]
+    print(f"Вопросов: {len(questions)}, файлов в {KNOWLEDGE_DIR}: {len(files)}")
+    print(f"{'копий':>6} {'кусков':>7} {'индекс, мс':>11} {'1 файл, мс':>11} "
+          f"{'вся база, ток.':>15} {'справка, ток.':>14} {'экономия':>9} "
+          f"{'поиск p50 / p95, мс':>20}")
+    for copies in (int(c) for c in args.copies.split(",")):
+        folder = os.path.join(args.workdir, f"knowledge_{copies}")
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+        for i in range(copies):
+            for f in files:
+                shutil.copy(os.path.join(KNOWLEDGE_DIR, f), os.path.join(folder, f"{i}_{f}"))
+        t0 = time.perf_counter()
+        kb = KnowledgeBase(folder)
+        build = time.perf_counter() - t0
+        touched = os.path.join(folder, f"0_{files[0]}")
+        with open(touched, "a", encoding="utf-8") as f:
+            f.write("\n")
+        t0 = time.perf_counter()
+        kb.refresh(force=True)
+        one = time.perf_counter() - t0
+        found = [kb.search(q) for q in questions]
+        per = sorted(r.seconds * 1000 for r in found)
+        q = statistics.quantiles(per, n=100) if len(per) > 1 else per * 99
+        sent = statistics.mean(r.tokens for r in found)
+        print(f"{copies:>6} {len(kb.chunks):>7} {build * 1000:>11.1f} {one * 1000:>11.1f} "
+              f"{kb.full_tokens:>15} {sent:>14.0f} {1 - sent / max(1, kb.full_tokens):>9.0%} "
+              f"{q[49]:>9.2f} / {q[94]:<8.2f}")
+
+
+def _flatten(result: dict) -> dict[str, dict]:
+    flat = {f"static/{k}": v for k, v in result.get("static", {}).items()}
+    flat |= {f"stages/{k}": v for k, v in result.get("stages", {}).items()}
+    for n, group in result.get("sizes", {}).items():
+        flat |= {f"{n}/{k}": v for k, v in group.items()}
+    return flat
+
+
+def bench_compare(args) -> None:
+    with open(args.old, encoding="utf-8") as f:
+        old = _flatten(json.load(f))
+    with open(args.new, encoding="utf-8") as f:
+        new = _flatten(json.load(f))
+    worse = 0
+    for name in sorted(old.keys() & new.keys()):
+        a, b = old[name]["p50_ms"], new[name]["p50_ms"]
+        change = (b - a) / a if a else 0.0
+        mark = "  ▲ хуже" if change > args.threshold else "  ▼ лучше" if change < -args.threshold else ""
+        worse += change > args.threshold
+        print(f"{name:<40} {a:10.3f} → {b:10.3f} мс  {change:+7.1%}{mark}")
+    print(f"Регрессий (p50 хуже на >{args.threshold:.0%}): {worse}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Замеры горячих участков бота")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("grammar", help="проверка грамматики: было / по языку / пачками")
+    p.add_argument("--limit", type=int, default=200)
+    p.add_argument("--batch", type=int, default=20)
+    p = sub.add_parser("rules", help="шаблоны/отказы/хеджи: по семействам / один проход")
+    p.add_argument("--limit", type=int, default=5000)
+    p.add_argument("--repeat", type=int, default=5)
+    p = sub.add_parser("sentiment-sample", help="тональность: ответы из bot_logs.db на разметку")
+    p.add_argument("--n", type=int, default=300)
+    p.add_argument("--out", default=SENTIMENT_EVAL)
+    p = sub.add_parser("sentiment", help="тональность: точность на размеченном наборе и скорость")
+    p.add_argument("--eval", default=SENTIMENT_EVAL)
+    p.add_argument("--limit", type=int, default=5000)
+    p.add_argument("--batch", type=int, default=500)
+    p.add_argument("--textblob", action="store_true", help="сравнить с прежним TextBlob")
+    p = sub.add_parser("suite", help="микробенчмарки горячих участков, JSON с результатами")
+    p.add_argument("--sizes", default="1000,10000,100000", help="строк в синтетической БД")
+    p.add_argument("--n", type=int, default=200, help="повторов на замер")
+    p.add_argument("--workdir", default=".bench", help="где хранить синтетические БД")
+    p.add_argument("--out", default=None, help="по умолчанию bench_results/<commit>.json")
+    p.add_argument("--llm-latency", type=float, default=0.0)
+    p.add_argument("--token-delay", type=float, default=0.0)
+    p.add_argument("--grammar", action="store_true", help="с LanguageTool (нужна Java)")
+    p = sub.add_parser("history", help="Dashboard: время загрузки при росте истории")
+    p.add_argument("--sizes", default="20000,100000,500000", help="строк в синтетической БД")
+    p.add_argument("--per-day", type=int, default=2000, help="вопросов в день")
+    p.add_argument("--n", type=int, default=10, help="повторов на замер")
+    p.add_argument("--full-max", type=int, default=200000,
+                   help="полную загрузку мерить только до стольких строк")
+    p.add_argument("--workdir", default=".bench", help="где хранить синтетические БД")
+    p = sub.add_parser("memory", help="Dashboard: память на сессию, было / стало")
+    p.add_argument("--size", type=int, default=100000, help="строк в синтетической БД")
+    p.add_argument("--days", type=int, default=7, help="период на странице")
+    p.add_argument("--sessions", type=int, default=10, help="открытых вкладок")
+    p.add_argument("--workdir", default=".bench", help="где хранить синтетические БД")
+    p = sub.add_parser("knowledge", help="база знаний: токены справки и время поиска")
+    p.add_argument("--limit", type=int, default=1000, help="вопросов из bot_logs.db")
+    p.add_argument("--copies", default="1,10,100", help="во сколько раз размножить базу")
+    p.add_argument("--workdir", default=".bench", help="где хранить копии базы")
+    p = sub.add_parser("compare", help="сравнить два JSON-прогона suite")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=0.10)
+    args = ap.parse_args()
+    {"grammar": bench_grammar, "rules": bench_rules, "sentiment": bench_sentiment,
+     "sentiment-sample": bench_sentiment_sample,
+     "suite": bench_suite, "history": bench_history, "memory": bench_memory,
+     "knowledge": bench_knowledge, "compare": bench_compare}[args.cmd](args)
@@ -0,0 +1,130 @@
+# Cache.py  ────────────────────────────────────────────────────────────
+# Кэш ответов на повторяющиеся вопросы (сроки, военка, стипендии…).
+# Ключ — нормализованный текст вопроса + кампус/уровень/тип из профиля.
+# В памяти — LRU с TTL, под ним таблица answer_cache в SQLite, чтобы
+# кэш переживал перезапуск. Любая правка SYSTEM_PROMPT.txt сбрасывает кэш.
+# Запись в SQLite — через поток-писатель Db (без ожидания), чтение — из памяти
+# или через читающее соединение.
+import os, re, time, hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from Db import Database
+
+load_dotenv()
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))     # записей в памяти
+ANSWER_CACHE_TTL  = float(os.getenv("ANSWER_CACHE_TTL", "86400"))   # сек (сутки)
+
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES   = re.compile(r"\s+")
+
+
+def normalize(question: str) -> str:
+    """«Когда  сессия?!» и «когда сессия» → один и тот же ключ."""
+    q = question.lower().replace("ё", "е")
+    q = _NON_WORD.sub(" ", q)
+    return _SPACES.sub(" ", q).strip()
+
+
+def make_key(question: str, campus: Optional[str], level: Optional[str],
+             ed_type: Optional[str]) -> str:
+    raw = "|".join([normalize(question), campus or "", level or "", ed_type or ""])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class Entry:
+    answer: str
+    category: Optional[str]
+    gen_time: float          # сколько стоила исходная генерация (для «сэкономлено»)
+    created: float           # time.time()
+
+
+class AnswerCache:
+    def __init__(self, db: Database, prompt: str, *,
+                 size: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL):
+        self.db = db
+        self.size = size
+        self.ttl = ttl
+        self.mem: OrderedDict[str, Entry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.prompt_hash = ""
+        self.set_prompt(prompt)
+        self._warm()
+
+    # ── инвалидация ────────────────────────────────────────────
+    def set_prompt(self, prompt: str) -> None:
+        """Новый системный промпт → все старые ответы недействительны."""
+        h = prompt_hash(prompt)
+        if h == self.prompt_hash:
+            return
+        self.prompt_hash = h
+        self.mem.clear()
+        self.db.submit("DELETE FROM answer_cache WHERE prompt_hash != ?", (h,))
+
+    def drop(self, key: str) -> None:
+        """Убирает ответ (например, после дизлайка)."""
+        self.mem.pop(key, None)
+        self.db.submit("DELETE FROM answer_cache WHERE key=?", (key,))
+
+    # ── чтение / запись ────────────────────────────────────────
+    def get(self, key: str) -> Optional[Entry]:
+        e = self.mem.get(key)
+        if e is None:
+            row = self.db.fetchone(
+                "SELECT answer, category, gen_time, created FROM answer_cache "
+                "WHERE key=? AND prompt_hash=?", (key, self.prompt_hash))
+            if row:
+                e = Entry(*row)
+                self._remember(key, e)
+        if e is not None and time.time() - e.created > self.ttl:
+            self.drop(key)
+            e = None
+        if e is None:
+            self.misses += 1
+            return None
+        self.mem.move_to_end(key)
+        self.hits += 1
+        return e
+
+    def put(self, key: str, answer: str, gen_time: float,
+            category: Optional[str] = None) -> None:
+        e = Entry(answer, category, gen_time, time.time())
+        self._remember(key, e)
+        self.db.submit(
+            "INSERT OR REPLACE INTO answer_cache VALUES (?,?,?,?,?,?)",
+            (key, self.prompt_hash, answer, category, gen_time, e.created))
+
+    def set_category(self, key: str, category: str) -> None:
+        """Категория приходит позже, из фоновой классификации."""
+        if key in self.mem:
+            self.mem[key].category = category
+        self.db.submit("UPDATE answer_cache SET category=? WHERE key=?",
+                       (category, key))
+
+    # ── внутреннее ─────────────────────────────────────────────
+    def _remember(self, key: str, e: Entry) -> None:
+        self.mem[key] = e
+        self.mem.move_to_end(key)
+        while len(self.mem) > self.size:
+            self.mem.popitem(last=False)
+
+    def _warm(self) -> None:
+        """Подгружает свежие записи из SQLite в память при старте."""
+        self.db.submit("DELETE FROM answer_cache WHERE created < ?",
+                       (time.time() - self.ttl,))
+        rows = self.db.fetchall(
+            "SELECT key, answer, category, gen_time, created FROM answer_cache "
+            "WHERE prompt_hash=? AND created >= ? ORDER BY created DESC LIMIT ?",
+            (self.prompt_hash, time.time() - self.ttl, self.size))
+        for key, *rest in reversed(rows):
+            self._remember(key, Entry(*rest))
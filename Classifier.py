@@ -0,0 +1,207 @@
+# Classifier.py  ───────────────────────────────────────────────────────
+# Локальный классификатор категорий вопросов (мультиномиальный наивный
+# Байес по основам слов). Учится офлайн на парах logs.question /
+# analysis.category, размеченных DeepSeek, и сохраняется в JSON.
+# В боте: уверенный прогноз → категория без обращения к API,
+# неуверенный → запасной вызов LLM.
+#
+#   python Classifier.py train  [--db bot_logs.db] [--out category_model.json]
+#   python Classifier.py report [--db bot_logs.db] [--threshold 0.6]
+import os, re, sys, json, math, time, zlib, sqlite3, argparse
+from collections import Counter, defaultdict
+from typing import Iterable, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CATEGORIES = [
+    "Финансовые вопросы", "Учеба", "Цифровые сервисы и техподдержка",
+    "Обратная связь", "Соц вопросы", "Наука", "Военка",
+    "Внеучебка", "Практика", "Другое",
+]
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),   # относительный — от каталога бота
+                          os.getenv("CLASSIFIER_PATH", "category_model.json"))
+THRESHOLD  = float(os.getenv("CLASSIFIER_THRESHOLD", "0.6"))   # ниже → LLM
+STEM_LEN   = 6      # грубая «основа» слова: первые 6 букв
+ALPHA      = 0.5    # сглаживание Лапласа
+
+_WORD = re.compile(r"[a-zа-я0-9]+")
+
+
+def tokens(text: str) -> list[str]:
+    words = _WORD.findall(text.lower().replace("ё", "е"))
+    return [w[:STEM_LEN] for w in words if len(w) > 1]
+
+
+def normalize_label(label: Optional[str]) -> Optional[str]:
+    """Ответ LLM «Учеба.» → «Учеба»; неизвестная категория → None."""
+    if not label:
+        return None
+    label = label.strip().strip(".«»\"'").strip()
+    return label if label in CATEGORIES else None
+
+
+# ── модель ─────────────────────────────────────────────────────
+class Model:
+    def __init__(self, classes: list[str], prior: dict, logp: dict, unk: dict):
+        self.classes = classes
+        self.prior = prior      # class → log P(class)
+        self.logp = logp        # token → {class: log P(token|class)}
+        self.unk = unk          # class → log P(неизвестный token|class)
+
+    @classmethod
+    def train(cls, pairs: Iterable[tuple[str, str]]) -> "Model":
+        docs = Counter()
+        counts: dict[str, Counter] = defaultdict(Counter)
+        for question, label in pairs:
+            docs[label] += 1
+            counts[label].update(tokens(question))
+        classes = sorted(docs)
+        vocab = set().union(*counts.values()) if counts else set()
+        n_docs = sum(docs.values())
+        prior = {c: math.log(docs[c] / n_docs) for c in classes}
+        logp: dict[str, dict] = defaultdict(dict)
+        unk = {}
+        for c in classes:
+            total = sum(counts[c].values()) + ALPHA * (len(vocab) + 1)
+            unk[c] = math.log(ALPHA / total)
+            for tok, n in counts[c].items():
+                logp[tok][c] = math.log((n + ALPHA) / total)
+        return cls(classes, prior, dict(logp), unk)
+
+    def predict(self, question: str) -> tuple[str, float]:
+        """(категория, вероятность) — вероятность после softmax по классам."""
+        scores = dict(self.prior)
+        for tok in tokens(question):
+            row = self.logp.get(tok)
+            if row is None:
+                continue                       # слово не встречалось вовсе
+            for c in self.classes:
+                scores[c] += row.get(c, self.unk[c])
+        best = max(scores, key=scores.get)
+        top = scores[best]
+        z = sum(math.exp(s - top) for s in scores.values())
+        return best, 1 / z
+
+    # ── сериализация ──────────────────────────────────────────
+    def save(self, path: str = MODEL_PATH) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"classes": self.classes, "prior": self.prior,
+                       "logp": self.logp, "unk": self.unk}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str = MODEL_PATH) -> "Model":
+        with open(path, encoding="utf-8") as f:
+            d = json.load(f)
+        return cls(d["classes"], d["prior"], d["logp"], d["unk"])
+
+
+# ── модель бота (перечитывается, если файл обновили командой train) ──
+_model: Optional[Model] = None
+_model_mtime = 0.0
+
+
+def current_model() -> Optional[Model]:
+    global _model, _model_mtime
+    try:
+        mtime = os.stat(MODEL_PATH).st_mtime
+    except OSError:
+        return None
+    if mtime != _model_mtime:
+        _model, _model_mtime = Model.load(MODEL_PATH), mtime
+    return _model
+
+
+def classify_local(question: str, threshold: float = THRESHOLD) -> Optional[str]:
+    """Категория, если модель есть и уверена; иначе None (нужен LLM)."""
+    model = current_model()
+    if model is None:
+        return None
+    label, prob = model.predict(question)
+    return label if prob >= threshold else None
+
+
+# ── обучающие данные ───────────────────────────────────────────
+def labeled_rows(db_path: str) -> list[tuple[int, str, str]]:
+    """(log_id, вопрос, категория) с разметкой от LLM (не от самой модели)."""
+    conn = sqlite3.connect(db_path)
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(analysis)")}
+    src = "AND (a.category_source IS NULL OR a.category_source = 'llm')" \
+        if "category_source" in cols else ""
+    rows = conn.execute(f"""
+        SELECT l.id, l.question, a.category
+        FROM logs l JOIN analysis a ON a.log_id = l.id
+        WHERE a.category IS NOT NULL {src}
+    """).fetchall()
+    conn.close()
+    out = []
+    for log_id, q, label in rows:
+        label = normalize_label(label)
+        if q and label:
+            out.append((log_id, q, label))
+    return out
+
+
+def _is_test(log_id: int) -> bool:
+    # стабильное разбиение 80/20 по id — отчёт сопоставим между запусками
+    return zlib.crc32(str(log_id).encode()) % 5 == 0
+
+
+# ── CLI ────────────────────────────────────────────────────────
+def cmd_train(args) -> None:
+    rows = labeled_rows(args.db)
+    if not rows:
+        sys.exit("Нет размеченных вопросов для обучения.")
+    t0 = time.perf_counter()
+    model = Model.train((q, c) for _, q, c in rows)
+    model.save(args.out)
+    print(f"Обучено на {len(rows)} вопросах за {time.perf_counter() - t0:.2f} с "
+          f"→ {args.out} ({len(model.logp)} основ)")
+
+
+def cmd_report(args) -> None:
+    rows = labeled_rows(args.db)
+    train = [(q, c) for i, q, c in rows if not _is_test(i)]
+    test = [(q, c) for i, q, c in rows if _is_test(i)]
+    if not train or not test:
+        sys.exit("Слишком мало размеченных вопросов для отчёта.")
+    model = Model.train(train)
+
+    t0 = time.perf_counter()
+    preds = [model.predict(q) for q, _ in test]
+    per_q = (time.perf_counter() - t0) / len(test) * 1000
+
+    correct = sum(p == c for (p, _), (_, c) in zip(preds, test))
+    confident = [(p, c) for (p, prob), (_, c) in zip(preds, test) if prob >= args.threshold]
+    conf_ok = sum(p == c for p, c in confident)
+    print(f"Обучение: {len(train)}, проверка: {len(test)} (разметка LLM)")
+    print(f"Точность (все прогнозы):    {correct / len(test):.1%}")
+    print(f"{f'Уверенных (p ≥ {args.threshold}):':28}{len(confident) / len(test):.1%} "
+          f"→ точность {conf_ok / max(len(confident), 1):.1%}")
+    print(f"Уходит в LLM:               {1 - len(confident) / len(test):.1%}")
+    print(f"Время прогноза:             {per_q:.3f} мс/вопрос")
+    print()
+    print(f"{'Категория':34} {'precision':>9} {'recall':>7} {'n':>5}")
+    for c in CATEGORIES:
+        tp = sum(p == c and t == c for (p, _), (_, t) in zip(preds, test))
+        n_pred = sum(p == c for p, _ in preds)
+        n_true = sum(t == c for _, t in test)
+        if not n_true and not n_pred:
+            continue
+        prec = tp / n_pred if n_pred else 0.0
+        rec = tp / n_true if n_true else 0.0
+        print(f"{c:34} {prec:9.2f} {rec:7.2f} {n_true:5}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Локальный классификатор категорий")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_train = sub.add_parser("train", help="обучить и сохранить модель")
+    p_train.add_argument("--db", default="bot_logs.db")
+    p_train.add_argument("--out", default=MODEL_PATH)
+    p_report = sub.add_parser("report", help="точность против разметки LLM")
+    p_report.add_argument("--db", default="bot_logs.db")
+    p_report.add_argument("--threshold", type=float, default=THRESHOLD)
+    args = ap.parse_args()
+    {"train": cmd_train, "report": cmd_report}[args.cmd](args)
@@ -1,14 +1,18 @@
 # ── импорт и конфигурация — без изменений ─────────────────────────────—
-import streamlit as st, pandas as pd, sqlite3
+import streamlit as st, pandas as pd, sqlite3, html
 from datetime import datetime, timedelta
 import matplotlib.pyplot as plt, matplotlib.dates as mdates
 import plotly.express as px, altair as alt
 from streamlit_autorefresh import st_autorefresh
+from Metrics import merge_buckets, quantile, METRICS_PERSIST_SEC
+from Db import DB_PATH
+from DashboardData import (DialogFrame, FrameLoader, texts, unique_users,
+                           load_rollup, load_hist, mean, std,
+                           search_page, highlighted, MARK)
+from Archive import hot_start
+from Tokens import cost
 from datetime import datetime, timedelta
 
-MIN_N     = 1      # минимальное количество ответов в сегменте
-THR       = 0.10   # доля дизлайков, начиная с которой бьём тревогу (40 %)
-
 st.set_page_config(page_title="Bot Dashboard", layout="wide")
 st.title("📊 Дашборд чат-бота")
 # st_autorefresh(interval=10000, key="auto_refresh")
@@ -17,34 +21,68 @@ st.title("📊 Дашборд чат-бота")
 if st.button("🔄 Обновить"):
     st.rerun()
 # ── загрузка данных ───────────────────────────────────────────────────—
-conn = sqlite3.connect("bot_logs.db", check_same_thread=False)
+conn = sqlite3.connect(DB_PATH, check_same_thread=False)
 
+# агрегаты для графиков и сводок — из предагрегатов rollup (Rollup.py)
 @st.cache_data(ttl=5)
-def load():
-    return pd.read_sql("""
-         SELECT logs.id, logs.timestamp, logs.user_id, logs.question, logs.answer,
-                analysis.*, campus, education_level, education_type
-         FROM logs
-         JOIN analysis      ON logs.id   = analysis.log_id
-         LEFT JOIN user_profiles ON logs.user_id = user_profiles.user_id
-         ORDER BY logs.timestamp DESC
-    """, conn, parse_dates=["timestamp"])
-
-df_base = load()
-if df_base.empty:
-    st.info("Пока нет данных.")
+def rollup(grain: str = "d", since=None, until=None, *, by=(), measures=None,
+           **filters) -> pd.DataFrame:
+    return load_rollup(conn, grain, since, until, filters, by=by, measures=measures)
+
+@st.cache_data(ttl=5)
+def hist(metric: str, since, until, **filters) -> pd.DataFrame:
+    return load_hist(conn, metric, since, until, filters)
+
+# строки диалогов за период — одни на все сессии (без копий), без текста;
+# секции берут из них срезы по общим маскам фильтров. Загрузчик один на
+# процесс: период читается один раз, дальше — только изменённые строки
+@st.cache_resource
+def _frames() -> FrameLoader:
+    return FrameLoader(DB_PATH)
+
+def frame(since, until) -> DialogFrame:
+    return _frames().load(since, until)
+
+@st.cache_data(ttl=60, max_entries=256)
+def dialog_texts(ids: tuple) -> pd.DataFrame:
+    return texts(conn, ids)
+
+def with_text(df: pd.DataFrame) -> pd.DataFrame:
+    """Дописывает вопрос и ответ — только к показываемым строкам."""
+    return df.join(dialog_texts(tuple(df.id)), on="id")
+
+# поиск (Search.py): страница id без текста, текст с подсветкой — только её
+@st.cache_data(ttl=5, max_entries=64)
+def search(query: str, since, until, feedback, before, limit, **filters) -> pd.DataFrame:
+    return search_page(conn, query, since, until, filters, feedback=feedback,
+                       before=before, limit=limit)
+
+@st.cache_data(ttl=60, max_entries=64)
+def search_texts(query: str, ids: tuple) -> pd.DataFrame:
+    return highlighted(conn, query, ids)
+
+def marked(text) -> str:
+    """Текст из highlighted() → HTML с <mark> вокруг совпадений."""
+    if not isinstance(text, str):
+        return "—"
+    return (html.escape(text).replace(MARK[0], "<mark>").replace(MARK[1], "</mark>")
+            .replace("\n", "<br>"))
+
+if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'rollup'").fetchone():
+    st.warning("Нет предагрегатов: перезапустите бота или выполните `python Rollup.py`.")
     st.stop()
 
 # --- подсчёты для лейблов фильтров (на весь период) -----------------
-campus_counts   = df_base['campus'].value_counts().to_dict()
-level_counts    = df_base['education_level'].value_counts().to_dict()
-type_counts     = df_base['education_type'].value_counts().to_dict()
-cat_counts      = df_base['category'].value_counts().to_dict()
+def label_counts(col: str) -> dict:
+    return rollup("a", by=(col,), measures=("n",)).set_index(col).n.to_dict()
 
-# Приведение числовых колонок
-for col in ["response_time","confidence","readability",
-            "grammar_errors","complex_words","sentiment"]:
-    df_base[col] = pd.to_numeric(df_base[col], errors="coerce")
+if not rollup("a", measures=("n",)).n.iloc[0]:
+    st.info("Пока нет данных.")
+    st.stop()
+campus_counts   = label_counts("campus")
+level_counts    = label_counts("education_level")
+type_counts     = label_counts("education_type")
+cat_counts      = label_counts("category")
 
 # ── период (общий, т.к. к времени вопросы одинаковы) ─────────────────—
 sd, ed = st.date_input(
@@ -52,15 +90,23 @@ sd, ed = st.date_input(
 )
 if isinstance(sd, datetime): sd = sd.date()
 if isinstance(ed, datetime): ed = ed.date()
-df_base = df_base[(df_base.timestamp.dt.date >= sd) & (df_base.timestamp.dt.date <= ed)]
-
-# ── универсальная функция фильтрации ──────────────────────────────────—
-def apply_filters(df: pd.DataFrame, prefix: str, *,
-                  with_category: bool = False, disabled: bool = False):
-    """Рисует селекторы и фильтрует df.
-       Если disabled=True → просто возвращает df (селекторы не показываются)."""
+since, until = sd.isoformat(), (ed + timedelta(days=1)).isoformat()
+hot_from = hot_start(conn)
+if hot_from and since < hot_from:
+    st.caption(f"Диалоги до {hot_from[:10]} читаются из архива (Archive.py); "
+               "графики — по предагрегатам за весь период, поиск по тексту — с этой даты.")
+
+def period(filters: dict, grain: str = "d", *, by=(), measures=None) -> pd.DataFrame:
+    """Суммы rollup за выбранный период с фильтрами (by=() — одна строка итогов)."""
+    return rollup(grain, since, until, by=by, measures=measures, **filters)
+
+# ── универсальные селекторы и фильтрация ──────────────────────────────—
+def select_filters(prefix: str, *,
+                   with_category: bool = False, disabled: bool = False) -> dict:
+    """Рисует селекторы и возвращает {колонка: [значения]}.
+       Если disabled=True → селекторы не показываются, действуют глобальные."""
     if disabled:
-        return df
+        return g_filters
 
     cols = st.columns(4 if with_category else 3)
     campus = cols[0].multiselect(
@@ -81,28 +127,40 @@ def apply_filters(df: pd.DataFrame, prefix: str, *,
                           "Внеучебка", "Практика", "Другое"],
             key=f"{prefix}_cat")
 
-    if campus:
-        df = df[df.campus.isin(campus)]
-    if level:
-        df = df[df.education_level.isin(level)]
-    if ed_type:
-        df = df[df.education_type.isin(ed_type)]
-    if category:
-        df = df[df.category.isin(category)]
-    return df
-
-# ── Статус работы бота (по heartbeat) ─────────────────────────────────
-try:
-    hb_row = conn.execute(
-        "SELECT ts FROM heartbeat WHERE id = 1"
-    ).fetchone()
-    if hb_row:
-        last_hb = pd.to_datetime(hb_row[0])
-        is_alive = (datetime.utcnow() - last_hb) < timedelta(minutes=0.1)
-    else:
-        is_alive = False
-except Exception:
+    return {"campus": campus, "education_level": level,
+            "education_type": ed_type, "category": category}
+
+# ── Статус работы бота (по агрегатам метрик) ──────────────────────────
+# бот пишет агрегаты раз в METRICS_PERSIST_SEC; пропущено два окна — не жив
+@st.cache_data(ttl=5)
+def load_metrics(hours: float = 1.0) -> pd.DataFrame:
+    since = (datetime.utcnow() - timedelta(hours=hours)).isoformat()
+    try:
+        return pd.read_sql(
+            "SELECT ts, name, kind, value, count, sum, buckets FROM metrics "
+            "WHERE ts >= ? ORDER BY ts", conn, params=(since,), parse_dates=["ts"])
+    except Exception:
+        return pd.DataFrame(columns=["ts", "name", "kind", "value", "count", "sum", "buckets"])
+
+metrics_df = load_metrics()
+if metrics_df.empty:
     is_alive = False
+else:
+    last_ts = metrics_df.ts.max()
+    is_alive = (datetime.utcnow() - last_ts) < timedelta(seconds=2.5 * METRICS_PERSIST_SEC)
+
+def hist_stats(name: str):
+    """(среднее, p95) гистограммы за последний час."""
+    h = metrics_df[metrics_df.name == name]
+    n = h["count"].sum()
+    if not n:
+        return float("nan"), float("nan")
+    p95 = quantile(merge_buckets(h.buckets.tolist()), 0.95)
+    return h["sum"].sum() / n, (p95 if p95 is not None else float("nan"))
+
+def last_gauge(name: str) -> float:
+    g = metrics_df[metrics_df.name == name]
+    return g.value.iloc[-1] if not g.empty else float("nan")
 
 status_html = (
     "<span style='color:limegreen; font-weight:bold; font-size:18px'>🟢 Бот работает</span>"
@@ -148,43 +206,85 @@ with st.sidebar.expander("🎛️ Глобальные фильтры", expanded
     )
 st.sidebar.markdown("---")
 # ── Системные метрики бота ────────────────────────────────────────────
-# 1) выборка последних 100 запросов
-last_100 = df_base.head(100)                # df_base уже отфильтрован по датам
-
-# 2) расчёты
-avg_rt  = last_100.response_time.mean()
-p95_rt  = last_100.response_time.quantile(0.95)
-unique_24h = df_base[
-    df_base.timestamp >= datetime.utcnow() - timedelta(hours=24)
-]["user_id"].nunique()
+# 1) время ответа, LLM и задержки — из агрегатов метрик за последний час
+avg_rt, p95_rt = hist_stats("bot_response_seconds")
+_, p95_llm     = hist_stats("bot_llm_seconds")
+loop_lag_now   = last_gauge("bot_event_loop_lag_seconds")
+in_flight_now  = last_gauge("bot_in_flight")
+queue_now      = last_gauge("bot_analysis_queue_depth")
+
+# 2) остальное — по предагрегатам: последний час поминутно и период по дням
+last_hour = rollup("m", (datetime.utcnow() - timedelta(hours=1)).isoformat()[:16],
+                   measures=("first_token_time_n", "first_token_time_sum")).iloc[0]
+avg_ttft = mean(last_hour, "first_token_time")
+period_tot = period({}, measures=("n", "cache_hits", "cache_saved",
+                                  "queued", "coalesced")).iloc[0]
+hit_ratio = period_tot.cache_hits / period_tot.n if period_tot.n else float("nan")
+saved_sec = period_tot.cache_saved
+unique_24h = unique_users(conn, (datetime.utcnow() - timedelta(hours=24)).isoformat())
 
 # 3) вывод в сайдбаре
 st.sidebar.subheader("⚙️ Системные метрики")
 st.sidebar.metric(
-    "⏱ Среднее время ответа (посл. 100)",
+    "⏱ Среднее время ответа (1 ч)",
     f"{avg_rt:.2f} сек" if not pd.isna(avg_rt) else "—"
 )
 st.sidebar.metric(
-    "🚀 P95 времени ответа",
+    "🚀 P95 времени ответа (1 ч)",
     f"{p95_rt:.2f} сек" if not pd.isna(p95_rt) else "—"
 )
+st.sidebar.metric(
+    "🤖 P95 вызова LLM (1 ч)",
+    f"{p95_llm:.2f} сек" if not pd.isna(p95_llm) else "—"
+)
+st.sidebar.metric(
+    "🔄 В обработке / очередь анализа",
+    "—" if pd.isna(in_flight_now) else f"{in_flight_now:.0f} / {queue_now:.0f}"
+)
+st.sidebar.metric(
+    "🐢 Задержка event loop",
+    f"{loop_lag_now * 1000:.0f} мс" if not pd.isna(loop_lag_now) else "—"
+)
+st.sidebar.metric(
+    "⚡ До первого токена (1 ч)",
+    f"{avg_ttft:.2f} сек" if not pd.isna(avg_ttft) else "—"
+)
 st.sidebar.metric(
     "👥 Уникальных пользователей (24 ч)",
     unique_24h
 )
+st.sidebar.metric(
+    "♻️ Ответов из кэша (период)",
+    f"{hit_ratio:.1%}" if not pd.isna(hit_ratio) else "—",
+    help="Доля вопросов, на которые бот ответил без обращения к LLM"
+)
+st.sidebar.metric(
+    "⏳ Сэкономлено генерации (период)",
+    f"{saved_sec:.0f} сек"
+)
+
+# контроль нагрузки: сколько вопросов ждали очереди / склеились / отклонены
+try:
+    rejected = dict(conn.execute(
+        "SELECT reason, COUNT(*) FROM admission_events "
+        "WHERE date(timestamp) BETWEEN ? AND ? GROUP BY reason",
+        (sd.isoformat(), ed.isoformat())).fetchall())
+except Exception:
+    rejected = {}
+st.sidebar.metric(
+    "🚦 В очереди к LLM / склеено (период)",
+    f"{int(period_tot.queued)} / {int(period_tot.coalesced)}"
+)
+st.sidebar.metric(
+    "⛔ Отклонено: лимит / перегрузка / LLM недоступен (период)",
+    f"{rejected.get('rate', 0)} / {rejected.get('overload', 0)} / {rejected.get('upstream', 0)}"
+)
 st.sidebar.markdown("---")
 
 
-# применяем глобальные фильтры
-df_master = df_base.copy()
-if g_campus:
-    df_master = df_master[df_master.campus.isin(g_campus)]
-if g_level:
-    df_master = df_master[df_master.education_level.isin(g_level)]
-if g_type:
-    df_master = df_master[df_master.education_type.isin(g_type)]
-if g_category:
-    df_master = df_master[df_master.category.isin(g_category)]
+# глобальные фильтры
+g_filters = {"campus": g_campus, "education_level": g_level,
+             "education_type": g_type, "category": g_category}
 
 # True → локальные фильтры отключаем
 master_active = any([g_campus, g_level, g_type, g_category])
@@ -193,109 +293,123 @@ master_active = any([g_campus, g_level, g_type, g_category])
 # ── сводные индикаторы (отдельные фильтры) ─────────────────────────────
 st.subheader("Сводные показатели")
 
-# базовый датасет уже прошёл через ГЛОБАЛЬНЫЕ фильтры → df_master
 # если глобальные фильтры активны → локальные селекторы скрыты
-summary_df = apply_filters(
-    df_master.copy(),
+summary = period(select_filters(
     "summary",
-    disabled=master_active   # True → просто вернёт df_master без UI
-)
+    disabled=master_active   # True → действуют глобальные фильтры
+), measures=("n", "word_count_n", "word_count_sum",
+              "confidence_n", "confidence_sum", "refusals")).iloc[0]
 
 # ——— 4 индикатора ——————————————————————————————————————————
 m1, m2, m3, m4 = st.columns(4)
-m1.metric("Запросов", len(summary_df))
+m1.metric("Запросов", int(summary.n))
 
-if summary_df.empty:
+if not summary.word_count_n:            # ещё ничего не проанализировано
     m2.metric("Средняя длина (слов)", "—")
     m3.metric("Средний confidence",  "—")
     m4.metric("Отказов %",           "—")
 else:
-    m2.metric("Средняя длина (слов)", f"{summary_df.word_count.mean():.0f}")
+    m2.metric("Средняя длина (слов)", f"{mean(summary, 'word_count'):.0f}")
     m3.metric(
         "Средний confidence",
-        f"{summary_df.confidence.mean():.2f}"
-        if summary_df.confidence.notna().any() else "—"
+        f"{mean(summary, 'confidence'):.2f}"
+        if summary.confidence_n else "—"
     )
     m4.metric(
         "Отказов %",
-        f"{summary_df.refusal_flag.mean() * 100:.1f}%"
-        if summary_df.refusal_flag.notna().any() else "—"
+        f"{summary.refusals / summary.word_count_n * 100:.1f}%"
     )
 
 st.markdown("---")
 
-# ── 🛑 Предупреждения о частых дизлайках (SIDEBAR) ────────────────────
-
-
-warn_df = df_base.copy()               # период
-agg = (warn_df
-       .groupby(["campus", "education_level", "education_type"])
-       .agg(total=("user_feedback", "size"),
-            neg  =("user_feedback", lambda s: (s == -1).sum()))
-       .reset_index())
-agg["ratio"] = agg.neg / agg.total
-alerts = agg[(agg.total >= MIN_N) & (agg.ratio >= THR)]
-
+# ── 🛑 Тревоги (SIDEBAR) ──────────────────────────────────────────────
+# всплески задержек и дизлайков ищет сам бот (Anomaly.py) и пишет в alerts
+@st.cache_data(ttl=5)
+def load_alerts(since, until, limit: int = 30) -> pd.DataFrame:
+    try:
+        return pd.read_sql(
+            "SELECT id, timestamp, kind, campus, education_level, education_type, message "
+            "FROM alerts WHERE timestamp >= ? AND timestamp < ? "
+            "ORDER BY timestamp DESC LIMIT ?", conn, params=(since, until, limit),
+            parse_dates=["timestamp"])
+    except Exception:
+        return pd.DataFrame(columns=["id", "timestamp", "kind", "campus", "education_level",
+                                     "education_type", "message"])
+
+alerts = load_alerts(since, until)
 if not alerts.empty:
-    st.sidebar.subheader("🛑 Частые негативные оценки")
-
-    # кнопки: клик → выбранный сегмент кладём в session_state
-    for i, r in alerts.iterrows():
-        seg = dict(campus=r.campus,
-                   level=r.education_level,
-                   ed_type=r.education_type)
-        label = (f"⚠ {seg['campus'] or '—'} | {seg['level'] or '—'} | "
-                 f"{seg['ed_type'] or '—'} "
-                 f"— {int(r.neg)}/{int(r.total)} ({r.ratio:.0%})")
-        if st.sidebar.button(label, key=f"alert_btn_{i}"):
+    st.sidebar.subheader("🛑 Тревоги")
+
+    # дизлайки — кнопки: клик → сегмент в session_state, ниже его диалоги
+    for r in alerts.itertuples():
+        label = f"⚠ {r.timestamp:%d.%m %H:%M} · {r.message}"
+        if r.kind != "dislikes":
+            st.sidebar.warning(label)
+            continue
+        seg = dict(campus=r.campus, level=r.education_level, ed_type=r.education_type)
+        if st.sidebar.button(label, key=f"alert_btn_{r.id}"):
             st.session_state["alert_sidebar"] = seg
     st.sidebar.markdown("---")
 
 # ── 1. Динамика запросов / время генерации ───────────────────────────—
 st.subheader("Динамика запросов / время генерации")
-dyn_df = apply_filters(df_master.copy(), "dyn", disabled=master_active)
+# корзина по длине периода: минуты — до 2 дней, часы — до 2 месяцев, дни
+days = (ed - sd).days + 1
+grain, freq, fmt = (("m", "1min", "%H:%M") if days <= 2 else
+                    ("h", "1h", "%d.%m %H:%M") if days <= 62 else
+                    ("d", "1D", "%d.%m.%Y"))
+dyn = period(select_filters("dyn", disabled=master_active), grain, by=("bucket",),
+             measures=("n", "response_time_n", "response_time_sum",
+                       "first_token_time_n", "first_token_time_sum")).set_index("bucket")
+dyn.index = pd.to_datetime(dyn.index)
 left, right = st.columns(2)
 with left:
-    series = dyn_df.set_index("timestamp").resample("1T").count()["id"]
+    series = dyn.n.resample(freq).sum() if not dyn.empty else dyn.n
     fig, ax = plt.subplots(figsize=(6,3))
     ax.plot(series.index, series.values, marker="o")
-    ax.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M"))
+    ax.xaxis.set_major_formatter(mdates.DateFormatter(fmt))
     fig.autofmt_xdate(rotation=45, ha="right"); ax.set_ylabel("шт")
     st.pyplot(fig)
 with right:
-    rt = dyn_df.set_index("timestamp")["response_time"].resample("1T").mean().dropna()
+    rt = mean(dyn, "response_time").dropna()
+    ttft = mean(dyn, "first_token_time").dropna()
     fig, ax = plt.subplots(figsize=(6,3))
-    ax.plot(rt.index, rt.values)
-    ax.xaxis.set_major_formatter(mdates.DateFormatter("%H:%M"))
+    ax.plot(rt.index, rt.values, label="полная генерация")
+    if not ttft.empty:
+        ax.plot(ttft.index, ttft.values, label="до первого токена")
+        ax.legend(fontsize=8)
+    ax.xaxis.set_major_formatter(mdates.DateFormatter(fmt))
     fig.autofmt_xdate(rotation=45, ha="right"); ax.set_ylabel("сек")
     st.pyplot(fig)
 
 # ── 2. Pie-метрики (тон, отказы, шаблонность) ─────────────────────────—
 st.subheader("Категориальные метрики")
-pie_df = apply_filters(df_master.copy(), "pie", disabled=master_active)
+pie = period(select_filters("pie", disabled=master_active),
+             measures=("n", "sent_pos", "sent_neu", "sent_neg", "refusals", "templates")).iloc[0]
 p1,p2,p3 = st.columns(3)
 with p1:
     st.plotly_chart(px.pie(
         names=["Позитив","Нейтрал","Негатив"],
-        values=[(pie_df.sentiment>0).sum(), (pie_df.sentiment==0).sum(), (pie_df.sentiment<0).sum()],
+        values=[pie.sent_pos, pie.sent_neu, pie.sent_neg],
         title="Тональность"), use_container_width=True)
 with p2:
     st.plotly_chart(px.pie(
         names=["Отказы","Обычные"],
-        values=[pie_df.refusal_flag.sum(), len(pie_df)-pie_df.refusal_flag.sum()],
+        values=[pie.refusals, pie.n - pie.refusals],
         title="Отказы"), use_container_width=True)
 with p3:
     st.plotly_chart(px.pie(
         names=["Шаблон","Нет шаблона"],
-        values=[pie_df.template_flag.sum(), len(pie_df)-pie_df.template_flag.sum()],
+        values=[pie.templates, pie.n - pie.templates],
         title="Шаблонность"), use_container_width=True)
 
 # ── 3. Bar-plot оценок пользователей ─────────────────────────────────—
 st.subheader("Распределение оценок пользователей")
-fb_df = apply_filters(df_master.copy(), "fb", disabled=master_active)
-fb_counts = {"Положительные": int((fb_df.user_feedback==1).sum()),
-             "Негативные":   int((fb_df.user_feedback==-1).sum()),
-             "Без оценки":   int(fb_df.user_feedback.isna().sum())}
+fb = period(select_filters("fb", disabled=master_active),
+            measures=("fb_pos", "fb_neg", "fb_none")).iloc[0]
+fb_counts = {"Положительные": int(fb.fb_pos),
+             "Негативные":   int(fb.fb_neg),
+             "Без оценки":   int(fb.fb_none)}
 bar_df = pd.DataFrame({"Оценка": fb_counts.keys(), "Количество": fb_counts.values()})
 fig = px.bar(bar_df, x="Оценка", y="Количество", color="Оценка", text="Количество",
              title="Оценки ответов бота")
@@ -305,8 +419,9 @@ st.plotly_chart(fig, use_container_width=True)
 
 # ── 4. Распределение вопросов по категориям ───────────────────────────—
 st.subheader("Распределение вопросов по категориям")
-cat_df = apply_filters(df_master.copy(), "cats", disabled=master_active)
-cat_counts = cat_df['category'].value_counts().reset_index()
+cats = period(select_filters("cats", disabled=master_active), by=("category",), measures=("n",))
+cat_counts = (cats.groupby("category").n.sum().astype(int)
+              .loc[lambda s: s > 0].sort_values(ascending=False).reset_index())
 cat_counts.columns = ["Категория","Количество"]
 if not cat_counts.empty:
     st.plotly_chart(px.bar(cat_counts, x="Количество", y="Категория",
@@ -316,35 +431,122 @@ else:
 
 # ── 5. Гистограммы длины и ошибок ─────────────────────────────────────—
 st.subheader("Распределения")
-h_df = apply_filters(df_master.copy(), "hist", disabled=master_active)
+h_filters = select_filters("hist", disabled=master_active)
 col_a, col_b = st.columns(2)
-with col_a:
-    st.plotly_chart(px.histogram(h_df, x="word_count", nbins=20,
+with col_a:     # корзины по 25 слов, последняя — «500 и больше»
+    st.plotly_chart(px.bar(hist("word_count", since, until, **h_filters), x="bin", y="n",
+                    labels={"bin": "word_count", "n": "count"},
                     title="Длина ответов (слов)"), use_container_width=True)
 with col_b:
-    st.plotly_chart(px.histogram(h_df, x="grammar_errors", nbins=10,
+    st.plotly_chart(px.bar(hist("grammar_errors", since, until, **h_filters), x="bin", y="n",
+                    labels={"bin": "grammar_errors", "n": "count"},
                     title="Грамматические ошибки"), use_container_width=True)
 
 # ── 6. Scatter confidence vs sentiment ───────────────────────────────—
 st.subheader("Уверенность vs Тональность")
-sc_df = apply_filters(df_master.copy(), "scatter", disabled=master_active)
+# точки — отдельные диалоги; текст не грузим на все точки, а показываем по id
+sc_df = frame(since, until).select(
+    select_filters("scatter", disabled=master_active),
+    columns=("id", "timestamp", "category", "confidence", "sentiment", "refusal_flag"))
 sc = alt.Chart(sc_df).mark_circle(size=60).encode(
     x='confidence', y='sentiment',
     color=alt.condition(alt.datum.refusal_flag==1,
                         alt.value('red'), alt.value('steelblue')),
-    tooltip=['timestamp','question','answer']
+    tooltip=['id','timestamp','category']
 ).interactive()
 st.altair_chart(sc, use_container_width=True)
+sc_id = st.number_input("Диалог по id (из подсказки)", min_value=0, step=1, value=0,
+                        key="scatter_id")
+if sc_id:
+    txt = dialog_texts((int(sc_id),)).iloc[0]
+    if pd.isna(txt.question):
+        st.info("Диалог не найден.")
+    else:
+        st.write(f"Q: {txt.question}")
+        st.write(f"A: {txt.answer}")
+
+# ── 7. Токены и стоимость ────────────────────────────────────────────—
+st.subheader("Токены и стоимость")
+tok = period(select_filters("tokens", with_category=True, disabled=master_active),
+             by=("category", "campus"),
+             measures=("llm_calls", "prompt_tokens", "completion_tokens", "completion_sq",
+                       "cached_tokens", "truncated", "max_tokens_sum", "llm_response_time",
+                       "memory_calls", "memory_tokens", "memory_prompt_tokens",
+                       "memory_response_time", "retrievals", "retrieval_time",
+                       "knowledge_tokens", "knowledge_saved"))
+tok = tok[tok.llm_calls > 0]                        # только ответы, сгенерированные LLM
+if tok.empty:
+    st.info("Нет данных о токенах для выбранных фильтров.")
+else:
+    # стоимость линейна по токенам → считается прямо по суммам
+    tok = tok.assign(cost=cost(tok.prompt_tokens, tok.completion_tokens, tok.cached_tokens))
+    tot = tok.sum(numeric_only=True)
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Вызовов LLM", int(tot.llm_calls))
+    c2.metric("Токенов вход / выход",
+              f"{tot.prompt_tokens:,.0f} / {tot.completion_tokens:,.0f}")
+    c3.metric("Вход из кэша промпта",
+              f"{tot.cached_tokens / max(1, tot.prompt_tokens):.0%}")
+    c4.metric("Стоимость (период)", f"${tot.cost:.2f}",
+              help="По ценам LLM_PRICE_INPUT / LLM_PRICE_CACHED / LLM_PRICE_OUTPUT за 1 млн токенов")
+
+    # память диалога (Memory.py): во что обходятся уточняющие вопросы
+    if tot.memory_calls:
+        plain = max(1, tot.llm_calls - tot.memory_calls)
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("Вызовов с памятью", f"{tot.memory_calls / tot.llm_calls:.0%}")
+        m2.metric("Токенов памяти, ср", f"{tot.memory_tokens / tot.memory_calls:.0f}",
+                  help="Сводка и прошлые реплики в промпте (оценка по длине текста)")
+        m3.metric("Вход с памятью / без, ср",
+                  f"{tot.memory_prompt_tokens / tot.memory_calls:.0f} / "
+                  f"{(tot.prompt_tokens - tot.memory_prompt_tokens) / plain:.0f}")
+        m4.metric("Время ответа с памятью / без, с",
+                  f"{tot.memory_response_time / tot.memory_calls:.2f} / "
+                  f"{(tot.llm_response_time - tot.memory_response_time) / plain:.2f}")
+
+    # база знаний (Knowledge.py): справка кусками вместо всей базы в промпте
+    if tot.retrievals:
+        k1, k2, k3, k4 = st.columns(4)
+        k1.metric("Справка в промпте, ср", f"{tot.knowledge_tokens / tot.retrievals:.0f} ток.")
+        k2.metric("Сэкономлено на входе",
+                  f"{tot.knowledge_saved / (tot.knowledge_saved + tot.prompt_tokens):.0%}",
+                  help="Токены базы знаний, не отправленные в промпт, от входа «вся база в промпте»")
+        k3.metric("Экономия (период)", f"${cost(tot.knowledge_saved, 0, 0):.2f}",
+                  help="По цене LLM_PRICE_INPUT, без учёта кэша промпта")
+        k4.metric("Поиск по базе, ср", f"{tot.retrieval_time / tot.retrievals * 1000:.2f} мс")
+
+    g = tok.groupby("category").sum(numeric_only=True)
+    by_cat = pd.DataFrame({
+        "Вызовов":   g.llm_calls.astype(int),
+        "Вход_ср":   g.prompt_tokens / g.llm_calls,
+        "Выход_ср":  g.completion_tokens / g.llm_calls,
+        "Выход_σ":   std(g, "llm_calls", "completion_tokens", "completion_sq"),
+        "Лимит_ср":  g.max_tokens_sum / g.llm_calls,
+        "Обрезано":  g.truncated / g.llm_calls,
+        "Стоимость": g.cost,
+    }).sort_values("Стоимость", ascending=False)
+    by_campus = tok.groupby(tok.campus.fillna("—")).cost.sum().reset_index()
+
+    col_a, col_b = st.columns(2)
+    with col_a:
+        st.plotly_chart(px.bar(by_cat.reset_index(), x="Стоимость", y="category",
+                               orientation="h", title="Стоимость по категориям, $"),
+                        use_container_width=True)
+    with col_b:
+        st.plotly_chart(px.bar(by_campus, x="campus", y="cost",
+                               title="Стоимость по кампусам, $"),
+                        use_container_width=True)
+    st.dataframe(by_cat.style.format({"Вход_ср": "{:.0f}", "Выход_ср": "{:.0f}",
+                                      "Выход_σ": "{:.0f}", "Лимит_ср": "{:.0f}",
+                                      "Обрезано": "{:.1%}", "Стоимость": "${:.4f}"}),
+                 use_container_width=True)
 
 if "alert_sidebar" in st.session_state:
     seg = st.session_state["alert_sidebar"]
 
-    sd_df = df_base[
-        (df_base.campus == seg["campus"]) &
-        (df_base.education_level == seg["level"]) &
-        (df_base.education_type == seg["ed_type"]) &
-        (df_base.user_feedback == -1)
-    ].copy()
+    sd_df = with_text(frame(since, until).select(
+        {"campus": [seg["campus"]], "education_level": [seg["level"]],
+         "education_type": [seg["ed_type"]]}, feedback=-1))
 
     if sd_df.empty:
         st.sidebar.info("Диалогов не найдено.")
@@ -366,10 +568,59 @@ if "alert_sidebar" in st.session_state:
         st.session_state.pop("alert_sidebar")
         st.rerun()
 
+# ── 🔎 поиск по диалогам ──────────────────────────────────────────────
+st.markdown("---")
+st.subheader("🔎 Поиск по диалогам")
+if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'logs_fts'").fetchone():
+    st.warning("Нет поискового индекса: перезапустите бота или выполните `python Search.py`.")
+else:
+    s_cols = st.columns([3, 1, 1])
+    s_query = s_cols[0].text_input(
+        "Слова из вопроса или ответа", key="search_query",
+        help='Слова ищутся по началу (стипенд → стипендия), "фраза в кавычках" — целиком')
+    s_fb = s_cols[1].selectbox("Оценка", ["Все", "👎", "👍"], key="search_fb")
+    s_size = s_cols[2].selectbox("На странице", [10, 20, 50], key="search_size")
+    s_filters = select_filters("search", with_category=True, disabled=master_active)
+    s_feedback = {"👎": -1, "👍": 1}.get(s_fb)
+
+    # keyset: стек id, с которых начинаются открытые страницы; смена
+    # запроса/фильтров/периода — снова с первой
+    s_key = (s_query, s_fb, s_size, since, until, repr(s_filters))
+    if st.session_state.get("search_key") != s_key:
+        st.session_state["search_key"] = s_key
+        st.session_state["search_pages"] = [None]
+    pages = st.session_state["search_pages"]
+
+    found = search(s_query, since, until, s_feedback, pages[-1], s_size + 1, **s_filters)
+    has_next = len(found) > s_size
+    found = found.head(s_size)
+
+    if found.empty:
+        st.info("Ничего не найдено.")
+    else:
+        st.caption(f"Страница {len(pages)} · диалоги {found.timestamp.iloc[-1]:%d.%m %H:%M}"
+                   f" — {found.timestamp.iloc[0]:%d.%m %H:%M}")
+        found = found.join(search_texts(s_query, tuple(found.id)), on="id")
+        for row in found.itertuples():
+            fb = {1: " · 👍", -1: " · 👎"}.get(row.user_feedback, "")
+            label = (f"{row.timestamp:%Y-%m-%d %H:%M} | User {row.user_id} | "
+                     f"{row.category if pd.notna(row.category) else '—'}{fb}")
+            with st.expander(label, expanded=False):
+                st.markdown(f"**Вопрос:** {marked(row.question)}", unsafe_allow_html=True)
+                st.markdown(f"**Ответ:** {marked(row.answer)}", unsafe_allow_html=True)
+
+    nav = st.columns([1, 1, 6])
+    if nav[0].button("← Назад", key="search_prev", disabled=len(pages) == 1):
+        pages.pop()
+        st.rerun()
+    if nav[1].button("Дальше →", key="search_next", disabled=not has_next):
+        pages.append(int(found.id.iloc[-1]))
+        st.rerun()
+
 # ── последние 5 диалогов (без локальных фильтров) ─────────────────────
 st.markdown("---")
 st.subheader("Последние 5 диалогов")
-for _, row in df_base.head(5).iterrows():          # df_base — только фильтр по датам
+for _, row in with_text(frame(since, until).select(limit=5)).iterrows():   # только период
     campus = row.campus if pd.notna(row.campus) else "—"
     level  = row.education_level if pd.notna(row.education_level) else "—"
     edu_t  = row.education_type if pd.notna(row.education_type) else "—"
@@ -377,8 +628,8 @@ for _, row in df_base.head(5).iterrows():          # df_base — только ф
     st.write(f"Q: {row.question}")
     st.write(f"A: {row.answer}")
     tags = []
-    if row.refusal_flag:  tags.append("🚫 Отказ")
-    if row.template_flag: tags.append("📋 Шаблон")
+    if row.refusal_flag == 1:  tags.append("🚫 Отказ")
+    if row.template_flag == 1: tags.append("📋 Шаблон")
     if row.sentiment>0:   tags.append("🙂 Позитив")
     elif row.sentiment<0: tags.append("🙁 Негатив")
     if tags: st.write("Метки: " + " · ".join(tags))
@@ -389,23 +640,22 @@ for _, row in df_base.head(5).iterrows():          # df_base — только ф
 # ── диалоги с негативной оценкой ───────────────────────────────────────
 st.subheader("Диалоги с негативной оценкой")
 
-neg_base = apply_filters(
-    df_master.copy(),
+neg_filters = select_filters(
     "neg",
     with_category=True,
     disabled=master_active
 )
-neg_df = neg_base[neg_base.user_feedback < 0]
 
-# метрика «негатив / все»
-ratio = 0 if len(neg_base) == 0 else len(neg_df) / len(neg_base)
+# метрика «негатив / все» и число диалогов — по предагрегатам
+neg_tot = period(neg_filters, measures=("n", "fb_neg")).iloc[0]
+ratio = 0 if not neg_tot.n else neg_tot.fb_neg / neg_tot.n
 st.metric("Негатив / все", f"{ratio:.1%}")
 
 # ── выбор количества выводимых диалогов ───────────────────────────────
-if neg_df.empty:
+if not neg_tot.fb_neg:
     st.info("Нет диалогов с негативной оценкой для выбранных фильтров.")
 else:
-    max_n = len(neg_df)
+    max_n = int(neg_tot.fb_neg)
 
     # показываем слайдер только если записей больше одной
     if max_n > 1:
@@ -419,7 +669,7 @@ else:
     else:
         n_show = 1   # единственная запись
 
-    neg_df = neg_df.head(n_show)
+    neg_df = with_text(frame(since, until).select(neg_filters, feedback=-1, limit=n_show))
 
     # вывод диалогов
     for _, row in neg_df.iterrows():
@@ -0,0 +1,375 @@
+# DashboardData.py  ────────────────────────────────────────────────────
+# Загрузка данных для Dashboard.py без Streamlit: страница оборачивает
+# эти функции в st.cache_*, а Bench.py меряет их напрямую.
+#
+# Вся история в память не читается:
+#   • графики и сводки — предагрегаты Rollup.py (load_rollup / load_hist),
+#     период и фильтры (кампус, уровень, тип, категория) — в SQL;
+#   • списки диалогов и точки scatter — DialogFrame: компактные строки
+#     периода без текста (load_frame → dialogs(), по индексу logs.timestamp)
+#     и общие маски фильтров; текст — texts() по id показываемых строк.
+#     Период читается целиком один раз, дальше FrameLoader дочитывает только
+#     строки, чей analysis.updated_at (ставят триггеры Db.py: новый анализ,
+#     оценка 👍/👎, пересчёт Backfill) не старше запомненной отметки;
+#     заново — только при изменении схемы (PRAGMA schema_version);
+#   • поиск — search_page(): индекс Search.py (FTS5) + фильтры, страницы по
+#     keyset (id меньше последнего показанного), текст с подсветкой —
+#     highlighted() только для строк страницы;
+#   • старые диалоги, перенесённые Archive.py в Parquet, load_frame и texts
+#     дочитывают из архива (только нужные колонки и дни), если период
+#     начинается раньше первой строки logs; поиск — только по базе.
+# Сегмент — профиль на момент вопроса (logs.campus и т. д.), как в rollup.
+# load_logs — прежняя полная загрузка, осталась для сравнения в Bench.py.
+import sqlite3, threading
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+import Archive
+import Rollup
+import Search
+
+ROWS_SQL = """
+     SELECT logs.id, logs.timestamp, logs.user_id, logs.question, logs.answer,
+            logs.cache_hit, logs.cache_saved, logs.admission,
+            logs.prompt_tokens, logs.completion_tokens, logs.cached_tokens,
+            logs.finish_reason, logs.max_tokens,
+            analysis.*
+     FROM logs
+     JOIN analysis ON logs.id = analysis.log_id
+"""
+PROFILES_SQL = "SELECT user_id, campus, education_level, education_type FROM user_profiles"
+
+NUMERIC = ["response_time", "first_token_time", "confidence", "readability",
+           "grammar_errors", "complex_words", "sentiment",
+           "prompt_tokens", "completion_tokens", "cached_tokens", "max_tokens"]
+
+
+def _timestamps(s: pd.Series) -> pd.Series:
+    # isoformat() без микросекунд, если их ровно 0: формат у строк разный
+    return pd.to_datetime(s, format="ISO8601")
+
+
+def load_logs(conn: sqlite3.Connection) -> pd.DataFrame:
+    """Все ответы с анализом и профилем (полная загрузка), новые — сверху."""
+    df = pd.read_sql(f"{ROWS_SQL} ORDER BY logs.id DESC", conn)
+    df["timestamp"] = _timestamps(df.timestamp)
+    for col in NUMERIC:
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+    return df.merge(pd.read_sql(PROFILES_SQL, conn), on="user_id", how="left")
+
+
+# ── строки диалогов ────────────────────────────────────────────
+# имя колонки на странице → выражение SQL
+COLUMNS = {
+    "id": "l.id", "timestamp": "l.timestamp", "user_id": "l.user_id",
+    "campus": "l.campus", "education_level": "l.education_level",
+    "education_type": "l.education_type",
+    "question": "l.question", "answer": "l.answer",
+    "category": "a.category", "user_feedback": "a.user_feedback",
+    "confidence": "a.confidence", "sentiment": "a.sentiment",
+    "refusal_flag": "a.refusal_flag", "template_flag": "a.template_flag",
+}
+DIALOG = ("id", "timestamp", "user_id", "campus", "education_level", "education_type",
+          "question", "answer", "sentiment", "refusal_flag", "template_flag")
+
+
+def _dialog_where(since: Optional[str], until: Optional[str], filters: Optional[dict],
+                  feedback: Optional[int]) -> tuple[str, list]:
+    cond, params = [], []
+    if since:
+        cond.append("l.timestamp >= ?"); params.append(since)
+    if until:
+        cond.append("l.timestamp < ?"); params.append(until)
+    for col, values in (filters or {}).items():
+        if values:
+            cond.append(f"{COLUMNS[col]} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+    if feedback is not None:
+        cond.append("a.user_feedback = ?"); params.append(feedback)
+    return (" WHERE " + " AND ".join(cond)) if cond else "", params
+
+
+def dialogs(conn: sqlite3.Connection, since: Optional[str] = None,
+            until: Optional[str] = None, filters: Optional[dict] = None, *,
+            feedback: Optional[int] = None, columns: Sequence[str] = DIALOG,
+            limit: Optional[int] = None) -> pd.DataFrame:
+    """Диалоги за [since, until) с фильтрами {колонка: [значения]} и оценкой,
+    новые сверху; только колонки columns."""
+    where, params = _dialog_where(since, until, filters, feedback)
+    sql = (f"SELECT {', '.join(f'{COLUMNS[c]} AS {c}' for c in columns)} "
+           f"FROM logs l JOIN analysis a ON a.log_id = l.id{where} ORDER BY l.timestamp DESC")
+    if limit is not None:
+        sql += " LIMIT ?"; params.append(limit)
+    df = pd.read_sql(sql, conn, params=params)
+    if "timestamp" in df:
+        df["timestamp"] = _timestamps(df.timestamp)
+    return df
+
+
+# ── компактные строки периода, общие для всех сессий ───────────
+# без текста; сегменты и категория — category, метрики и флаги — float32
+# (NaN — ещё не проанализировано, как и раньше)
+META = ("id", "timestamp", "user_id", "campus", "education_level", "education_type",
+        "category", "user_feedback", "confidence", "sentiment",
+        "refusal_flag", "template_flag")
+DTYPES = {"id": "int32", "user_id": "int64",
+          "campus": "category", "education_level": "category",
+          "education_type": "category", "category": "category",
+          "user_feedback": "float32", "refusal_flag": "float32", "template_flag": "float32",
+          "confidence": "float32", "sentiment": "float32"}
+
+
+class DialogFrame:
+    """Строки диалогов за период (новые сверху) + маски фильтров.
+    Один экземпляр на период отдаётся всем сессиям (st.cache_resource),
+    поэтому данные только читаются; маски по колонкам и их сочетания
+    считаются один раз и переиспользуются секциями и сессиями."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self._masks: dict[tuple, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    def _mask(self, key: tuple, make) -> np.ndarray:
+        m = self._masks.get(key)
+        if m is None:
+            m = self._masks[key] = make()
+            m.flags.writeable = False
+        return m
+
+    def mask(self, filters: Optional[dict] = None, feedback: Optional[int] = None) -> np.ndarray:
+        parts = [(col, tuple(sorted(v))) for col, v in (filters or {}).items() if v]
+        if feedback is not None:
+            parts.append(("user_feedback", (feedback,)))
+        if not parts:
+            return self._mask((), lambda: np.ones(len(self.df), dtype=bool))
+        cols = [self._mask((p,), lambda p=p: self.df[p[0]].isin(p[1]).to_numpy(bool))
+                for p in parts]
+        return self._mask(tuple(parts), lambda: np.logical_and.reduce(cols))
+
+    def select(self, filters: Optional[dict] = None, feedback: Optional[int] = None, *,
+               columns: Optional[Sequence[str]] = None, limit: Optional[int] = None) -> pd.DataFrame:
+        """Копия только отобранных строк (и колонок) — для вывода."""
+        idx = np.flatnonzero(self.mask(filters, feedback))
+        if limit is not None:
+            idx = idx[:limit]
+        df = self.df.iloc[idx]
+        return df[list(columns)] if columns else df
+
+    def count(self, filters: Optional[dict] = None, feedback: Optional[int] = None) -> int:
+        return int(self.mask(filters, feedback).sum())
+
+
+def _archived(conn: sqlite3.Connection, since: Optional[str]) -> bool:
+    """Нужен ли архив: период начинается раньше первой строки в базе."""
+    start = Archive.hot_start(conn)
+    return start is None or since is None or since < start
+
+
+def load_frame(conn: sqlite3.Connection, since: Optional[str] = None,
+               until: Optional[str] = None) -> DialogFrame:
+    df = dialogs(conn, since, until, columns=META)
+    old = Archive.read(conn, since, until, META) if _archived(conn, since) else None
+    if old is not None and len(old):
+        old["timestamp"] = _timestamps(old.timestamp)
+        df = pd.concat([df, old.sort_values("timestamp", ascending=False)],
+                       ignore_index=True)
+    return DialogFrame(df.astype(DTYPES))
+
+
+class FrameLoader:
+    """DialogFrame последних periods периодов, обновляемые по analysis.updated_at.
+    Отметка — наибольший прочитанный updated_at: писатель в SQLite один,
+    поэтому всё, что зафиксируют позже, получит отметку не меньше её.
+    Строки ровно с отметкой при следующем чтении сравниваются по id."""
+
+    def __init__(self, path: str, periods: int = 4):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()         # сессии Streamlit — разные потоки
+        self.periods = periods
+        # (since, until) → [DialogFrame, schema_version, отметка, id с отметкой]
+        self._state: OrderedDict[tuple, list] = OrderedDict()
+        self.full_loads = 0
+        self.updates = 0
+
+    def load(self, since: Optional[str] = None, until: Optional[str] = None) -> DialogFrame:
+        """Актуальный DialogFrame периода; новый объект — только если строки изменились."""
+        with self.lock:
+            key = (since, until)
+            schema = self.conn.execute("PRAGMA schema_version").fetchone()[0]
+            state = self._state.pop(key, None)
+            if state is None or state[1] != schema:
+                # отметка — до чтения: изменённое во время чтения дочитается потом
+                mark = self.conn.execute("SELECT MAX(updated_at) FROM analysis").fetchone()[0]
+                edge = {r[0] for r in self.conn.execute(
+                    "SELECT log_id FROM analysis WHERE updated_at = ?", (mark,))}
+                state = [load_frame(self.conn, since, until), schema, mark or "", edge]
+                self.full_loads += 1
+            else:
+                self._update(state, since, until)
+            self._state[key] = state
+            while len(self._state) > self.periods:
+                self._state.popitem(last=False)
+            return state[0]
+
+    def _update(self, state: list, since: Optional[str], until: Optional[str]) -> None:
+        frame, _, mark, edge = state
+        where, params = _dialog_where(since, until, None, None)
+        cond = where.replace(" WHERE ", " AND ", 1)
+        # CROSS JOIN — сначала индекс updated_at, а не все строки периода
+        fresh = pd.read_sql(
+            f"SELECT {', '.join(f'{COLUMNS[c]} AS {c}' for c in META)}, a.updated_at "
+            f"FROM analysis a CROSS JOIN logs l ON l.id = a.log_id "
+            f"WHERE a.updated_at >= ?{cond}", self.conn, params=[mark, *params])
+        fresh = fresh[~((fresh.updated_at == mark) & fresh.id.isin(edge))]
+        if fresh.empty:
+            return
+        state[2] = top = fresh.updated_at.max()
+        state[3] = set(fresh.id[fresh.updated_at == top]) | (edge if top == mark else set())
+        fresh = fresh.drop(columns="updated_at")
+        fresh["timestamp"] = _timestamps(fresh.timestamp)
+        old = frame.df[~frame.df.id.isin(fresh.id)]
+        df = pd.concat([fresh.astype(DTYPES), old], ignore_index=True)
+        df = df.sort_values("timestamp", ascending=False, kind="stable", ignore_index=True)
+        state[0] = DialogFrame(df.astype(DTYPES))
+        self.updates += 1
+
+
+def texts(conn: sqlite3.Connection, ids: Sequence[int]) -> pd.DataFrame:
+    """Вопрос и ответ — только для показываемых диалогов, по id."""
+    if not len(ids):
+        return pd.DataFrame(columns=["question", "answer"])
+    ids = [int(i) for i in ids]
+    df = pd.read_sql(f"SELECT id, question, answer FROM logs "
+                     f"WHERE id IN ({','.join('?' * len(ids))})", conn, params=ids)
+    missing = sorted(set(ids) - set(df.id))
+    if missing:
+        old = Archive.read(conn, columns=("id", "question", "answer"), ids=missing)
+        if old is not None:
+            df = pd.concat([df, old], ignore_index=True)
+    return df.set_index("id").reindex(ids)
+
+
+# ── поиск по тексту ────────────────────────────────────────────
+SEARCH = ("id", "timestamp", "user_id", "campus", "education_level", "education_type",
+          "category", "user_feedback")
+MARK = ("\x02", "\x03")     # границы совпадения в highlighted(); страница меняет на HTML
+
+
+def _first_id(conn: sqlite3.Connection, ts: str) -> Optional[int]:
+    row = conn.execute("SELECT id FROM logs WHERE timestamp >= ? ORDER BY timestamp LIMIT 1",
+                       (ts,)).fetchone()
+    return row[0] if row else None
+
+
+def search_page(conn: sqlite3.Connection, query: str = "", since: Optional[str] = None,
+                until: Optional[str] = None, filters: Optional[dict] = None, *,
+                feedback: Optional[int] = None, before: Optional[int] = None,
+                limit: int = 20) -> pd.DataFrame:
+    """Страница результатов без текста, новые сверху: не больше limit строк
+    с id < before. Пустой query — все диалоги по фильтрам.
+    Строки перебираются по убыванию id (от индекса FTS, если есть query),
+    поэтому период — это диапазон id: logs.id растёт вместе с timestamp."""
+    where, params = _dialog_where(None, None, filters, feedback)
+    cond = [where[len(" WHERE "):]] if where else []
+    match = Search.fts_query(query)
+    if match:
+        src, key = "logs_fts f CROSS JOIN logs l ON l.id = f.rowid", "f.rowid"
+        cond.insert(0, "logs_fts MATCH ?"); params.insert(0, match)
+    else:
+        src, key = "logs l", "l.id"
+    lo = _first_id(conn, since) if since else 0
+    hi = _first_id(conn, until) if until else None
+    if lo is None:                       # после since вопросов нет
+        lo = hi = 0
+    cond.append(f"{key} >= ?"); params.append(lo)
+    for bound in (hi, before):
+        if bound is not None:
+            cond.append(f"{key} < ?"); params.append(bound)
+    # CROSS JOIN — порядок соединения как написано: сначала индекс/ключ по
+    # убыванию, фильтры проверяются по ходу, чтение останавливается на LIMIT
+    sql = (f"SELECT {', '.join(f'{COLUMNS[c]} AS {c}' for c in SEARCH)} "
+           f"FROM {src} CROSS JOIN analysis a ON a.log_id = l.id "
+           f"WHERE {' AND '.join(cond)} ORDER BY {key} DESC LIMIT ?")
+    df = pd.read_sql(sql, conn, params=params + [limit])
+    df["timestamp"] = _timestamps(df.timestamp)
+    return df
+
+
+def highlighted(conn: sqlite3.Connection, query: str, ids: Sequence[int]) -> pd.DataFrame:
+    """Вопрос и ответ строк страницы; совпадения с query обрамлены MARK."""
+    df = texts(conn, ids)
+    match = Search.fts_query(query)
+    if not match or df.empty:
+        return df
+    rows = Search.highlight(list(df.itertuples(name=None)), match, *MARK)
+    return pd.DataFrame(rows, columns=["id", "question", "answer"]).set_index("id")
+
+
+def unique_users(conn: sqlite3.Connection, since: str) -> int:
+    return conn.execute("SELECT COUNT(DISTINCT user_id) FROM logs WHERE timestamp >= ?",
+                        (since,)).fetchone()[0]
+
+
+# ── предагрегаты (Rollup.py) ───────────────────────────────────
+def _where(grain: Optional[str], since: Optional[str], until: Optional[str],
+           filters: Optional[dict]) -> tuple[str, list]:
+    cond, params = [], []
+    if grain:
+        cond.append("grain = ?"); params.append(grain)
+    if since:
+        cond.append("bucket >= ?"); params.append(since)
+    if until:
+        cond.append("bucket < ?"); params.append(until)
+    for col, values in (filters or {}).items():
+        if values:
+            cond.append(f"{col} IN ({','.join('?' * len(values))})")
+            params.extend(values)
+    return (" WHERE " + " AND ".join(cond)) if cond else "", params
+
+
+def load_rollup(conn: sqlite3.Connection, grain: str = "d", since: Optional[str] = None,
+                until: Optional[str] = None, filters: Optional[dict] = None, *,
+                by: Sequence[str] = (), measures: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """Суммы rollup за [since, until) с фильтрами {колонка: [значения]},
+    сгруппированные в SQL по колонкам by (bucket и/или ключи сегмента);
+    by=() — одна строка итогов. Пустые ключи ('' — профиль/категория
+    неизвестны) отдаются как None."""
+    measures = list(measures or Rollup.MEASURES)
+    where, params = _where(grain, since, until, filters)
+    cols = [*by, *(f"SUM({m}) AS {m}" for m in measures)]
+    group = f" GROUP BY {', '.join(by)} HAVING SUM(n) != 0" if by else ""
+    df = pd.read_sql(f"SELECT {', '.join(cols)} FROM rollup{where}{group}", conn, params=params)
+    df[measures] = df[measures].astype(float).fillna(0)   # и у пустой выборки — числа
+    return df.replace({k: {"": None} for k in Rollup.KEYS if k in by})
+
+
+def load_hist(conn: sqlite3.Connection, metric: str, since: Optional[str] = None,
+              until: Optional[str] = None, filters: Optional[dict] = None) -> pd.DataFrame:
+    """Гистограмма metric по дням за период: bin → n."""
+    where, params = _where(None, since, until, filters)
+    where += (" AND " if where else " WHERE ") + "metric = ?"
+    return pd.read_sql(f"SELECT bin, SUM(n) AS n FROM rollup_hist{where} "
+                       "GROUP BY bin HAVING SUM(n) > 0 ORDER BY bin",
+                       conn, params=params + [metric])
+
+
+def mean(r, metric: str):
+    """Среднее по суммам rollup; r — DataFrame (по строкам) или Series итогов."""
+    n = r[f"{metric}_n"]
+    if isinstance(n, pd.Series):
+        n = n.where(n > 0)
+    elif not n:
+        return float("nan")
+    return r[f"{metric}_sum"] / n
+
+
+def std(r: pd.DataFrame, n: str, s: str, sq: str) -> pd.Series:
+    """σ по количеству, сумме и сумме квадратов: sqrt(E[x²] − E[x]²)."""
+    cnt = r[n].where(r[n] > 0)
+    return (r[sq] / cnt - (r[s] / cnt) ** 2).clip(lower=0) ** 0.5
@@ -0,0 +1,267 @@
+# Db.py  ───────────────────────────────────────────────────────────────
+# Доступ к bot_logs.db без блокировки event loop:
+#   • все записи идут через отдельный поток-писатель со своим соединением,
+#     который собирает операции от разных апдейтов в одну транзакцию
+#     (не дольше DB_FLUSH_MS) и возвращает результат через asyncio-future;
+#   • чтения — через отдельное соединение, в WAL они не ждут писателя.
+import os, time, queue, asyncio, logging, sqlite3, threading
+from typing import Any, Callable, Optional, Sequence
+from dotenv import load_dotenv
+
+import Rollup
+import Search
+from Metrics import db_write_seconds
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DB_PATH     = os.getenv("DB_PATH", "bot_logs.db")
+DB_FLUSH_MS = float(os.getenv("DB_FLUSH_MS", "10"))    # макс. ожидание до коммита
+DB_BATCH    = int(os.getenv("DB_BATCH", "200"))        # макс. операций в транзакции
+
+_STOP = object()
+
+
+def connect(path: str = DB_PATH, **kwargs) -> sqlite3.Connection:
+    """Соединение в режиме WAL (читатели не блокируются писателем)."""
+    c = sqlite3.connect(path, **kwargs)
+    c.execute("PRAGMA journal_mode=WAL")
+    c.execute("PRAGMA synchronous=NORMAL")
+    c.execute("PRAGMA busy_timeout=5000")
+    return c
+
+
+# ── схема bot_logs.db ──────────────────────────────────────────
+def _add_column(c: sqlite3.Connection, table: str, column: str, decl: str) -> None:
+    """Миграция: добавляет колонку, если её ещё нет в существующей БД."""
+    cols = {r[1] for r in c.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def init_schema(path: str = DB_PATH) -> None:
+    """Создаёт таблицы и догоняет миграции (бот при импорте Handlers,
+    Backfill, Bench для синтетической БД). Отдельное соединение."""
+    c = connect(path)
+    c.execute("""CREATE TABLE IF NOT EXISTS logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT, user_id INTEGER, username TEXT,
+        question TEXT, answer TEXT
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS user_profiles (
+        user_id INTEGER PRIMARY KEY,
+        campus TEXT, education_level TEXT, education_type TEXT
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS analysis (
+        log_id INTEGER PRIMARY KEY,
+        confidence REAL, sentiment REAL, template_flag INTEGER, word_count INTEGER,
+        response_time REAL, reference_flag INTEGER, refusal_flag INTEGER,
+        readability REAL, grammar_errors INTEGER, complex_words INTEGER,
+        question_repeat INTEGER, user_feedback INTEGER, category TEXT
+    )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS answer_cache (
+        key TEXT PRIMARY KEY, prompt_hash TEXT,
+        answer TEXT, category TEXT, gen_time REAL, created REAL
+    )""")
+    # response_time — полное время генерации, first_token_time — до первого токена
+    _add_column(c, "analysis", "first_token_time", "REAL")
+    # кэш ответов: попал ли вопрос в кэш, сколько секунд генерации сэкономлено
+    _add_column(c, "logs", "cache_hit", "INTEGER")
+    _add_column(c, "logs", "cache_saved", "REAL")
+    _add_column(c, "logs", "cache_key", "TEXT")
+    # кто определил категорию: llm | local (Classifier) | cache
+    _add_column(c, "analysis", "category_source", "TEXT")
+    # какой версией Analysis посчитана строка (Backfill.py пересчитывает старые)
+    _add_column(c, "analysis", "analysis_version", "INTEGER")
+    # чем посчитана confidence: logprobs | heuristic (пересчёт без logprobs
+    # в Backfill / recover не затирает значение по logprobs)
+    _add_column(c, "analysis", "confidence_source", "TEXT")
+    # как вопрос прошёл контроль нагрузки: cache | direct | queued | coalesced
+    _add_column(c, "logs", "admission", "TEXT")
+    # токены вызова LLM (usage), почему закончилась генерация и какой был лимит
+    _add_column(c, "logs", "prompt_tokens", "INTEGER")
+    _add_column(c, "logs", "completion_tokens", "INTEGER")
+    _add_column(c, "logs", "cached_tokens", "INTEGER")
+    _add_column(c, "logs", "finish_reason", "TEXT")
+    _add_column(c, "logs", "max_tokens", "INTEGER")
+    # когда строка analysis последний раз менялась (анализ, оценка, пересчёт) —
+    # по ней Dashboard дочитывает строки периода (FrameLoader); ставят
+    # триггеры, код не трогает
+    _add_column(c, "analysis", "updated_at", "TEXT")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_analysis_updated_at ON analysis (updated_at)")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS analysis_touch_insert AFTER INSERT ON analysis
+        BEGIN
+            UPDATE analysis SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+            WHERE log_id = NEW.log_id;
+        END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS analysis_touch_update AFTER UPDATE ON analysis
+        WHEN NEW.updated_at IS OLD.updated_at
+        BEGIN
+            UPDATE analysis SET updated_at = strftime('%Y-%m-%d %H:%M:%f', 'now')
+            WHERE log_id = NEW.log_id;
+        END""")
+    # память диалога (Memory.py): сколько токенов и реплик ушло в промпт
+    _add_column(c, "logs", "history_tokens", "INTEGER")
+    _add_column(c, "logs", "history_turns", "INTEGER")
+    # база знаний (Knowledge.py): справка в промпте, экономия, время поиска
+    _add_column(c, "logs", "knowledge_tokens", "INTEGER")
+    _add_column(c, "logs", "knowledge_saved", "INTEGER")
+    _add_column(c, "logs", "retrieval_time", "REAL")
+    # профиль на момент вопроса (ставит триггер) и предагрегаты для Dashboard
+    _add_column(c, "logs", "campus", "TEXT")
+    _add_column(c, "logs", "education_level", "TEXT")
+    _add_column(c, "logs", "education_type", "TEXT")
+    if Rollup.ensure(c):
+        Rollup.rebuild(c)
+    # фильтры Dashboard (период, пользователи за сутки, категория, оценка)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs (timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_logs_user_id ON logs (user_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_analysis_category ON analysis (category)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_analysis_user_feedback ON analysis (user_feedback)")
+    # полнотекстовый поиск по вопросам и ответам (Search.py)
+    if Search.ensure(c):
+        Search.rebuild(c)
+    # состояние FSM для Storage.SQLiteStorage
+    c.execute("""CREATE TABLE IF NOT EXISTS fsm_state (
+        key TEXT PRIMARY KEY, state TEXT, data TEXT
+    )""")
+    # агрегаты метрик за окна (Metrics.persist) — читает Dashboard.py
+    c.execute("""CREATE TABLE IF NOT EXISTS metrics (
+        ts TEXT, name TEXT, kind TEXT, value REAL,
+        count INTEGER, sum REAL, buckets TEXT
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_metrics_name_ts ON metrics (name, ts)")
+    # вопросы без ответа LLM (в logs не попадают): reason = rate | overload |
+    # upstream (LLM недоступен — студенту ушёл UNAVAILABLE_TEXT)
+    c.execute("""CREATE TABLE IF NOT EXISTS admission_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT, user_id INTEGER, reason TEXT
+    )""")
+    # память диалога по студентам (Memory.py); turns — JSON
+    c.execute("""CREATE TABLE IF NOT EXISTS conversations (
+        user_id INTEGER PRIMARY KEY, summary TEXT, turns TEXT, updated REAL
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations (updated)")
+    # тревоги детектора аномалий (Anomaly.py) — читает Dashboard.py
+    c.execute("""CREATE TABLE IF NOT EXISTS alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT, kind TEXT, metric TEXT,
+        campus TEXT, education_level TEXT, education_type TEXT,
+        value REAL, baseline REAL, n INTEGER, p_value REAL, message TEXT
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_alerts_timestamp ON alerts (timestamp)")
+    c.commit()
+    c.close()
+
+
+class Database:
+    def __init__(self, path: str = DB_PATH, *, flush_ms: float = DB_FLUSH_MS,
+                 batch: int = DB_BATCH):
+        self.path = path
+        self.flush = flush_ms / 1000
+        self.batch = batch
+        self.reader = connect(path, check_same_thread=False)
+        self._q: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._writer, name="db-writer",
+                                        daemon=True)
+        self._thread.start()
+        # статистика
+        self.batches = 0
+        self.ops = 0
+
+    # ── запись ─────────────────────────────────────────────────
+    async def run(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Выполняет fn(conn) в потоке-писателе внутри общей транзакции."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._q.put((fn, fut, loop))
+        return await fut
+
+    async def execute(self, sql: str, params: Sequence = ()) -> int:
+        """Одиночный запрос на запись; возвращает lastrowid."""
+        return await self.run(lambda c: c.execute(sql, params).lastrowid)
+
+    async def executemany(self, sql: str, rows: Sequence[Sequence]) -> None:
+        await self.run(lambda c: c.executemany(sql, rows))
+
+    def submit(self, sql: str, params: Sequence = ()) -> None:
+        """Запись «выстрелил и забыл» — можно звать и из синхронного кода."""
+        self._q.put((lambda c: c.execute(sql, params), None, None))
+
+    # ── чтение ─────────────────────────────────────────────────
+    def fetchone(self, sql: str, params: Sequence = ()) -> Optional[tuple]:
+        return self.reader.execute(sql, params).fetchone()
+
+    def fetchall(self, sql: str, params: Sequence = ()) -> list:
+        return self.reader.execute(sql, params).fetchall()
+
+    # ── завершение ─────────────────────────────────────────────
+    def close(self) -> None:
+        """Дописывает очередь и останавливает поток-писатель."""
+        self._q.put(_STOP)
+        self._thread.join()
+        self.reader.close()
+
+    # ── поток-писатель ─────────────────────────────────────────
+    def _writer(self) -> None:
+        conn = connect(self.path, isolation_level=None)   # транзакции — вручную
+        stop = False
+        while not stop:
+            item = self._q.get()
+            if item is _STOP:
+                break
+            items = [item]
+            deadline = time.monotonic() + self.flush
+            while len(items) < self.batch:
+                left = deadline - time.monotonic()
+                try:
+                    nxt = self._q.get(timeout=left) if left > 0 else self._q.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stop = True
+                    break
+                items.append(nxt)
+            self._commit(conn, items)
+        conn.close()
+
+    def _commit(self, conn: sqlite3.Connection, items: list) -> None:
+        results = []
+        t0 = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, fut, loop in items:
+                # SAVEPOINT — ошибка одной операции не откатывает всю пачку
+                conn.execute("SAVEPOINT op")
+                try:
+                    res, err = fn(conn), None
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    res, err = None, e
+                conn.execute("RELEASE op")
+                results.append((fut, loop, res, err))
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"DB batch failed: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            results = [(fut, loop, None, e) for fn, fut, loop in items]
+        db_write_seconds.observe(time.perf_counter() - t0)
+        self.batches += 1
+        self.ops += len(items)
+        for fut, loop, res, err in results:
+            if fut is None:
+                if err:
+                    logger.error(f"DB write failed: {err}")
+                continue
+            loop.call_soon_threadsafe(_resolve, fut, res, err)
+
+
+def _resolve(fut: asyncio.Future, res: Any, err: Optional[Exception]) -> None:
+    if fut.cancelled():
+        return
+    if err:
+        fut.set_exception(err)
+    else:
+        fut.set_result(res)
@@ -0,0 +1,99 @@
+# FakeLLM.py  ──────────────────────────────────────────────────────────
+# Локальная заглушка OpenAI-совместимого API (/chat/completions, обычный
+# и потоковый SSE-режим) для проверки транспорта и нагрузочных прогонов
+# без реального DeepSeek. usage как у DeepSeek (с prompt_cache_hit_tokens:
+# системный промпт считается закэшированным), ответ обрезается по max_tokens
+# (finish_reason=length), logprobs — если их запросили.
+#
+#   python FakeLLM.py --port 8081 --latency 0.8 --fail-rate 0.1
+#   LLM_BASE_URL=http://127.0.0.1:8081 python Main.py
+import json, time, random, asyncio, argparse
+
+from aiohttp import web
+
+ANSWER = ("Сроки пересдачи устанавливаются учебным офисом вашей программы. "
+          "Проверьте расписание в LMS и письмо от учебного офиса; "
+          "если вопрос срочный — напишите менеджеру программы.")
+
+
+def _chunk(rid: str, delta: dict, finish=None, logprobs=None, usage=None) -> bytes:
+    choices = [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": finish,
+                                         "logprobs": logprobs}]
+    body = {"id": rid, "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": "fake", "choices": choices, "usage": usage}
+    return f"data: {json.dumps(body, ensure_ascii=False)}\n\n".encode()
+
+
+def _logprobs(tokens: list[str]) -> dict:
+    return {"content": [{"token": t, "logprob": -random.expovariate(20), "bytes": None,
+                         "top_logprobs": []} for t in tokens]}
+
+
+def make_app(latency: float = 0.5, fail_rate: float = 0.0,
+             token_delay: float = 0.02, answer: str = ANSWER) -> web.Application:
+    stats = {"requests": 0, "failed": 0}
+
+    async def completions(request: web.Request) -> web.StreamResponse:
+        stats["requests"] += 1
+        req = await request.json()
+        if random.random() < fail_rate:
+            stats["failed"] += 1
+            return web.json_response({"error": {"message": "fake overload"}}, status=503)
+        await asyncio.sleep(latency * random.uniform(0.5, 1.5))
+        rid = f"fake-{stats['requests']}"
+        max_tokens = req.get("max_tokens") or 1024
+        words = answer.split(" ")
+        if max_tokens <= 10:                      # «классификация»
+            words = ["Учеба"]
+        finish = "length" if len(words) > max_tokens else "stop"
+        words = words[:max_tokens]                # слово ≈ токен
+        want_lp = bool(req.get("logprobs"))
+        sizes = [len(m.get("content", "")) // 4 for m in req["messages"]]
+        usage = {"prompt_tokens": sum(sizes), "completion_tokens": len(words),
+                 "prompt_cache_hit_tokens": sizes[0] if len(sizes) > 1 else 0}
+        usage["prompt_cache_miss_tokens"] = usage["prompt_tokens"] - usage["prompt_cache_hit_tokens"]
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if not req.get("stream"):
+            return web.json_response({
+                "id": rid, "object": "chat.completion", "created": int(time.time()),
+                "model": "fake",
+                "choices": [{"index": 0, "finish_reason": finish,
+                             "message": {"role": "assistant", "content": " ".join(words)},
+                             "logprobs": _logprobs(words) if want_lp else None}],
+                "usage": usage,
+            })
+
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        await resp.write(_chunk(rid, {"role": "assistant", "content": ""}))
+        for i, w in enumerate(words):
+            await asyncio.sleep(token_delay)
+            await resp.write(_chunk(rid, {"content": (" " if i else "") + w},
+                                    logprobs=_logprobs([w]) if want_lp else None))
+        await resp.write(_chunk(rid, {}, finish=finish))
+        if (req.get("stream_options") or {}).get("include_usage"):
+            await resp.write(_chunk(rid, None, usage=usage))
+        await resp.write(b"data: [DONE]\n\n")
+        return resp
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post("/chat/completions", completions)
+    app.router.add_post("/v1/chat/completions", completions)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Заглушка OpenAI-совместимого API")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--latency", type=float, default=0.5, help="задержка до ответа, сек")
+    ap.add_argument("--token-delay", type=float, default=0.02, help="пауза между токенами в stream")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="доля ответов 503")
+    args = ap.parse_args()
+    web.run_app(make_app(args.latency, args.fail_rate, args.token_delay),
+                host=args.host, port=args.port)
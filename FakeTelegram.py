@@ -0,0 +1,154 @@
+# FakeTelegram.py  ─────────────────────────────────────────────────────
+# Локальная замена Telegram для проверки и замера webhook-режима:
+#
+#   api  — заглушка Bot API (sendMessage, editMessageText, setWebhook, …),
+#          на которую бот ходит вместо api.telegram.org;
+#   send — «Telegram»: шлёт апдейты на webhook бота с секретным заголовком
+#          и меряет время подтверждения и пропускную способность.
+#
+#   python FakeTelegram.py api  --port 8082
+#   python FakeLLM.py --port 8081
+#   BOT_MODE=webhook WEBHOOK_SECRET=s3cret TELEGRAM_API_URL=http://127.0.0.1:8082 \
+#     LLM_BASE_URL=http://127.0.0.1:8081 BOT_TOKEN=123456:TEST python Main.py
+#   python FakeTelegram.py send --url http://127.0.0.1:8080/webhook --secret s3cret \
+#     --updates 2000 --concurrency 100 --api http://127.0.0.1:8082
+import time, random, asyncio, argparse, statistics
+from itertools import count
+
+import aiohttp
+from aiohttp import web
+
+QUESTIONS = [
+    "Когда начинается сессия?", "Как оформить академический отпуск?",
+    "Когда придёт стипендия?", "Где посмотреть расписание пересдач?",
+    "Как записаться на военную кафедру?", "Как перевестись на другую программу?",
+]
+
+
+# ── заглушка Bot API ───────────────────────────────────────────
+def make_api_app() -> web.Application:
+    stats = {"calls": 0, "sendMessage": 0, "editMessageText": 0, "first": None, "last": None}
+    msg_ids = count(1)
+
+    async def method(request: web.Request) -> web.Response:
+        name = request.match_info["method"]
+        try:
+            data = await request.post()
+        except Exception:
+            data = {}
+        now = time.monotonic()
+        stats["calls"] += 1
+        stats[name] = stats.get(name, 0) + 1
+        stats["first"] = stats["first"] or now
+        stats["last"] = now
+        if name == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        elif name.startswith(("send", "edit")):
+            chat_id = int(data.get("chat_id") or 0)
+            result = {"message_id": int(data.get("message_id") or next(msg_ids)),
+                      "date": int(time.time()),
+                      "chat": {"id": chat_id, "type": "private"},
+                      "text": data.get("text", "")}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response(stats)
+
+    async def reset(request: web.Request) -> web.Response:
+        for k in list(stats):
+            stats[k] = None if k in ("first", "last") else 0
+        return web.json_response({"ok": True})
+
+    app = web.Application()
+    app.router.add_get("/stats", get_stats)
+    app.router.add_post("/reset", reset)
+    app.router.add_route("*", "/bot{token}/{method}", method)
+    return app
+
+
+# ── отправка апдейтов ──────────────────────────────────────────
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Студент"},
+            "text": text,
+        },
+    }
+
+
+async def send(args) -> None:
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    latencies: list[float] = []
+    errors = 0
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async with aiohttp.ClientSession() as s:
+        if args.api:
+            await s.post(f"{args.api}/reset")
+
+        async def one(i: int) -> None:
+            nonlocal errors
+            # много разных пользователей — чтобы не упираться в лимит на одного
+            upd = make_update(i, 10_000 + i % args.users, random.choice(QUESTIONS))
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    async with s.post(args.url, json=upd, headers=headers) as r:
+                        await r.read()
+                        if r.status != 200:
+                            errors += 1
+                except aiohttp.ClientError:
+                    errors += 1
+                latencies.append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(1, args.updates + 1)))
+        elapsed = time.perf_counter() - t0
+
+        lat = sorted(latencies)
+        q = statistics.quantiles(lat, n=100) if len(lat) > 1 else [lat[0]] * 99
+        print(f"Отправлено {args.updates} апдейтов за {elapsed:.2f} с "
+              f"→ {args.updates / elapsed:.0f} апд/с, ошибок: {errors}")
+        print(f"Подтверждение webhook: p50 {q[49]*1000:.1f} мс, "
+              f"p95 {q[94]*1000:.1f} мс, p99 {q[98]*1000:.1f} мс")
+
+        if args.api:
+            # ждём, пока бот отправит ответы (sendMessage) на все апдейты
+            deadline = time.monotonic() + args.wait
+            while time.monotonic() < deadline:
+                async with s.get(f"{args.api}/stats") as r:
+                    st = await r.json()
+                if st.get("sendMessage", 0) >= args.updates:
+                    break
+                await asyncio.sleep(0.2)
+            total = time.perf_counter() - t0
+            print(f"Ответов бота (sendMessage): {st.get('sendMessage', 0)}, "
+                  f"правок: {st.get('editMessageText', 0)}, "
+                  f"сквозная пропускная способность ≈ {st.get('sendMessage', 0) / total:.0f} отв/с")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Заглушка Telegram для webhook-режима")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p_api = sub.add_parser("api", help="заглушка Bot API")
+    p_api.add_argument("--host", default="127.0.0.1")
+    p_api.add_argument("--port", type=int, default=8082)
+    p_send = sub.add_parser("send", help="отправить апдейты на webhook")
+    p_send.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    p_send.add_argument("--secret", default=None)
+    p_send.add_argument("--updates", type=int, default=1000)
+    p_send.add_argument("--concurrency", type=int, default=50)
+    p_send.add_argument("--users", type=int, default=500)
+    p_send.add_argument("--api", default=None, help="адрес FakeTelegram api для подсчёта ответов")
+    p_send.add_argument("--wait", type=float, default=60, help="сек ожидания ответов бота")
+    args = ap.parse_args()
+    if args.cmd == "api":
+        web.run_app(make_api_app(), host=args.host, port=args.port)
+    else:
+        asyncio.run(send(args))
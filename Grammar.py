@@ -0,0 +1,190 @@
+# Grammar.py  ──────────────────────────────────────────────────────────
+# Проверка грамматики для Analysis.analyse.
+# Раньше каждый ответ целиком проверялся и tool_ru, и tool_en — два полных
+# прохода LanguageTool. Теперь текст режется на фрагменты, язык фрагмента
+# определяется по доле кириллицы/латиницы, и каждый фрагмент проверяется
+# только «своим» языком. Проверяющие объекты — пул (создаются лениво,
+# не больше GRAMMAR_POOL_SIZE на язык), так что параллельные запросы не
+# ждут друг друга. count_errors_many проверяет пачку ответов за один
+# вызов LanguageTool на язык. GRAMMAR_MODE: on | off | sample.
+# Если LanguageTool недоступен (нет пакета / Java, сервер лежит) или
+# свободный экземпляр не появился за GRAMMAR_WAIT сек, grammar_errors = None.
+import os, re, queue, random, logging, threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+GRAMMAR_MODE      = os.getenv("GRAMMAR_MODE", "on")             # on | off | sample
+GRAMMAR_SAMPLE    = float(os.getenv("GRAMMAR_SAMPLE", "0.2"))   # доля при sample
+GRAMMAR_POOL_SIZE = int(os.getenv("GRAMMAR_POOL_SIZE", "2"))    # экземпляров на язык
+GRAMMAR_SERVER    = os.getenv("GRAMMAR_SERVER")                 # общий LanguageTool-сервер
+GRAMMAR_WAIT      = float(os.getenv("GRAMMAR_WAIT", "30"))      # сек ждать свободный экземпляр
+
+LANGS = {"ru": "ru-RU", "en": "en-US"}
+
+_SPLIT = re.compile(r"(?<=[.!?…])\s+|\n+")
+_CYR   = re.compile(r"[а-яё]", re.I)
+_LAT   = re.compile(r"[a-z]", re.I)
+_SEP   = "\n\n"
+
+
+# ── определение языка ──────────────────────────────────────────
+def detect(segment: str) -> Optional[str]:
+    """ru / en по преобладающему алфавиту; None — букв нет вовсе."""
+    cyr = len(_CYR.findall(segment))
+    lat = len(_LAT.findall(segment))
+    if not cyr and not lat:
+        return None
+    return "ru" if cyr >= lat else "en"
+
+
+def split_by_language(text: str) -> list[tuple[str, str]]:
+    """[(язык, фрагмент)], соседние фрагменты одного языка склеены."""
+    out: list[tuple[str, str]] = []
+    for seg in _SPLIT.split(text):
+        seg = seg.strip()
+        lang = detect(seg) if seg else None
+        if lang is None:
+            continue
+        if out and out[-1][0] == lang:
+            out[-1] = (lang, out[-1][1] + " " + seg)
+        else:
+            out.append((lang, seg))
+    return out
+
+
+# ── пул проверяющих ────────────────────────────────────────────
+class Unavailable(Exception):
+    """Проверяющего нет: не создаётся или все заняты дольше GRAMMAR_WAIT."""
+
+
+class CheckerPool:
+    def __init__(self, lang: str, size: int = GRAMMAR_POOL_SIZE):
+        self.code = LANGS[lang]
+        self.size = size
+        self._free: queue.Queue = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _new(self):
+        import language_tool_python     # тяжёлый импорт — только при первой проверке
+        if GRAMMAR_SERVER:
+            return language_tool_python.LanguageTool(self.code, remote_server=GRAMMAR_SERVER)
+        return language_tool_python.LanguageTool(self.code)
+
+    @contextmanager
+    def checker(self):
+        try:
+            tool = self._free.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    tool = self._new()
+                except Exception as e:
+                    with self._lock:
+                        self._created -= 1      # место в пуле снова свободно
+                    raise Unavailable(f"LanguageTool {self.code}: {e!r}") from e
+            else:
+                try:
+                    tool = self._free.get(timeout=GRAMMAR_WAIT)
+                except queue.Empty:
+                    raise Unavailable(f"LanguageTool {self.code}: нет свободного экземпляра") from None
+        try:
+            yield tool
+        finally:
+            self._free.put(tool)
+
+    def check(self, text: str) -> list:
+        with self.checker() as tool:
+            return tool.check(text)
+
+
+_pools: dict[str, CheckerPool] = {}
+_pools_lock = threading.Lock()
+
+
+def pool(lang: str) -> CheckerPool:
+    with _pools_lock:
+        if lang not in _pools:
+            _pools[lang] = CheckerPool(lang)
+        return _pools[lang]
+
+
+# ── публичное API ──────────────────────────────────────────────
+def enabled() -> bool:
+    """Проверять ли этот ответ (с учётом GRAMMAR_MODE / GRAMMAR_SAMPLE)."""
+    if GRAMMAR_MODE == "off":
+        return False
+    if GRAMMAR_MODE == "sample":
+        return random.random() < GRAMMAR_SAMPLE
+    return True
+
+
+def count_errors(text: str) -> Optional[int]:
+    """Число ошибок в ответе; None — проверка отключена или пропущена выборкой."""
+    if not enabled():
+        return None
+    try:
+        return sum(len(pool(lang).check(seg)) for lang, seg in split_by_language(text))
+    except Unavailable as e:
+        logger.warning(f"Grammar: {e}")
+        return None
+
+
+def count_errors_many(texts: list[str]) -> list[Optional[int]]:
+    """Пакетная проверка: все фрагменты одного языка склеиваются и
+    проверяются одним вызовом на экземпляр пула; ошибки раскладываются
+    обратно по ответам по смещению."""
+    result: list[Optional[int]] = [0 if enabled() else None for _ in texts]
+    by_lang: dict[str, list[tuple[int, str]]] = {}
+    for i, text in enumerate(texts):
+        if result[i] is None:
+            continue
+        for lang, seg in split_by_language(text):
+            by_lang.setdefault(lang, []).append((i, seg))
+
+    jobs = []
+    for lang, items in by_lang.items():
+        size = pool(lang).size
+        step = -(-len(items) // size)                  # поровну на экземпляры
+        for k in range(0, len(items), step):
+            jobs.append((lang, items[k:k + step]))
+
+    def run(job) -> Optional[list[int]]:
+        lang, items = job
+        starts, blob, pos = [], [], 0
+        for _, seg in items:
+            starts.append(pos)
+            blob.append(seg)
+            pos += len(seg) + len(_SEP)
+        owners = [i for i, _ in items]
+        try:
+            matches = pool(lang).check(_SEP.join(blob))
+        except Unavailable as e:
+            logger.warning(f"Grammar: {e}")
+            return None
+        return [owners[bisect_right(starts, m.offset) - 1] for m in matches]
+
+    failed: set[int] = set()
+    if jobs:
+        with ThreadPoolExecutor(max_workers=len(jobs)) as ex:
+            for job, owners in zip(jobs, ex.map(run, jobs)):
+                if owners is None:              # часть ответа не проверена — ошибок не знаем
+                    failed.update(i for i, _ in job[1])
+                    continue
+                for i in owners:
+                    result[i] += 1
+    for i in failed:
+        result[i] = None
+    return result
@@ -1,61 +1,102 @@
-import os, time, textwrap, logging, sqlite3, asyncio, random, json, httpx
+import os, time, textwrap, logging, asyncio, random, json
 from datetime import datetime
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
-from openai import AsyncOpenAI
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+import openai
 from pathlib import Path
 from Keyboards import main_kb, confirm_kb, campus_kb, level_kb, type_kb
-import Analysis
+from Pipeline import AnalysisPipeline
+from Streaming import StreamingReply
+from Cache import AnswerCache, make_key
+from Db import Database, DB_PATH, init_schema
+import Classifier
+from Limiter import RateLimitMiddleware, LLMGate, Coalescer, Overloaded
+from Transport import make_client, ResilientLLM, Unavailable, CLASSIFY_HEDGE_MS
+from Profiles import ProfileStore, Profile, EMPTY
+from Tokens import Generation, TokenBudget, LLM_LOGPROBS
+from Anomaly import AnomalyDetector
+from Memory import ConversationStore, MEMORY, MEMORY_SUMMARY_TOKENS
+from Knowledge import KnowledgeBase, KNOWLEDGE
+from Metrics import (REGISTRY, response_seconds, llm_seconds, classify_seconds,
+                     questions_total, errors_total, in_flight)
 
 load_dotenv()
 router = Router()
 logger = logging.getLogger(__name__)
 
-# Временное хранение данных пользователя при опросе
-user_data_temp = {}
+# Состояния опроса профиля; промежуточные ответы лежат в FSM-хранилище
+# (бэкенд выбирается в Storage.make_storage, см. FSM_STORAGE)
+class Onboarding(StatesGroup):
+    campus = State()
+    level = State()
+    ed_type = State()
 
-oai = AsyncOpenAI(
-    api_key=os.getenv("DEEPSEEK_API_KEY"),
-    base_url="https://api.deepseek.com"
-)
+# Потоковый вывод ответа (правки сообщения по мере генерации)
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "1") == "1"
+
+# общий httpx-пул, таймауты, повторы и предохранитель — см. Transport.py
+oai = make_client()
+llm = ResilientLLM()
+
+UNAVAILABLE_TEXT = ("Сервис ответов сейчас недоступен 😔 "
+                    "Пожалуйста, повторите вопрос через пару минут.")
 
 # ── базы данных ─────────────────────────────────────────────────
-conn = sqlite3.connect("bot_logs.db", check_same_thread=False)
-conn.execute("""CREATE TABLE IF NOT EXISTS logs (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    timestamp TEXT, user_id INTEGER, username TEXT,
-    question TEXT, answer TEXT
-)""")
-conn.execute("""CREATE TABLE IF NOT EXISTS user_profiles (
-    user_id INTEGER PRIMARY KEY,
-    campus TEXT, education_level TEXT, education_type TEXT
-)""")
-conn.execute("""CREATE TABLE IF NOT EXISTS analysis (
-    log_id INTEGER PRIMARY KEY,
-    confidence REAL, sentiment REAL, template_flag INTEGER, word_count INTEGER,
-    response_time REAL, reference_flag INTEGER, refusal_flag INTEGER,
-    readability REAL, grammar_errors INTEGER, complex_words INTEGER,
-    question_repeat INTEGER, user_feedback INTEGER, category TEXT
-)""")
-conn.commit()
+# схема и миграции — Db.init_schema; дальше все записи идут через
+# поток-писатель db, чтения — через db.fetchone/fetchall
+init_schema(DB_PATH)
+
+db = Database(DB_PATH)
+profiles = ProfileStore(db)     # профили с LRU-кэшем, прогрев при старте
+budget = TokenBudget(db)        # max_tokens по категории; обновляется из Main.main
+anomalies = AnomalyDetector(db) # задержки и дизлайки; проверки — из Main.main
 
 # ── системный промпт — пропущен ради краткости ─────────────────
 PROMPT_PATH = Path(__file__).with_name("SYSTEM_PROMPT.txt")
 with open(PROMPT_PATH, encoding="utf-8") as f:
     PROMPT_SYSTEM = f.read()
+_prompt_mtime = PROMPT_PATH.stat().st_mtime
+
+# справка по программам и правилам — в базе знаний, в промпт идут куски (Knowledge.py)
+knowledge = KnowledgeBase()
+
+answer_cache = AnswerCache(db, PROMPT_SYSTEM + knowledge.version)
+
+def _reload_prompt() -> None:
+    """Перечитывает SYSTEM_PROMPT.txt и базу знаний, если они изменились, и сбрасывает кэш."""
+    global PROMPT_SYSTEM, _prompt_mtime
+    mtime = PROMPT_PATH.stat().st_mtime
+    if not knowledge.refresh() and mtime == _prompt_mtime:
+        return
+    if mtime != _prompt_mtime:
+        with open(PROMPT_PATH, encoding="utf-8") as f:
+            PROMPT_SYSTEM = f.read()
+        _prompt_mtime = mtime
+    answer_cache.set_prompt(PROMPT_SYSTEM + knowledge.version)
+    logger.info("SYSTEM_PROMPT.txt или база знаний изменены — кэш ответов сброшен")
+
+# ── контроль нагрузки ──────────────────────────────────────────
+def _record_rejection(user_id: int, reason: str) -> None:
+    db.submit("INSERT INTO admission_events (timestamp, user_id, reason) VALUES (?,?,?)",
+              (datetime.utcnow().isoformat(), user_id, reason))
+
+rate_limiter = RateLimitMiddleware(record=_record_rejection)
+router.message.middleware(rate_limiter)     # срабатывает только для flags={"llm": True}
+llm_gate = LLMGate()
+coalescer = Coalescer()
 
 # ── команды и диалог ───────────────────────────────────────────
 
 @router.message(Command("start"))
-async def cmd_start(msg: Message):
+async def cmd_start(msg: Message, state: FSMContext):
     user_id = msg.from_user.id
-    # Очистка возможных старых данных профиля и проверка существования профиля
-    user_data_temp.pop(user_id, None)
-    cur = conn.cursor()
-    cur.execute("SELECT 1 FROM user_profiles WHERE user_id=?", (user_id,))
-    if cur.fetchone():
+    # Очистка возможных старых данных опроса и проверка существования профиля
+    await state.clear()
+    if profiles.get(user_id):
         # Профиль уже сохранён – приветствуем и показываем меню
         await msg.answer(
             "Здравствуйте! Я — виртуальный ассистент учебного офиса.\n"
@@ -64,6 +105,7 @@ async def cmd_start(msg: Message):
         )
     else:
         # Профиль не задан – начинаем опрос
+        await state.set_state(Onboarding.campus)
         await msg.answer(
             "Здравствуйте! Я — виртуальный ассистент учебного офиса.\n"
             "Для начала работы, пожалуйста, ответьте на несколько вопросов.\n\n"
@@ -72,87 +114,50 @@ async def cmd_start(msg: Message):
         )
 
 @router.callback_query(F.data.startswith("campus_"))
-async def on_choose_campus(cb: CallbackQuery):
+async def on_choose_campus(cb: CallbackQuery, state: FSMContext):
     # Сохранение выбранного кампуса и переход к вопросу об уровне образования
     _, campus_raw = cb.data.split("_", 1)
     campus = campus_raw.replace("_", " ")
-    user_data_temp[cb.from_user.id] = {"campus": campus}
+    await state.set_data({"campus": campus})
+    await state.set_state(Onboarding.level)
     await cb.message.edit_reply_markup()  # убираем кнопки кампуса
     await cb.message.answer("Какой уровень образования у вас?", reply_markup=level_kb)
     await cb.answer()
 
 @router.callback_query(F.data.startswith("level_"))
-async def on_choose_level(cb: CallbackQuery):
+async def on_choose_level(cb: CallbackQuery, state: FSMContext):
     # Сохранение уровня образования и переход к вопросу о типе обучения
     _, level_raw = cb.data.split("_", 1)
     education_level = level_raw.replace("_", " ")
-    user_data_temp[cb.from_user.id]["education_level"] = education_level
+    await state.update_data(education_level=education_level)
+    await state.set_state(Onboarding.ed_type)
     await cb.message.edit_reply_markup()
     await cb.message.answer("Тип обучения?", reply_markup=type_kb)
     await cb.answer()
 
 @router.callback_query(F.data.startswith("type_"))
-async def on_choose_type(cb: CallbackQuery):
+async def on_choose_type(cb: CallbackQuery, state: FSMContext):
     # Сохранение типа обучения и завершение опроса профиля
     _, type_raw = cb.data.split("_", 1)
     education_type = type_raw.replace("_", " ")
-    user_id = cb.from_user.id
-    # Дописываем тип обучения к временным данным
-    if user_id in user_data_temp:
-        user_data_temp[user_id]["education_type"] = education_type
-    else:
-        user_data_temp[user_id] = {"education_type": education_type}
-    # Сохраняем профиль пользователя в БД
-    conn.execute(
-        "INSERT OR REPLACE INTO user_profiles (user_id, campus, education_level, education_type) VALUES (?,?,?,?)",
-        (user_id, user_data_temp[user_id].get("campus"), user_data_temp[user_id].get("education_level"), user_data_temp[user_id].get("education_type"))
-    )
-    conn.commit()
-    user_data_temp.pop(user_id, None)  # очистка временных данных
+    # ответы, данные раньше (их может не быть, если кнопку нажали из старого опроса)
+    data = await state.get_data()
+    await profiles.save(cb.from_user.id, Profile(
+        data.get("campus"), data.get("education_level"), education_type))
+    memory.forget(cb.from_user.id)  # другой профиль — прежний разговор не про него
+    await state.clear()  # очистка временных данных
     await cb.message.edit_reply_markup()  # убираем кнопки типа обучения
     await cb.message.answer("✅ Данные сохранены. Теперь вы можете задать свой вопрос.", reply_markup=main_kb)
     await cb.answer()
 
-@router.message(F.text & ~F.via_bot)
-async def ask_gpt(msg: Message):
-    question = msg.text
-    start_t = time.monotonic()
-
-    response = await oai.chat.completions.create(
-        model="deepseek-chat",
-        messages=[
-            {"role": "system", "content": PROMPT_SYSTEM},
-            {"role": "user",   "content": question}
-        ],
-        max_tokens=1024,
-        temperature=0.5
-    )
-    gen_time = time.monotonic() - start_t
-    answer = response.choices[0].message.content.replace("**", "").strip()
-
-    # 1) логируем вопрос/ответ
-    cur = conn.cursor()
-    cur.execute(
-        """INSERT INTO logs (timestamp, user_id, username, question, answer) 
-                   VALUES (?,?,?,?,?)""",
-        (datetime.utcnow().isoformat(),
-         msg.from_user.id,
-         msg.from_user.username or "",
-         question, answer)
-    )
-    conn.commit()
-    log_id = cur.lastrowid
-
-    # 2) анализируем ответ и определяем категорию вопроса
-    metrics = Analysis.analyse(question, answer, gen_time)
-    # Классификация вопроса по категориям через API DeepSeek
-    category_resp = await oai.chat.completions.create(
+async def _classify_llm(question: str) -> str:
+    """Классификация вопроса по категориям через API DeepSeek."""
+    category_resp = await llm.call(lambda: oai.chat.completions.create(
         model="deepseek-chat",
         messages=[
             {"role": "system", "content": (
                 "Ты классификатор студенческих вопросов по категориям. "
-                "Доступные категории: Финансовые вопросы, Учеба, Цифровые сервисы и техподдержка, "
-                "Обратная связь, Соц вопросы, Наука, Военка, Внеучебка, Практика, Другое. "
+                f"Доступные категории: {', '.join(Classifier.CATEGORIES)}. "
                 "Определи наиболее подходящую категорию для вопроса пользователя. "
                 "Ответь только названием категории."
             )},
@@ -160,15 +165,237 @@ async def ask_gpt(msg: Message):
         ],
         max_tokens=10,
         temperature=0
+    ), hedge=CLASSIFY_HEDGE_MS / 1000 or None)
+    raw = category_resp.choices[0].message.content.strip()
+    return Classifier.normalize_label(raw) or raw
+
+async def classify_question(question: str) -> tuple[str, str]:
+    """(категория, источник): сначала локальная модель, при низкой
+    уверенности — DeepSeek."""
+    with classify_seconds.time():
+        category = Classifier.classify_local(question)
+        if category:
+            return category, "local"
+        return await _classify_llm(question), "llm"
+
+# фоновый анализ ответов; запускается из Main.main
+pipeline = AnalysisPipeline(db, classify_question, cache=answer_cache)
+
+async def _summarize(summary: str, turns: list[tuple[str, str]]) -> str:
+    """Сводка старых реплик для памяти диалога (Memory.py)."""
+    text = "\n".join(f"Студент: {q}\nБот: {a}" for q, a in turns)
+    resp = await llm.call(lambda: oai.chat.completions.create(
+        model="deepseek-chat",
+        messages=[
+            {"role": "system", "content": (
+                "Сожми переписку студента с ботом учебного офиса в короткую сводку: "
+                "о чём спрашивал студент и какие факты из ответов важны для его "
+                "следующих вопросов. Только сводка, без вступлений."
+            )},
+            {"role": "user", "content": f"Прежняя сводка: {summary or '—'}\n\n{text}"}
+        ],
+        max_tokens=MEMORY_SUMMARY_TOKENS,
+        temperature=0
+    ))
+    return resp.choices[0].message.content.strip()
+
+# память диалога: кольцо реплик + сводка, бюджет токенов (Memory.py)
+memory = ConversationStore(db, _summarize)
+
+REGISTRY.gauge("bot_llm_in_flight", "Одновременных вызовов LLM", fn=lambda: llm_gate.in_flight)
+REGISTRY.gauge("bot_llm_waiting", "Ждут слота LLM", fn=lambda: llm_gate.waiting)
+REGISTRY.gauge("bot_answer_cache_hit_ratio", "Доля попаданий в кэш ответов",
+               fn=lambda: answer_cache.hits / max(1, answer_cache.hits + answer_cache.misses))
+
+def _request(question: str, max_tokens: int, context: list[dict] = (), **extra) -> dict:
+    """Параметры вызова LLM для ответа студенту; context — справка и память диалога."""
+    if LLM_LOGPROBS:
+        extra["logprobs"] = True
+    return dict(
+        model="deepseek-chat",
+        messages=[
+            {"role": "system", "content": PROMPT_SYSTEM},
+            *context,
+            {"role": "user",   "content": question}
+        ],
+        max_tokens=max_tokens,
+        temperature=0.5,
+        **extra
     )
-    category = category_resp.choices[0].message.content.strip()
-    metrics["category"] = category
 
-    Analysis.save(conn, log_id, metrics)
+async def _generate(question: str, max_tokens: int, context: list[dict] = ()) -> Generation:
+    """Ответ целиком, без стриминга."""
+    with llm_seconds.time():
+        response = await llm.call(lambda: oai.chat.completions.create(
+            **_request(question, max_tokens, context)))
+    choice = response.choices[0]
+    gen = Generation(choice.message.content.replace("**", "").strip(),
+                     finish_reason=choice.finish_reason, max_tokens=max_tokens)
+    gen.add_usage(response.usage)
+    gen.add_logprobs(choice.logprobs)
+    return gen
+
+async def _generate_stream(question: str, reply: StreamingReply, max_tokens: int,
+                           context: list[dict] = ()) -> Generation:
+    """Ответ по дельтам с правками сообщения; usage приходит последним чанком."""
+    start_t = time.monotonic()
+    gen = Generation(max_tokens=max_tokens)
+    parts = []
+    # повторы возможны только до начала потока; обрыв посередине — ошибка
+    t0 = time.perf_counter()
+    stream = await llm.call(lambda: oai.chat.completions.create(
+        **_request(question, max_tokens, context, stream=True,
+                   stream_options={"include_usage": True})))
+    try:
+        async for chunk in stream:
+            gen.add_usage(chunk.usage)
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            gen.finish_reason = choice.finish_reason or gen.finish_reason
+            gen.add_logprobs(choice.logprobs)
+            delta = choice.delta.content
+            if not delta:
+                continue
+            if gen.first_token is None:
+                gen.first_token = time.monotonic() - start_t
+            parts.append(delta)
+            await reply.update("".join(parts).replace("**", ""))
+    except openai.APIError:
+        llm.breaker.failure()
+        raise
+    finally:
+        llm_seconds.observe(time.perf_counter() - t0)
+    gen.answer = "".join(parts).replace("**", "").strip()
+    return gen
+
+@router.message(F.text & ~F.via_bot, flags={"llm": True})
+async def ask_gpt(msg: Message):
+    questions_total.inc()
+    in_flight.set(in_flight.value + 1)
+    try:
+        await _answer(msg)
+    finally:
+        in_flight.set(in_flight.value - 1)
+
+async def _answer(msg: Message):
+    question = msg.text
+    start_t = time.monotonic()
+
+    # 0) кэш: одинаковый вопрос от студента с тем же профилем; с памятью
+    #    диалога ответ зависит от контекста — мимо кэша и склейки
+    _reload_prompt()
+    profile = profiles.get(msg.from_user.id) or EMPTY
+    convo = memory.get(msg.from_user.id) if MEMORY else None
+    history = convo.messages() if convo else []
+    history_size = (convo.tokens, len(convo.turns)) if history else (0, 0)
+    cache_key = None if history else make_key(question, *profile)
+    cached = answer_cache.get(cache_key) if cache_key else None
+
+    gen = Generation()      # пустая — если LLM не вызывали (кэш, склейка)
+    found = None            # справка из базы знаний — только для вызова LLM
+    reply = None
+    admission = "direct"
+    if cached:
+        answer, admission = cached.answer, "cache"
+    else:
+        try:
+            # такой же вопрос уже генерируется → ждём его ответ
+            shared = await coalescer.follow(cache_key) if cache_key else None
+            if shared is not None:
+                answer, admission = shared, "coalesced"
+            else:
+                async with coalescer.lead(cache_key or f"user:{msg.from_user.id}:{msg.message_id}") as lead:
+                    # уточнение («а для заочников?») ищем вместе с прошлым вопросом
+                    query = f"{convo.turns[-1][0]} {question}" if history and convo.turns else question
+                    if KNOWLEDGE:
+                        found = knowledge.search(query, profile.campus, profile.education_level)
+                        reference = found.prompt if found.chunks else ""
+                    else:
+                        reference = knowledge.full() if knowledge.chunks else ""
+                    context = [{"role": "system", "content": reference}] if reference else []
+                    context += history
+                    async with llm_gate.slot(on_queued=lambda: msg.answer(
+                            "⏳ Сейчас много вопросов — ваш в очереди, ответ скоро будет.")) as queued:
+                        if queued:
+                            admission = "queued"
+                        # бюджет токенов — по категории, если локальная модель уверена
+                        max_tokens = budget.max_tokens(Classifier.classify_local(question))
+                        if STREAM_REPLIES:
+                            reply = StreamingReply(msg)
+                            await reply.start()
+                            gen = await _generate_stream(question, reply, max_tokens, context)
+                        else:
+                            gen = await _generate(question, max_tokens, context)
+                        answer = gen.answer
+                    lead.set_result(answer)
+        except Overloaded:
+            _record_rejection(msg.from_user.id, "overload")
+            await msg.answer("Сейчас очень много вопросов. Пожалуйста, повторите через минуту.")
+            return
+        except (Unavailable, openai.APIError) as e:
+            # API упал или предохранитель разомкнут — студент всё равно получает ответ
+            logger.error(f"LLM недоступен: {type(e).__name__}: {e}")
+            errors_total.inc()
+            _record_rejection(msg.from_user.id, "upstream")
+            if reply:
+                await reply.finish(UNAVAILABLE_TEXT)
+            else:
+                await msg.answer(UNAVAILABLE_TEXT)
+            return
+    gen_time = time.monotonic() - start_t
+    response_seconds.observe(gen_time)
+    if admission in ("direct", "queued"):       # кэш и склейка не говорят о задержке LLM
+        anomalies.observe_latency("response_time", gen_time)
+        anomalies.observe_latency("first_token_time", gen.first_token)
+    # обрезанный лимитом токенов ответ не раздаём другим студентам
+    if cache_key and admission not in ("cache", "coalesced") and answer \
+            and gen.finish_reason == "stop":
+        answer_cache.put(cache_key, answer, gen_time)
+    if convo is not None and answer:
+        memory.add(msg.from_user.id, question, answer)
+
+    # 1) логируем вопрос/ответ; время генерации сразу кладём в analysis,
+    #    чтобы оно не потерялось, если бот перезапустится до анализа
+    row = (datetime.utcnow().isoformat(),
+           msg.from_user.id,
+           msg.from_user.username or "",
+           question, answer,
+           int(bool(cached)),
+           max(0.0, cached.gen_time - gen_time) if cached else 0.0,
+           cache_key, admission,
+           gen.prompt_tokens, gen.completion_tokens, gen.cached_tokens,
+           gen.finish_reason, gen.max_tokens,
+           *history_size,
+           *((found.tokens, found.saved, found.seconds) if found else (None, None, None)))
+
+    def _insert(c):
+        cur = c.execute(
+            """INSERT INTO logs (timestamp, user_id, username, question, answer,
+                                cache_hit, cache_saved, cache_key, admission,
+                                prompt_tokens, completion_tokens, cached_tokens,
+                                finish_reason, max_tokens, history_tokens, history_turns,
+                                knowledge_tokens, knowledge_saved, retrieval_time)
+                       VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", row)
+        c.execute("""INSERT INTO analysis (log_id, response_time, first_token_time)
+                     VALUES (?,?,?)""", (cur.lastrowid, gen_time, gen.first_token))
+        return cur.lastrowid
 
-    # 3) отправляем ответ пользователю
-    for chunk in textwrap.wrap(answer, 4096, replace_whitespace=False):
-        await msg.answer(chunk, reply_markup=confirm_kb(log_id))
+    log_id = await db.run(_insert)   # log_id нужен для confirm_kb
+
+    # 2) анализ ответа и категория вопроса — в фоне, пользователь не ждёт
+    #    (для ответа из кэша категория уже известна — второй вызов LLM не нужен)
+    pipeline.submit(log_id, question, answer, gen_time,
+                    category=cached.category if cached else None,
+                    cache_key=cache_key, logprobs=gen.logprobs)
+
+    # 3) отправляем ответ пользователю (при стриминге — дописываем последнее
+    #    сообщение и только теперь вешаем кнопки оценки)
+    if reply:
+        await reply.finish(answer, reply_markup=confirm_kb(log_id))
+    else:
+        for chunk in textwrap.wrap(answer, 4096, replace_whitespace=False):
+            await msg.answer(chunk, reply_markup=confirm_kb(log_id))
 
 @router.callback_query(F.data.startswith("confirm_"))
 async def on_confirm(cb: CallbackQuery):
@@ -176,8 +403,14 @@ async def on_confirm(cb: CallbackQuery):
     _, vote, log_id = cb.data.split("_")
     fb = 1 if vote == "yes" else -1
 
-    conn.execute("UPDATE analysis SET user_feedback=? WHERE log_id=?", (fb, log_id))
-    conn.commit()
+    await db.execute("UPDATE analysis SET user_feedback=? WHERE log_id=?", (fb, log_id))
+    row = db.fetchone("SELECT cache_key, campus, education_level, education_type "
+                      "FROM logs WHERE id=?", (log_id,))
+    if row:
+        anomalies.observe_vote(row[1:], fb)     # сегмент — профиль на момент вопроса
+        if fb == -1 and row[0]:
+            # неудачный ответ больше не раздаём из кэша
+            answer_cache.drop(row[0])
 
     await cb.message.edit_reply_markup()
     await cb.answer("Спасибо!" if fb == 1 else "Понял, попробуем иначе.")
\ No newline at end of file
@@ -0,0 +1,260 @@
+# Knowledge.py  ────────────────────────────────────────────────────────
+# База знаний учебного офиса: справка по программам, срокам и правилам
+# лежит не в SYSTEM_PROMPT.txt, а файлами .md / .txt в KNOWLEDGE_DIR.
+# В промпт идёт короткий SYSTEM_PROMPT.txt и только куски справки,
+# подходящие к вопросу, — промпт не растёт вместе с базой.
+#
+#   • Файл режется на куски по абзацам (до KNOWLEDGE_CHUNK_TOKENS токенов);
+#     у каждого куска — заголовок документа (первая строка «# …»).
+#   • Поиск — BM25 по словам, усечённым до KNOWLEDGE_STEM букв (грубая
+#     замена стемминга: стипендия / стипендии / стипендию — один терм).
+#     Индекс в памяти процесса: терм → {кусок: частота}. В промпт — до
+#     KNOWLEDGE_TOP_K кусков не слабее KNOWLEDGE_MIN_SCORE от лучшего.
+#   • В начале файла можно ограничить, кому он нужен:
+#         ---
+#         campus: Москва, Пермь
+#         level: Бакалавр
+#         ---
+#     Кусок такого файла найдётся только студенту с этим кампусом и
+#     уровнем (или без профиля); без заголовка — для всех.
+#   • Индекс строится при старте; refresh() (не чаще KNOWLEDGE_CHECK_SEC)
+#     переиндексирует только добавленные, изменённые и удалённые файлы.
+#     version меняется вместе с файлами — Handlers сбрасывает по нему кэш
+#     ответов.
+#
+# Сколько токенов справки ушло в вызов, сколько сэкономлено против всей
+# базы в промпте и сколько длился поиск — logs.knowledge_tokens /
+# knowledge_saved / retrieval_time (в Dashboard — рядом с токенами).
+# KNOWLEDGE=0 — как раньше: вся база в каждом промпте.
+#
+#   python Knowledge.py "когда пересдача" [--campus Пермь] [--level Бакалавр]
+import os, re, math, time, heapq, hashlib, argparse, logging
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from Metrics import knowledge_seconds
+from Tokens import estimate_tokens
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE              = os.getenv("KNOWLEDGE", "1") == "1"           # 0 — вся база в промпт
+KNOWLEDGE_DIR          = os.getenv("KNOWLEDGE_DIR", str(Path(__file__).with_name("knowledge")))
+KNOWLEDGE_TOP_K        = int(os.getenv("KNOWLEDGE_TOP_K", "4"))
+KNOWLEDGE_TOKENS       = int(os.getenv("KNOWLEDGE_TOKENS", "800"))    # потолок справки в промпте
+KNOWLEDGE_CHUNK_TOKENS = int(os.getenv("KNOWLEDGE_CHUNK_TOKENS", "200"))
+KNOWLEDGE_STEM         = int(os.getenv("KNOWLEDGE_STEM", "6"))
+KNOWLEDGE_MIN_SCORE    = float(os.getenv("KNOWLEDGE_MIN_SCORE", "0.3"))  # доля от лучшего куска
+KNOWLEDGE_CHECK_SEC    = float(os.getenv("KNOWLEDGE_CHECK_SEC", "5"))
+
+BM25_K1, BM25_B = 1.5, 0.75
+SUFFIXES = (".md", ".txt")
+HEADER = "Справка по вопросу (база знаний учебного офиса):"
+# служебные слова: в маленькой базе их idf не успевает стать малым
+STOP = frozenset("""и в во на по за из к ко с со у о об от до для при про не ни но а или
+    ли же бы то как что кто где когда какой какая какие это этот мне мы вы я он она
+    они их его ее есть нет да так уже еще можно нужно ли the and of to in for is""".split())
+
+
+def terms(text: str) -> list[str]:
+    words = re.findall(r"\w\w+", text.lower().replace("ё", "е"))
+    return [w[:KNOWLEDGE_STEM] for w in words if w not in STOP]
+
+
+def _values(line: str) -> frozenset[str]:
+    return frozenset(v.strip().lower() for v in line.split(",") if v.strip())
+
+
+@dataclass
+class Chunk:
+    path: str
+    title: str
+    text: str
+    campus: frozenset[str]      # пусто — для всех
+    level: frozenset[str]
+    tokens: int                 # оценка для промпта (Tokens.estimate_tokens)
+    length: int                 # термов — для нормировки BM25
+
+    def fits(self, campus: Optional[str], level: Optional[str]) -> bool:
+        return ((not self.campus or not campus or campus.lower() in self.campus) and
+                (not self.level or not level or level.lower() in self.level))
+
+
+@dataclass
+class Retrieval:
+    chunks: list[Chunk]
+    seconds: float
+    tokens: int                 # справки в промпте
+    saved: int                  # против всей базы в промпте
+
+    @property
+    def prompt(self) -> str:
+        return "\n\n".join([HEADER, *(f"[{c.title}]\n{c.text}" for c in self.chunks)])
+
+
+def split(path: Path, text: str, limit: int = KNOWLEDGE_CHUNK_TOKENS) -> list[Chunk]:
+    """Файл → куски по абзацам; заголовок «---» в начале — campus / level."""
+    meta = {}
+    lines = text.splitlines()
+    if lines and lines[0].strip() == "---" and "---" in (l.strip() for l in lines[1:]):
+        end = next(i for i in range(1, len(lines)) if lines[i].strip() == "---")
+        for line in lines[1:end]:
+            key, _, value = line.partition(":")
+            meta[key.strip().lower()] = _values(value)
+        lines = lines[end + 1:]
+    head = next((i for i, l in enumerate(lines) if l.startswith("#")), None)
+    title = lines.pop(head).lstrip("#").strip() if head is not None else path.stem
+    body = "\n".join(lines)
+
+    out, part = [], []
+    def flush():
+        if part:
+            t = "\n\n".join(part)
+            out.append(Chunk(str(path), title, t, meta.get("campus", frozenset()),
+                             meta.get("level", frozenset()), estimate_tokens(t),
+                             len(terms(t)) + len(terms(title))))
+            part.clear()
+    for para in re.split(r"\n\s*\n", body):
+        para = para.strip()
+        if not para:
+            continue
+        if part and estimate_tokens("\n\n".join([*part, para])) > limit:
+            flush()
+        part.append(para)
+    flush()
+    return out
+
+
+class KnowledgeBase:
+    def __init__(self, folder: str = KNOWLEDGE_DIR):
+        self.folder = Path(folder)
+        self.files: dict[str, tuple[int, int, list[int]]] = {}  # путь → (mtime, размер, куски)
+        self.chunks: dict[int, Chunk] = {}
+        self.postings: dict[str, dict[int, int]] = {}            # терм → {кусок: частота}
+        self.total_len = 0
+        self.full_tokens = 0        # вся база в промпте — для подсчёта экономии
+        self.version = ""
+        self._full: Optional[str] = None
+        self._next = 0
+        self._checked = 0.0
+        self.refresh(force=True)
+
+    # ── индекс ─────────────────────────────────────────────────
+    def refresh(self, force: bool = False) -> bool:
+        """Переиндексирует изменившиеся файлы; True — индекс изменился."""
+        now = time.monotonic()
+        if not force and now - self._checked < KNOWLEDGE_CHECK_SEC:
+            return False
+        self._checked = now
+        seen = {}
+        if self.folder.is_dir():
+            for p in sorted(self.folder.rglob("*")):
+                if p.suffix.lower() in SUFFIXES and p.is_file():
+                    st = p.stat()
+                    seen[str(p)] = (st.st_mtime_ns, st.st_size)
+        changed = False
+        for path in [p for p in self.files if p not in seen]:
+            self._remove(path)
+            changed = True
+        for path, stamp in seen.items():
+            if self.files.get(path, (None, None))[:2] != stamp:
+                self._remove(path)
+                self._add(path, stamp)
+                changed = True
+        if changed:
+            self.full_tokens = sum(c.tokens for c in self.chunks.values())
+            self.version = hashlib.sha1(repr(sorted(seen.items())).encode()).hexdigest()[:12]
+            self._full = None
+            logger.info(f"База знаний: {len(self.files)} файлов, {len(self.chunks)} кусков")
+        return changed
+
+    def _add(self, path: str, stamp: tuple[int, int]) -> None:
+        try:
+            text = Path(path).read_text(encoding="utf-8")
+        except (OSError, UnicodeDecodeError) as e:
+            logger.error(f"База знаний: {path} не прочитан: {e}")
+            text = ""
+        ids = []
+        for chunk in split(Path(path), text):
+            cid, self._next = self._next, self._next + 1
+            self.chunks[cid] = chunk
+            for t, n in Counter(terms(chunk.title + "\n" + chunk.text)).items():
+                self.postings.setdefault(t, {})[cid] = n
+            self.total_len += chunk.length
+            ids.append(cid)
+        self.files[path] = (*stamp, ids)
+
+    def _remove(self, path: str) -> None:
+        if path not in self.files:
+            return
+        for cid in self.files.pop(path)[2]:
+            chunk = self.chunks.pop(cid)
+            self.total_len -= chunk.length
+            for t in set(terms(chunk.title + "\n" + chunk.text)):
+                docs = self.postings[t]
+                del docs[cid]
+                if not docs:
+                    del self.postings[t]
+
+    # ── поиск ──────────────────────────────────────────────────
+    def search(self, question: str, campus: Optional[str] = None, level: Optional[str] = None,
+               *, k: int = KNOWLEDGE_TOP_K, budget: int = KNOWLEDGE_TOKENS) -> Retrieval:
+        """Лучшие по BM25 куски для профиля студента, не больше k и budget токенов."""
+        t0 = time.perf_counter()
+        n = len(self.chunks)
+        avg = self.total_len / n if n else 1.0
+        scores: dict[int, float] = {}
+        fits: dict[int, bool] = {}
+        for t in set(terms(question)):
+            docs = self.postings.get(t)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for cid, tf in docs.items():
+                if cid not in fits:
+                    fits[cid] = self.chunks[cid].fits(campus, level)
+                if fits[cid]:
+                    length = self.chunks[cid].length
+                    scores[cid] = scores.get(cid, 0.0) + idf * tf * (BM25_K1 + 1) / (
+                        tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg))
+        found, used = [], 0
+        best = max(scores.values(), default=0.0)
+        for cid in heapq.nlargest(k, scores, key=scores.get):
+            chunk = self.chunks[cid]
+            if scores[cid] >= best * KNOWLEDGE_MIN_SCORE and used + chunk.tokens <= budget:
+                found.append(chunk)
+                used += chunk.tokens
+        seconds = time.perf_counter() - t0
+        knowledge_seconds.observe(seconds)
+        return Retrieval(found, seconds, used, max(0, self.full_tokens - used))
+
+    def full(self) -> str:
+        """Вся база одним текстом — для KNOWLEDGE=0."""
+        if self._full is None:
+            chunks = sorted(self.chunks.items())
+            self._full = Retrieval([c for _, c in chunks], 0.0, self.full_tokens, 0).prompt
+        return self._full
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Поиск по базе знаний, как его видит бот")
+    ap.add_argument("question")
+    ap.add_argument("--dir", default=KNOWLEDGE_DIR)
+    ap.add_argument("--campus")
+    ap.add_argument("--level")
+    ap.add_argument("--k", type=int, default=KNOWLEDGE_TOP_K)
+    args = ap.parse_args()
+    t0 = time.perf_counter()
+    kb = KnowledgeBase(args.dir)
+    print(f"Индекс: {len(kb.files)} файлов, {len(kb.chunks)} кусков, "
+          f"{kb.full_tokens} токенов за {(time.perf_counter() - t0) * 1000:.1f} мс")
+    r = kb.search(args.question, args.campus, args.level, k=args.k)
+    for c in r.chunks:
+        print(f"\n── {Path(c.path).name} · {c.title} ({c.tokens} ток.)\n{c.text}")
+    print(f"\nСправка: {r.tokens} токенов вместо {kb.full_tokens} "
+          f"(−{r.saved}), поиск {r.seconds * 1000:.2f} мс")
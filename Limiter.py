@@ -0,0 +1,166 @@
+# Limiter.py  ──────────────────────────────────────────────────────────
+# Контроль нагрузки перед обращением к LLM:
+#   • RateLimitMiddleware — «ведро токенов» на пользователя (спам отсекается
+#     ещё до хендлера, у хендлера должен быть флаг llm);
+#   • LLMGate — общий семафор на одновременные вызовы LLM с ограниченной
+#     очередью ожидания (переполнена → Overloaded);
+#   • Coalescer — одинаковые вопросы «в полёте» ждут один общий ответ.
+import os, time, asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message
+from dotenv import load_dotenv
+
+load_dotenv()
+
+USER_RATE_PER_MIN = float(os.getenv("USER_RATE_PER_MIN", "6"))  # вопросов в минуту
+USER_BURST        = float(os.getenv("USER_BURST", "3"))          # подряд без ожидания
+LLM_CONCURRENCY   = int(os.getenv("LLM_CONCURRENCY", "8"))       # одновременных вызовов
+LLM_QUEUE         = int(os.getenv("LLM_QUEUE", "32"))            # ждущих в очереди
+
+
+class Overloaded(Exception):
+    """Очередь к LLM заполнена — вопрос не принят."""
+
+
+# ── ведро токенов ──────────────────────────────────────────────
+class TokenBucket:
+    __slots__ = ("tokens", "stamp", "warned")
+
+    def __init__(self, burst: float):
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.warned = False      # предупреждение уже отправлено в этом «окне»
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    def __init__(self, rate_per_min: float = USER_RATE_PER_MIN,
+                 burst: float = USER_BURST,
+                 record: Optional[Callable[[int, str], None]] = None):
+        self.rate = rate_per_min / 60
+        self.burst = burst
+        self.record = record
+        self.buckets: dict[int, TokenBucket] = {}
+        self.rejected = 0
+        self._last_prune = time.monotonic()
+
+    def take(self, user_id: int) -> tuple[bool, TokenBucket]:
+        now = time.monotonic()
+        b = self.buckets.get(user_id)
+        if b is None:
+            b = self.buckets[user_id] = TokenBucket(self.burst)
+        b.tokens = min(self.burst, b.tokens + (now - b.stamp) * self.rate)
+        b.stamp = now
+        if b.tokens >= 1:
+            b.tokens -= 1
+            b.warned = False
+            return True, b
+        return False, b
+
+    def _prune(self) -> None:
+        # полные (давно неактивные) вёдра хранить незачем
+        now = time.monotonic()
+        if now - self._last_prune < 300:
+            return
+        self._last_prune = now
+        idle = self.burst / self.rate if self.rate else 3600
+        for uid in [u for u, b in self.buckets.items() if now - b.stamp > idle]:
+            del self.buckets[uid]
+
+    async def __call__(self, handler: Callable[[Message, Dict[str, Any]], Awaitable[Any]],
+                       event: Message, data: Dict[str, Any]) -> Any:
+        if not get_flag(data, "llm"):
+            return await handler(event, data)
+        self._prune()
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        ok, bucket = self.take(user.id)
+        if ok:
+            return await handler(event, data)
+        self.rejected += 1
+        if self.record:
+            self.record(user.id, "rate")
+        if not bucket.warned:
+            bucket.warned = True
+            wait = (1 - bucket.tokens) / self.rate if self.rate else 60
+            await event.answer(f"Слишком много вопросов подряд — "
+                               f"попробуйте через {max(1, round(wait))} сек.")
+        return None
+
+
+# ── общий семафор на LLM ───────────────────────────────────────
+class LLMGate:
+    def __init__(self, limit: int = LLM_CONCURRENCY, max_waiting: int = LLM_QUEUE):
+        self._sem = asyncio.Semaphore(limit)
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.waiting = 0
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self, on_queued: Optional[Callable[[], Awaitable[Any]]] = None):
+        """Слот на вызов LLM; yield True, если пришлось ждать в очереди."""
+        queued = self._sem.locked()
+        if queued:
+            if self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise Overloaded()
+            self.waiting += 1
+            self.queued += 1
+            try:
+                if on_queued:
+                    await on_queued()
+                await self._sem.acquire()
+            finally:
+                self.waiting -= 1
+        else:
+            await self._sem.acquire()
+        self.in_flight += 1
+        try:
+            yield queued
+        finally:
+            self.in_flight -= 1
+            self._sem.release()
+
+
+# ── склейка одинаковых вопросов ────────────────────────────────
+class Coalescer:
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.coalesced = 0
+
+    async def follow(self, key: str) -> Optional[Any]:
+        """Результат уже идущего запроса с тем же ключом (или None)."""
+        fut = self._inflight.get(key)
+        if fut is None:
+            return None
+        self.coalesced += 1
+        try:
+            return await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            if fut.cancelled():
+                return None      # ведущий отменён — пусть спросит сам
+            raise
+
+    @asynccontextmanager
+    async def lead(self, key: str):
+        """Ведущий запрос: остальные с тем же ключом получат fut.set_result(...)."""
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            yield fut
+        except Exception as e:
+            if not fut.done():
+                fut.set_exception(e)
+                fut.exception()     # ведомых может не быть — не шумим в логе
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            if not fut.done():
+                fut.cancel()
@@ -1,43 +1,117 @@
 # Main.py  ─────────────────────────────────────────────────────────────
-import asyncio, logging, os, sys, sqlite3
-from datetime import datetime
+import asyncio, logging, os, sys, secrets
+from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
-from Handlers import router
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from Handlers import router, pipeline, db, oai, budget, anomalies, memory
+from Storage import make_storage
+import Metrics
+from Anomaly import ANOMALY_CHAT_ID
 from dotenv import load_dotenv
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
-dp = Dispatcher()
-
-# ——— функция-пульс — обновляет таблицу heartbeat каждую минуту ———
-async def heartbeat_loop(db_path: str = "bot_logs.db"):
-    while True:
-        try:
-            conn = sqlite3.connect(db_path)
-            conn.execute("""CREATE TABLE IF NOT EXISTS heartbeat
-                            (id INTEGER PRIMARY KEY CHECK (id = 1),
-                             ts TEXT)""")
-            conn.execute("INSERT OR REPLACE INTO heartbeat (id, ts) VALUES (1,?)",
-                         (datetime.utcnow().isoformat(),))
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            logging.error(f"Heartbeat error: {e}")
-        await asyncio.sleep(5)        # ← период, при желании измените
-# ───────────────────────────────────────────────────────────────────────
+# ——— режим приёма апдейтов: polling (по умолчанию) или webhook ———
+BOT_MODE                = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL             = os.getenv("WEBHOOK_URL", "")          # https://bot.example.com
+WEBHOOK_PATH            = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET          = os.getenv("WEBHOOK_SECRET")           # X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST            = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT            = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))  # 1…100
+# свой адрес Bot API (локальный сервер или FakeTelegram.py); пусто — api.telegram.org
+TELEGRAM_API_URL        = os.getenv("TELEGRAM_API_URL", "")
+
+# FSM-хранилище опроса: memory | sqlite | redis (FSM_STORAGE)
+dp = Dispatcher(storage=make_storage(db))
+
+async def run_webhook(bot: Bot) -> None:
+    """aiohttp-сервер для апдейтов: Telegram сразу получает 200,
+    а каждый апдейт обрабатывается в отдельной задаче."""
+    # без секрета кто угодно мог бы слать на открытый адрес поддельные
+    # апдейты; webhook ставится при каждом запуске, так что случайный
+    # секрет на время процесса ничем не хуже заданного
+    secret = WEBHOOK_SECRET
+    if not secret:
+        secret = secrets.token_urlsafe(32)
+        logging.warning("WEBHOOK_SECRET не задан — сгенерирован случайный на время запуска")
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot,
+        secret_token=secret,            # чужие запросы без заголовка → 401
+        handle_in_background=True,
+    ).register(app, path=WEBHOOK_PATH)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    await bot.set_webhook(
+        f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=secret,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logging.info(f"Webhook: слушаем {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await dp.emit_startup(bot=bot)
+        await asyncio.Event().wait()      # работаем до остановки процесса
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await runner.cleanup()
 
 async def main() -> None:
-    bot = Bot(token=BOT_TOKEN,
+    session = None
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    bot = Bot(token=BOT_TOKEN, session=session,
               default=DefaultBotProperties(parse_mode=ParseMode.HTML))
     dp.include_router(router)
+    bot.session.middleware(Metrics.telegram_middleware())   # время запросов к Bot API
+
+    # фоновые задачи: ссылки держим сами — event loop хранит только слабые
+    background: set[asyncio.Task] = set()
+    def spawn(coro) -> None:
+        task = asyncio.create_task(coro)
+        background.add(task)
+        task.add_done_callback(background.discard)
 
-    # запускаем пульс параллельно с polling
-    asyncio.create_task(heartbeat_loop())
+    # метрики: задержка event loop, агрегаты в SQLite (по ним дашборд видит,
+    # что бот жив) и /metrics для Prometheus
+    spawn(Metrics.loop_lag_monitor())
+    spawn(Metrics.persist_loop(db))
+    spawn(budget.refresh_loop())     # max_tokens по категориям
+    # аномалии задержек и дизлайков → таблица alerts (+ чат, если задан)
+    notify = (lambda text: bot.send_message(ANOMALY_CHAT_ID, text)) if ANOMALY_CHAT_ID else None
+    spawn(anomalies.run(notify))
+    spawn(memory.expire_loop())      # память диалогов после простоя
+    metrics_runner = await Metrics.serve() if Metrics.METRICS_PORT else None
+    # фоновый анализ ответов (+ дообработка строк, оставшихся без анализа)
+    await pipeline.start()
 
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(bot)
+        else:
+            await bot.delete_webhook()    # иначе getUpdates вернёт конфликт
+            await dp.start_polling(bot)
+    finally:
+        await pipeline.stop()
+        await memory.stop()
+        tasks = list(background)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await oai.close()   # закрываем общий httpx-пул
+        await dp.storage.close()
+        db.close()      # дописываем очередь записей
+        await bot.session.close()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
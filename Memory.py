@@ -0,0 +1,185 @@
+# Memory.py  ───────────────────────────────────────────────────────────
+# Память диалога: уточнения («а для заочников?») понимаются в контексте
+# прошлых реплик, но промпт не растёт вместе с историей.
+#
+#   • Кольцо последних реплик (вопрос + ответ, длинный ответ обрезан до
+#     MEMORY_ANSWER_CHARS) и сводка более старых. Сводка + реплики — не
+#     больше MEMORY_TOKENS токенов (оценка по длине, Tokens.estimate_tokens):
+#     что не влезает, вытесняется из кольца и в фоне сжимается LLM в
+#     сводку (не длиннее MEMORY_SUMMARY_TOKENS); до этого в промпт не идёт.
+#   • После MEMORY_IDLE_MIN минут тишины память забывается — новый вопрос
+#     начинает новый разговор.
+#   • Хранится в таблице conversations (строка на студента, сквозная запись
+#     через поток-писатель Db); в памяти процесса — LRU на
+#     MEMORY_CACHE_SIZE студентов, остальные читаются из базы по первому
+#     вопросу, а не все при старте.
+#
+# Сколько токенов памяти и реплик ушло в каждый вызов — logs.history_tokens
+# / history_turns (в Dashboard — рядом с prompt_tokens и временем ответа).
+import os, json, time, asyncio, logging
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+from dotenv import load_dotenv
+
+from Db import Database
+from Metrics import memory_summary_seconds
+from Tokens import estimate_tokens
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MEMORY                = os.getenv("MEMORY", "1") == "1"               # 0 — без памяти
+MEMORY_TOKENS         = int(os.getenv("MEMORY_TOKENS", "600"))        # сводка + реплики
+MEMORY_TURNS          = int(os.getenv("MEMORY_TURNS", "6"))           # реплик в кольце
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "150"))
+MEMORY_ANSWER_CHARS   = int(os.getenv("MEMORY_ANSWER_CHARS", "600"))
+MEMORY_IDLE_MIN       = float(os.getenv("MEMORY_IDLE_MIN", "30"))
+MEMORY_CACHE_SIZE     = int(os.getenv("MEMORY_CACHE_SIZE", "10000"))
+
+# (прежняя сводка, вытесненные реплики) → новая сводка
+Summarizer = Callable[[str, list[tuple[str, str]]], Awaitable[str]]
+
+
+@dataclass
+class Conversation:
+    summary: str = ""
+    turns: deque = field(default_factory=deque)     # [вопрос, ответ, токенов]
+    pending: list = field(default_factory=list)     # вытеснены, ждут сводки
+    updated: float = 0.0                            # time.time() последней реплики
+    compacting: bool = False
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.summary) + sum(t[2] for t in self.turns)
+
+    def messages(self) -> list[dict]:
+        """Память для промпта: сводка и реплики в формате chat API."""
+        out = []
+        if self.summary:
+            out.append({"role": "system",
+                        "content": f"Кратко о прошлом разговоре со студентом: {self.summary}"})
+        for q, a, _ in self.turns:
+            out.append({"role": "user", "content": q})
+            out.append({"role": "assistant", "content": a})
+        return out
+
+
+class ConversationStore:
+    def __init__(self, db: Database, summarize: Optional[Summarizer] = None, *,
+                 budget: int = MEMORY_TOKENS, size: int = MEMORY_CACHE_SIZE):
+        self.db = db
+        self.summarize = summarize
+        self.budget = budget
+        self.size = size
+        self.mem: OrderedDict[int, Conversation] = OrderedDict()
+        self.summaries = 0
+        self._tasks: set[asyncio.Task] = set()      # сводки в фоне (ссылки — от GC)
+
+    def get(self, user_id: int) -> Conversation:
+        """Текущий разговор студента (пустой — если нет или истёк)."""
+        c = self.mem.get(user_id)
+        if c is None:
+            c = self._load(user_id)
+        if c.updated and time.time() - c.updated > MEMORY_IDLE_MIN * 60:
+            c = Conversation()
+        self.mem[user_id] = c
+        self.mem.move_to_end(user_id)
+        while len(self.mem) > self.size:
+            self.mem.popitem(last=False)
+        return c
+
+    def add(self, user_id: int, question: str, answer: str) -> None:
+        """Реплика в кольцо; лишнее — в очередь на сводку (в фоне)."""
+        c = self.get(user_id)
+        if len(answer) > MEMORY_ANSWER_CHARS:
+            answer = answer[:MEMORY_ANSWER_CHARS].rsplit(" ", 1)[0] + " …"
+        c.turns.append([question, answer, estimate_tokens(question) + estimate_tokens(answer)])
+        c.updated = time.time()
+        while c.turns and (len(c.turns) > MEMORY_TURNS or c.tokens > self.budget):
+            c.pending.append(c.turns.popleft())
+        self._save(user_id, c)
+        if c.pending and not c.compacting:
+            c.compacting = True     # сразу: задача стартует не раньше следующего шага loop
+            self._spawn(self._compact(user_id, c))
+
+    def forget(self, user_id: int) -> None:
+        self.mem.pop(user_id, None)
+        self.db.submit("DELETE FROM conversations WHERE user_id = ?", (user_id,))
+
+    async def expire_loop(self, interval: float = MEMORY_IDLE_MIN * 60) -> None:
+        """Удаляет из базы и памяти разговоры, молчащие дольше MEMORY_IDLE_MIN."""
+        while True:
+            await asyncio.sleep(interval)
+            cutoff = time.time() - MEMORY_IDLE_MIN * 60
+            for user_id in [u for u, c in self.mem.items() if c.updated < cutoff]:
+                del self.mem[user_id]
+            self.db.submit("DELETE FROM conversations WHERE updated < ?", (cutoff,))
+
+    async def stop(self) -> None:
+        """Отменяет незаконченные сводки: вытесненные реплики уже в базе
+        (pending) и сведутся после перезапуска."""
+        tasks = list(self._tasks)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ── внутреннее ─────────────────────────────────────────────
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _compact(self, user_id: int, c: Conversation) -> None:
+        try:
+            while c.pending:
+                batch = [(q, a) for q, a, _ in c.pending]
+                summary = None
+                if self.summarize:
+                    try:
+                        with memory_summary_seconds.time():
+                            summary = await self.summarize(c.summary, batch)
+                        self.summaries += 1
+                    except Exception as e:
+                        logger.error(f"Memory summary error: {e}")
+                if summary is None:     # LLM недоступен — хотя бы темы вопросов
+                    summary = "; ".join(filter(None, [c.summary, *(q for q, _ in batch)]))
+                del c.pending[:len(batch)]
+                c.summary = self._fit(summary, MEMORY_SUMMARY_TOKENS)
+                # сводка подросла — вытесняем старые реплики дальше
+                while c.turns and c.tokens > self.budget:
+                    c.pending.append(c.turns.popleft())
+                if self.mem.get(user_id) is c:      # не истёк и не забыт за время сводки
+                    self._save(user_id, c)
+        finally:
+            c.compacting = False
+
+    @staticmethod
+    def _fit(text: str, tokens: int) -> str:
+        """Обрезает текст с начала, пока он длиннее tokens (свежее — в конце)."""
+        while text and estimate_tokens(text) > tokens:
+            text = text[len(text) // 4:].split(" ", 1)[-1]
+        return text
+
+    def _save(self, user_id: int, c: Conversation) -> None:
+        self.db.submit(
+            "INSERT OR REPLACE INTO conversations (user_id, summary, turns, updated) "
+            "VALUES (?,?,?,?)",
+            (user_id, c.summary,
+             json.dumps({"turns": list(c.turns), "pending": c.pending}, ensure_ascii=False),
+             c.updated))
+
+    def _load(self, user_id: int) -> Conversation:
+        row = self.db.fetchone(
+            "SELECT summary, turns, updated FROM conversations WHERE user_id = ?", (user_id,))
+        if row is None:
+            return Conversation()
+        data = json.loads(row[1] or "{}")
+        c = Conversation(row[0] or "", deque(data.get("turns", [])),
+                         data.get("pending", []), row[2] or 0.0)
+        if c.pending and self.summarize:
+            c.compacting = True
+            self._spawn(self._compact(user_id, c))     # после перезапуска
+        return c
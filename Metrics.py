@@ -0,0 +1,251 @@
+# Metrics.py  ──────────────────────────────────────────────────────────
+# Метрики бота в памяти процесса: счётчики, гистограммы задержек и
+# датчики (gauge). Отдаются в формате Prometheus на METRICS_PORT/metrics
+# и раз в METRICS_PERSIST_SEC сохраняются в таблицу metrics компактными
+# агрегатами за окно — их читает Dashboard.py (статус бота и системные
+# метрики) вместо сырых строк и старой таблицы heartbeat.
+import os, json, time, asyncio, logging, threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+METRICS_HOST        = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT        = int(os.getenv("METRICS_PORT", "9100"))          # 0 — без HTTP
+METRICS_PERSIST_SEC = float(os.getenv("METRICS_PERSIST_SEC", "15"))
+METRICS_KEEP_DAYS   = float(os.getenv("METRICS_KEEP_DAYS", "7"))
+
+# границы корзин, сек: от миллисекунд (БД, классификатор) до минуты (LLM)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name, self.help = name, help
+        self.value = 0.0
+        self._last = 0.0
+
+    def inc(self, n: float = 1.0) -> None:
+        self.value += n
+
+    def render(self) -> list[str]:
+        return [f"{self.name} {self.value}"]      # имя — сразу с _total, как в HELP/TYPE
+
+    def snapshot(self) -> dict:
+        delta, self._last = self.value - self._last, self.value
+        return {"value": delta}
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Optional[Callable[[], float]] = None):
+        self.name, self.help = name, help
+        self.fn = fn            # значение снимается в момент чтения
+        self.value = 0.0
+
+    def set(self, v: float) -> None:
+        self.value = v
+
+    def get(self) -> float:
+        return float(self.fn()) if self.fn else self.value
+
+    def render(self) -> list[str]:
+        return [f"{self.name} {self.get()}"]
+
+    def snapshot(self) -> dict:
+        return {"value": self.get()}
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        self.name, self.help = name, help
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)      # последняя — +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()                    # пишут и из потока Db
+        self._last = ([0] * len(self.counts), 0, 0.0)
+
+    def observe(self, v: float) -> None:
+        i = bisect_left(self.bounds, v)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += v
+
+    @contextmanager
+    def time(self):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0)
+
+    def render(self) -> list[str]:
+        out, acc = [], 0
+        for le, n in zip(self.bounds + ("+Inf",), self.counts):
+            acc += n
+            out.append(f'{self.name}_bucket{{le="{le}"}} {acc}')
+        out.append(f"{self.name}_sum {self.sum}")
+        out.append(f"{self.name}_count {self.count}")
+        return out
+
+    def snapshot(self) -> dict:
+        """Приращение с прошлого снимка: count, sum и корзины {le: n}."""
+        with self._lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        last_counts, last_count, last_sum = self._last
+        self._last = (counts, count, total)
+        delta = [a - b for a, b in zip(counts, last_counts)]
+        buckets = {str(le): n for le, n in zip(self.bounds + ("+Inf",), delta) if n}
+        return {"count": count - last_count, "sum": total - last_sum,
+                "buckets": json.dumps(buckets)}
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, object] = {}
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help))
+
+    def gauge(self, name: str, help: str, fn: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.metrics.setdefault(name, Gauge(name, help, fn))
+
+    def histogram(self, name: str, help: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for m in self.metrics.values():
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ── метрики бота ───────────────────────────────────────────────
+response_seconds = REGISTRY.histogram("bot_response_seconds", "Время ответа студенту (вопрос → готовый ответ)")
+llm_seconds      = REGISTRY.histogram("bot_llm_seconds", "Вызов LLM для ответа")
+classify_seconds = REGISTRY.histogram("bot_classify_seconds", "Определение категории (локально или LLM)")
+analysis_seconds = REGISTRY.histogram("bot_analysis_seconds", "Analysis.analyse_many (пачка заданий) в пуле процессов")
+memory_summary_seconds = REGISTRY.histogram("bot_memory_summary_seconds", "Сжатие старых реплик диалога в сводку")
+knowledge_seconds = REGISTRY.histogram("bot_knowledge_seconds", "Поиск справки в базе знаний (BM25)",
+                                       buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                                                0.005, 0.01, 0.025, 0.05, 0.1))
+db_write_seconds = REGISTRY.histogram("bot_db_write_seconds", "Транзакция пачки записей в SQLite")
+tg_send_seconds  = REGISTRY.histogram("bot_telegram_send_seconds", "Запрос к Telegram Bot API")
+questions_total  = REGISTRY.counter("bot_questions_total", "Принятые вопросы")
+errors_total     = REGISTRY.counter("bot_errors_total", "Ошибки обработки вопроса")
+in_flight        = REGISTRY.gauge("bot_in_flight", "Вопросов в обработке прямо сейчас")
+loop_lag         = REGISTRY.gauge("bot_event_loop_lag_seconds", "Задержка event loop")
+
+
+# ── фоновые задачи ─────────────────────────────────────────────
+async def loop_lag_monitor(interval: float = 0.5) -> None:
+    """Насколько позже запланированного просыпается корутина."""
+    while True:
+        t0 = time.perf_counter()
+        await asyncio.sleep(interval)
+        loop_lag.set(max(0.0, time.perf_counter() - t0 - interval))
+
+
+async def persist_loop(db, interval: float = METRICS_PERSIST_SEC) -> None:
+    """Раз в interval пишет агрегаты за окно в таблицу metrics."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await persist(db)
+        except Exception as e:
+            logger.error(f"Metrics persist error: {e}")
+
+
+async def persist(db) -> None:
+    ts = datetime.utcnow().isoformat()
+    rows = []
+    for m in REGISTRY.metrics.values():
+        snap = m.snapshot()
+        rows.append((ts, m.name, m.kind, snap.get("value"), snap.get("count"),
+                     snap.get("sum"), snap.get("buckets")))
+    cutoff = (datetime.utcnow() - timedelta(days=METRICS_KEEP_DAYS)).isoformat()
+
+    def _write(c):
+        c.executemany("INSERT INTO metrics (ts, name, kind, value, count, sum, buckets) "
+                      "VALUES (?,?,?,?,?,?,?)", rows)
+        c.execute("DELETE FROM metrics WHERE ts < ?", (cutoff,))
+
+    await db.run(_write)
+
+
+async def serve(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """HTTP /metrics в формате Prometheus; возвращает runner для остановки."""
+    from aiohttp import web
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=REGISTRY.render(),
+                            content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics: http://{host}:{port}/metrics")
+    return runner
+
+
+# ── Telegram: замер каждого запроса к Bot API ──────────────────
+def telegram_middleware():
+    from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+    class TelegramTiming(BaseRequestMiddleware):
+        async def __call__(self, make_request, bot, method):
+            with tg_send_seconds.time():
+                return await make_request(bot, method)
+
+    return TelegramTiming()
+
+
+# ── чтение агрегатов (Dashboard) ───────────────────────────────
+def merge_buckets(rows: list[str]) -> dict[float, int]:
+    """Складывает JSON-корзины нескольких окон: {граница: n}."""
+    total: dict[float, int] = {}
+    for raw in rows:
+        for le, n in json.loads(raw or "{}").items():
+            b = float("inf") if le == "+Inf" else float(le)
+            total[b] = total.get(b, 0) + n
+    return total
+
+
+def quantile(buckets: dict[float, int], q: float,
+             bounds=DEFAULT_BUCKETS) -> Optional[float]:
+    """Квантиль по корзинам с линейной интерполяцией внутри корзины
+    (как histogram_quantile в Prometheus)."""
+    n = sum(buckets.values())
+    if not n:
+        return None
+    need, acc = q * n, 0
+    edges = sorted(set(bounds) | set(buckets))
+    for i, le in enumerate(edges):
+        k = buckets.get(le, 0)
+        if k and acc + k >= need:
+            lo = edges[i - 1] if i else 0.0
+            if le == float("inf"):
+                return lo
+            return lo + (le - lo) * (need - acc) / k
+        acc += k
+    return None
@@ -0,0 +1,227 @@
+# Pipeline.py  ─────────────────────────────────────────────────────────
+# Фоновый анализ ответов: ask_gpt только кладёт задание в очередь,
+# а тяжёлый Analysis.analyse и классификация выполняются отдельно.
+# Если категорию определить не удалось (LLM недоступен), метрики ответа
+# всё равно сохраняются с category = NULL, а классификация только этих
+# строк повторяется позже (LABEL_RETRIES раз, затем — recover при старте).
+import os, time, asyncio, logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+from dotenv import load_dotenv
+
+import Analysis
+from Db import Database
+from Metrics import analysis_seconds, REGISTRY
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_WORKERS     = int(os.getenv("ANALYSIS_WORKERS", "2"))      # корутины-обработчики
+ANALYSIS_PROCESSES   = int(os.getenv("ANALYSIS_PROCESSES", "2"))    # процессы под analyse
+CLASSIFY_CONCURRENCY = int(os.getenv("CLASSIFY_CONCURRENCY", "4"))  # одновременных вызовов LLM
+ANALYSIS_BATCH       = int(os.getenv("ANALYSIS_BATCH", "32"))       # заданий за один analyse_many
+REPORT_INTERVAL      = float(os.getenv("ANALYSIS_REPORT_SEC", "60"))
+LABEL_RETRIES        = int(os.getenv("ANALYSIS_LABEL_RETRIES", "3"))
+LABEL_RETRY_SEC      = float(os.getenv("ANALYSIS_LABEL_RETRY_SEC", "30"))  # база паузы, ×2 за попытку
+
+
+@dataclass
+class Job:
+    log_id: int
+    question: str
+    answer: str
+    gen_time: Optional[float]
+    category: Optional[str] = None      # уже известна (ответ из кэша)
+    cache_key: Optional[str] = None     # куда дописать категорию в кэше
+    logprobs: Optional[list[float]] = None   # при LLM_LOGPROBS → confidence
+    enqueued: float = field(default_factory=time.monotonic)
+
+
+class AnalysisPipeline:
+    """Очередь заданий анализа + пул процессов + ограничение классификации."""
+
+    def __init__(self, db: Database,
+                 classify: Callable[[str], Awaitable[tuple[str, str]]], *,
+                 cache=None,
+                 workers: int = ANALYSIS_WORKERS,
+                 processes: int = ANALYSIS_PROCESSES,
+                 classify_concurrency: int = CLASSIFY_CONCURRENCY,
+                 batch: int = ANALYSIS_BATCH):
+        self.db = db
+        self.classify = classify
+        self.cache = cache
+        self.workers = workers
+        self.processes = processes
+        self.classify_concurrency = classify_concurrency
+        self.batch = batch
+        self.queue: asyncio.Queue[Job] = asyncio.Queue()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._tasks: list[asyncio.Task] = []
+        self._retries: set[asyncio.Task] = set()
+        # статистика для отчёта
+        self.done = 0
+        self.failed = 0
+        self.unlabeled = 0      # сохранены без категории, ждут повтора
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        REGISTRY.gauge("bot_analysis_queue_depth", "Заданий в очереди анализа",
+                       fn=self.queue.qsize)
+        REGISTRY.gauge("bot_analysis_lag_seconds", "Задержка последнего анализа",
+                       fn=lambda: self.last_lag)
+
+    # ── жизненный цикл ─────────────────────────────────────────
+    async def start(self) -> None:
+        self._pool = ProcessPoolExecutor(max_workers=self.processes)
+        self._sem = asyncio.Semaphore(self.classify_concurrency)
+        recovered = self.recover()
+        if recovered:
+            logger.info(f"Analysis pipeline: {recovered} строк logs без анализа поставлены в очередь")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        if REPORT_INTERVAL > 0:
+            self._tasks.append(asyncio.create_task(self._report_loop()))
+
+    async def stop(self) -> None:
+        tasks = [*self._tasks, *self._retries]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    # ── постановка заданий ─────────────────────────────────────
+    def submit(self, log_id: int, question: str, answer: str,
+               gen_time: Optional[float], *, category: Optional[str] = None,
+               cache_key: Optional[str] = None,
+               logprobs: Optional[list[float]] = None) -> None:
+        self.queue.put_nowait(Job(log_id, question, answer, gen_time,
+                                  category, cache_key, logprobs))
+
+    def recover(self) -> int:
+        """Ставит в очередь строки logs, для которых анализ ещё не записан
+        (например, бот был остановлен до того, как воркер их обработал)."""
+        rows = self.db.fetchall("""
+            SELECT logs.id, logs.question, logs.answer
+            FROM logs LEFT JOIN analysis ON analysis.log_id = logs.id
+            WHERE analysis.log_id IS NULL OR analysis.word_count IS NULL
+               OR analysis.category IS NULL
+            ORDER BY logs.id
+        """)
+        for log_id, question, answer in rows:
+            self.submit(log_id, question or "", answer or "", None)
+        return len(rows)
+
+    # ── статистика ─────────────────────────────────────────────
+    def stats(self) -> dict:
+        """Глубина очереди и задержка (от постановки до записи в analysis)."""
+        oldest = 0.0
+        if not self.queue.empty():
+            # _queue — deque внутри asyncio.Queue, первый элемент самый старый
+            oldest = time.monotonic() - self.queue._queue[0].enqueued
+        return {
+            "depth": self.queue.qsize(),
+            "oldest_wait": round(oldest, 3),
+            "last_lag": round(self.last_lag, 3),
+            "max_lag": round(self.max_lag, 3),
+            "done": self.done,
+            "failed": self.failed,
+            "unlabeled": self.unlabeled,
+        }
+
+    async def _report_loop(self) -> None:
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            logger.info(f"Analysis pipeline: {self.stats()}")
+
+    # ── обработка ──────────────────────────────────────────────
+    async def _worker(self, n: int) -> None:
+        while True:
+            # берём всё, что накопилось (до self.batch): грамматика и
+            # тональность считаются на пачку за один вызов analyse_many
+            jobs = [await self.queue.get()]
+            while len(jobs) < self.batch and not self.queue.empty():
+                jobs.append(self.queue.get_nowait())
+            try:
+                await self._process(jobs)
+                self.done += len(jobs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += len(jobs)
+                logger.error(f"Analysis worker {n}: log_id={[j.log_id for j in jobs]}: {e}")
+            finally:
+                now = time.monotonic()
+                for job in jobs:
+                    lag = now - job.enqueued
+                    self.last_lag = lag
+                    self.max_lag = max(self.max_lag, lag)
+                    self.queue.task_done()
+
+    async def _process(self, jobs: list[Job]) -> None:
+        loop = asyncio.get_running_loop()
+        # analyse (LanguageTool, тональность, textstat) — в отдельном процессе,
+        # классификация — параллельно, но не больше classify_concurrency сразу
+        metrics, labels = await asyncio.gather(
+            self._analyse(loop, jobs),
+            asyncio.gather(*(self._label(job) for job in jobs), return_exceptions=True))
+        retry = []
+        for job, m, label in zip(jobs, metrics, labels):
+            if isinstance(label, BaseException):
+                if isinstance(label, asyncio.CancelledError):
+                    raise label
+                label = (None, None)        # метрики сохраняем, категорию — позже
+                retry.append(job)
+            m["category"], m["category_source"] = label
+        items = [(job.log_id, m) for job, m in zip(jobs, metrics)]
+        await self.db.run(lambda c: Analysis.save_many(c, items))
+        if retry:
+            self.unlabeled += len(retry)
+            logger.warning(f"Analysis: категория не определена для log_id="
+                           f"{[j.log_id for j in retry]}, повтор позже")
+            task = asyncio.create_task(self._relabel(retry))
+            self._retries.add(task)
+            task.add_done_callback(self._retries.discard)
+
+    async def _relabel(self, jobs: list[Job]) -> None:
+        """Повтор классификации строк, сохранённых без категории."""
+        for attempt in range(LABEL_RETRIES):
+            await asyncio.sleep(LABEL_RETRY_SEC * 2 ** attempt)
+            labels = await asyncio.gather(*(self._label(job) for job in jobs),
+                                          return_exceptions=True)
+            done = [(category, source, job.log_id)
+                    for job, label in zip(jobs, labels)
+                    if not isinstance(label, BaseException)
+                    for category, source in [label]]
+            if done:
+                # category — ключ rollup: триггер обновления переносит вклад строки
+                await self.db.executemany(
+                    "UPDATE analysis SET category = ?, category_source = ? WHERE log_id = ?", done)
+                self.unlabeled -= len(done)
+            jobs = [job for job, label in zip(jobs, labels) if isinstance(label, BaseException)]
+            if not jobs:
+                return
+        logger.error(f"Analysis: категория так и не определена для log_id="
+                     f"{[j.log_id for j in jobs]} — повтор при следующем запуске")
+
+    async def _analyse(self, loop: asyncio.AbstractEventLoop, jobs: list[Job]) -> list[dict]:
+        with analysis_seconds.time():
+            return await loop.run_in_executor(
+                self._pool, Analysis.analyse_many,
+                [(job.question, job.answer, job.gen_time, job.logprobs) for job in jobs])
+
+    async def _label(self, job: Job) -> tuple[str, str]:
+        if job.category:
+            return job.category, "cache"
+        category, source = await self._classify(job.question)
+        if self.cache and job.cache_key:
+            self.cache.set_category(job.cache_key, category)
+        return category, source
+
+    async def _classify(self, question: str) -> tuple[str, str]:
+        async with self._sem:
+            return await self.classify(question)
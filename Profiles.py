@@ -0,0 +1,77 @@
+# Profiles.py  ─────────────────────────────────────────────────────────
+# Профили студентов (кампус / уровень / тип обучения) с LRU-кэшем в
+# памяти: запись — сквозная (БД + кэш), чтение на горячем пути — из кэша.
+# Кэш прогревается при старте. TTL нужен, когда ботов несколько: профиль,
+# сохранённый другим воркером, подтянется не позже чем через TTL.
+import os, time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from dotenv import load_dotenv
+
+from Db import Database
+
+load_dotenv()
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "50000"))
+PROFILE_CACHE_TTL  = float(os.getenv("PROFILE_CACHE_TTL", "600"))   # сек
+
+
+class Profile(NamedTuple):
+    campus: Optional[str]
+    education_level: Optional[str]
+    education_type: Optional[str]
+
+
+EMPTY = Profile(None, None, None)
+
+
+class ProfileStore:
+    def __init__(self, db: Database, *, size: int = PROFILE_CACHE_SIZE,
+                 ttl: float = PROFILE_CACHE_TTL):
+        self.db = db
+        self.size = size
+        self.ttl = ttl
+        self.mem: OrderedDict[int, tuple[Profile, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._warm()
+
+    def get(self, user_id: int) -> Optional[Profile]:
+        """Профиль или None, если студент ещё не проходил опрос."""
+        item = self.mem.get(user_id)
+        if item and time.monotonic() - item[1] < self.ttl:
+            self.mem.move_to_end(user_id)
+            self.hits += 1
+            return item[0]
+        self.misses += 1
+        # отсутствие профиля не кэшируем: его может сохранить другой воркер
+        row = self.db.fetchone(
+            "SELECT campus, education_level, education_type FROM user_profiles WHERE user_id=?",
+            (user_id,))
+        if row is None:
+            self.mem.pop(user_id, None)
+            return None
+        p = Profile(*row)
+        self._remember(user_id, p)
+        return p
+
+    async def save(self, user_id: int, profile: Profile) -> None:
+        await self.db.execute(
+            "INSERT OR REPLACE INTO user_profiles (user_id, campus, education_level, education_type) VALUES (?,?,?,?)",
+            (user_id, *profile))
+        self._remember(user_id, profile)
+
+    # ── внутреннее ─────────────────────────────────────────────
+    def _remember(self, user_id: int, p: Profile) -> None:
+        self.mem[user_id] = (p, time.monotonic())
+        self.mem.move_to_end(user_id)
+        while len(self.mem) > self.size:
+            self.mem.popitem(last=False)
+
+    def _warm(self) -> None:
+        rows = self.db.fetchall(
+            "SELECT user_id, campus, education_level, education_type FROM user_profiles "
+            "ORDER BY rowid DESC LIMIT ?", (self.size,))
+        for user_id, *rest in reversed(rows):
+            self._remember(user_id, Profile(*rest))
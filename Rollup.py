@@ -0,0 +1,231 @@
+# Rollup.py  ───────────────────────────────────────────────────────────
+# Предагрегаты для Dashboard.py: вместо пересчёта графиков по всем строкам
+# logs/analysis страница читает суммы по корзинам времени.
+#
+#   rollup       — grain (m | h | d: минута, час, день; a — за всё время)
+#                  × bucket (префикс ISO-времени logs.timestamp) × кампус ×
+#                  уровень × тип × категория → количества, суммы и суммы
+#                  квадратов метрик (среднее и σ без сырых строк), счётчики
+#                  оценок, флагов, кэша и токенов;
+#   rollup_hist  — то же по дням, но с гистограммами (длина ответа, ошибки).
+#
+# Поддерживаются триггерами в той же транзакции, что и запись бота: вставка
+# analysis добавляет вклад строки, изменение (анализ дописан фоном, оценка
+# 👍/👎, пересчёт Backfill) вычитает старый вклад и добавляет новый.
+# Сегмент берётся из профиля на момент вопроса (logs.campus и т. д. ставит
+# триггер при вставке logs), поэтому смена профиля не разъезжает суммы.
+# Удаление строк rollup не меняет — архивированные логи остаются в графиках;
+# rebuild() считает их заново из Parquet (Archive.read).
+#
+#   python Rollup.py [--db bot_logs.db] [--archive archive/]  # пересобрать с нуля
+import re, time, argparse, sqlite3
+from typing import Optional
+
+GRAINS = {"m": 16, "h": 13, "d": 10, "a": 0}   # длина префикса "YYYY-MM-DDTHH:MM"
+VERSION = 4     # менять вместе с GRAINS / MEASURES: пересоздать триггеры и rollup
+KEYS = ("campus", "education_level", "education_type", "category")
+METRICS = ("response_time", "first_token_time", "word_count", "confidence", "sentiment")
+
+# вклад одной строки: {a} — строка analysis, {l} — строка logs
+MEASURES: dict[str, str] = {"n": "1"}
+for _m in METRICS:
+    MEASURES[f"{_m}_n"] = f"{{a}}.{_m} IS NOT NULL"
+    MEASURES[f"{_m}_sum"] = f"COALESCE({{a}}.{_m}, 0)"
+    MEASURES[f"{_m}_sq"] = f"COALESCE({{a}}.{_m} * {{a}}.{_m}, 0)"
+MEASURES.update({
+    "fb_pos": "COALESCE({a}.user_feedback = 1, 0)",
+    "fb_neg": "COALESCE({a}.user_feedback = -1, 0)",
+    "fb_none": "{a}.user_feedback IS NULL",
+    "sent_pos": "COALESCE({a}.sentiment > 0, 0)",
+    "sent_neu": "COALESCE({a}.sentiment = 0, 0)",
+    "sent_neg": "COALESCE({a}.sentiment < 0, 0)",
+    "refusals": "COALESCE({a}.refusal_flag, 0)",
+    "templates": "COALESCE({a}.template_flag, 0)",
+    "cache_hits": "COALESCE({l}.cache_hit, 0)",
+    "cache_saved": "COALESCE({l}.cache_saved, 0)",
+    "queued": "COALESCE({l}.admission = 'queued', 0)",
+    "coalesced": "COALESCE({l}.admission = 'coalesced', 0)",
+    "llm_calls": "{l}.completion_tokens IS NOT NULL",
+    "prompt_tokens": "COALESCE({l}.prompt_tokens, 0)",
+    "completion_tokens": "COALESCE({l}.completion_tokens, 0)",
+    "completion_sq": "COALESCE({l}.completion_tokens * {l}.completion_tokens, 0)",
+    "cached_tokens": "COALESCE({l}.cached_tokens, 0)",
+    "truncated": "COALESCE({l}.finish_reason = 'length', 0)",
+    "max_tokens_sum": "COALESCE({l}.max_tokens, 0)",
+    "llm_response_time": "CASE WHEN {l}.completion_tokens IS NOT NULL "
+                         "THEN COALESCE({a}.response_time, 0) ELSE 0 END",
+    # вызовы LLM с памятью диалога: их число, токены памяти, весь промпт и время
+    "memory_calls": "COALESCE({l}.history_tokens > 0 AND {l}.completion_tokens IS NOT NULL, 0)",
+    "memory_tokens": "CASE WHEN {l}.completion_tokens IS NOT NULL "
+                     "THEN COALESCE({l}.history_tokens, 0) ELSE 0 END",
+    "memory_prompt_tokens": "CASE WHEN {l}.history_tokens > 0 AND {l}.completion_tokens IS NOT NULL "
+                            "THEN COALESCE({l}.prompt_tokens, 0) ELSE 0 END",
+    "memory_response_time": "CASE WHEN {l}.history_tokens > 0 AND {l}.completion_tokens IS NOT NULL "
+                            "THEN COALESCE({a}.response_time, 0) ELSE 0 END",
+    # поиск по базе знаний: сколько раз, справка в промпте, экономия, время
+    "retrievals": "{l}.retrieval_time IS NOT NULL",
+    "retrieval_time": "COALESCE({l}.retrieval_time, 0)",
+    "knowledge_tokens": "COALESCE({l}.knowledge_tokens, 0)",
+    "knowledge_saved": "COALESCE({l}.knowledge_saved, 0)",
+})
+
+# гистограммы: метрика → (ширина корзины, последняя корзина «и больше»)
+HISTOGRAMS = {"word_count": (25, 500), "grammar_errors": (1, 10)}
+
+# колонки analysis, изменение которых меняет вклад строки
+_WATCHED = ("response_time", "first_token_time", "word_count", "confidence", "sentiment",
+            "user_feedback", "refusal_flag", "template_flag", "grammar_errors", "category")
+
+
+def _keys(a: str, l: str) -> list[str]:
+    return [f"COALESCE({l}.campus, '')", f"COALESCE({l}.education_level, '')",
+            f"COALESCE({l}.education_type, '')", f"COALESCE({a}.category, '')"]
+
+
+def _bin(metric: str, a: str) -> str:
+    width, last = HISTOGRAMS[metric]
+    return f"MIN(CAST({a}.{metric} AS INTEGER) / {width} * {width}, {last})"
+
+
+def _delta(a: str, sign: str) -> list[str]:
+    """Операторы триггера: прибавить (sign='+') или вычесть вклад строки a."""
+    cols = ", ".join(MEASURES)
+    values = ", ".join(f"{sign}({e.format(a=a, l='l')})" for e in MEASURES.values())
+    update = ", ".join(f"{c} = {c} + excluded.{c}" for c in MEASURES)
+    keys = ", ".join(_keys(a, "l"))
+    stmts = [f"""INSERT INTO rollup (grain, bucket, {", ".join(KEYS)}, {cols})
+            SELECT '{g}', substr(l.timestamp, 1, {n}), {keys}, {values}
+            FROM logs l WHERE l.id = {a}.log_id
+            ON CONFLICT DO UPDATE SET {update};""" for g, n in GRAINS.items()]
+    for metric in HISTOGRAMS:
+        stmts.append(f"""INSERT INTO rollup_hist (bucket, {", ".join(KEYS)}, metric, bin, n)
+            SELECT substr(l.timestamp, 1, 10), {keys}, '{metric}', {_bin(metric, a)}, {sign}1
+            FROM logs l WHERE l.id = {a}.log_id AND {a}.{metric} IS NOT NULL
+            ON CONFLICT DO UPDATE SET n = n + excluded.n;""")
+    return stmts
+
+
+def ensure(c: sqlite3.Connection) -> bool:
+    """Таблицы и триггеры (из Db.init_schema). True — таблицы только что
+    созданы или триггеры другой версии: rollup надо заполнить rebuild()."""
+    triggers = {f"rollup_insert_v{VERSION}", f"rollup_update_v{VERSION}"}
+    current = {r[0] for r in c.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'rollup_%'")}
+    for name in current - triggers:
+        c.execute(f"DROP TRIGGER {name}")
+    if not triggers <= current:         # набор колонок мог измениться
+        c.execute("DROP TABLE IF EXISTS rollup")
+        c.execute("DROP TABLE IF EXISTS rollup_hist")
+    key_decl = ", ".join(f"{k} TEXT NOT NULL" for k in KEYS)
+    c.execute(f"""CREATE TABLE IF NOT EXISTS rollup (
+        grain TEXT NOT NULL, bucket TEXT NOT NULL, {key_decl},
+        {", ".join(f"{m} REAL NOT NULL DEFAULT 0" for m in MEASURES)},
+        PRIMARY KEY (grain, bucket, {", ".join(KEYS)})
+    ) WITHOUT ROWID""")
+    c.execute(f"""CREATE TABLE IF NOT EXISTS rollup_hist (
+        bucket TEXT NOT NULL, {key_decl}, metric TEXT NOT NULL, bin INTEGER NOT NULL,
+        n INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (metric, bucket, {", ".join(KEYS)}, bin)
+    ) WITHOUT ROWID""")
+    # профиль на момент вопроса — ключ сегмента в rollup
+    c.execute("""CREATE TRIGGER IF NOT EXISTS logs_profile_snapshot AFTER INSERT ON logs
+        WHEN NEW.campus IS NULL AND NEW.education_level IS NULL AND NEW.education_type IS NULL
+        BEGIN
+            UPDATE logs SET (campus, education_level, education_type) =
+                (SELECT campus, education_level, education_type
+                 FROM user_profiles WHERE user_id = NEW.user_id)
+            WHERE id = NEW.id;
+        END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS rollup_insert_v{VERSION} AFTER INSERT ON analysis
+        BEGIN
+            {" ".join(_delta("NEW", "+"))}
+        END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS rollup_update_v{VERSION}
+        AFTER UPDATE OF {", ".join(_WATCHED)} ON analysis
+        BEGIN
+            {" ".join(_delta("OLD", "-"))}
+            {" ".join(_delta("NEW", "+"))}
+        END""")
+    return not triggers <= current
+
+
+def _columns() -> list[str]:
+    """Колонки строки logs + analysis, из которых считается вклад."""
+    used = {"timestamp", "user_id", *KEYS, *HISTOGRAMS}
+    for e in MEASURES.values():
+        used.update(re.findall(r"\{[al]\}\.(\w+)", e))
+    return sorted(used)
+
+
+def _aggregate(c: sqlite3.Connection, source: str, a: str, l: str) -> None:
+    """Прибавляет к rollup / rollup_hist вклад строк source (a, l — их алиасы)."""
+    keys = ", ".join(_keys(a, l))
+    sums = ", ".join(f"SUM({e.format(a=a, l=l)})" for e in MEASURES.values())
+    add = ", ".join(f"{m} = {m} + excluded.{m}" for m in MEASURES)
+    for g, n in GRAINS.items():
+        c.execute(f"""INSERT INTO rollup (grain, bucket, {", ".join(KEYS)}, {", ".join(MEASURES)})
+            SELECT '{g}', substr({l}.timestamp, 1, {n}), {keys}, {sums}
+            FROM {source}
+            GROUP BY 2, 3, 4, 5, 6
+            ON CONFLICT DO UPDATE SET {add}""")
+    for metric in HISTOGRAMS:
+        c.execute(f"""INSERT INTO rollup_hist (bucket, {", ".join(KEYS)}, metric, bin, n)
+            SELECT substr({l}.timestamp, 1, 10), {keys}, '{metric}', {_bin(metric, a)}, COUNT(*)
+            FROM {source}
+            WHERE {a}.{metric} IS NOT NULL
+            GROUP BY 1, 2, 3, 4, 5, 7
+            ON CONFLICT DO UPDATE SET n = n + excluded.n""")
+
+
+def _aggregate_archive(c: sqlite3.Connection, root: Optional[str]) -> int:
+    """Вклад диалогов, перенесённых Archive.py в Parquet; возвращает их число.
+    Строки читаются во временную таблицу и считаются тем же SQL, что и база;
+    день на границе архива и базы складывается из обеих частей."""
+    import Archive          # Archive → Db → Rollup: импорт только здесь
+    cols = _columns()
+    df = Archive.read(c, columns=cols, root=root or Archive.ARCHIVE_DIR)
+    if df is None or df.empty:
+        return 0
+    c.execute(f"CREATE TEMP TABLE rollup_archive ({', '.join(cols)})")
+    try:
+        c.executemany(f"INSERT INTO rollup_archive VALUES ({', '.join('?' * len(cols))})",
+                      df.astype(object).where(df.notna(), None).itertuples(index=False))
+        # старые строки без снимка профиля — как в базе, по текущему профилю
+        c.execute("""UPDATE rollup_archive SET (campus, education_level, education_type) =
+                         (SELECT campus, education_level, education_type
+                          FROM user_profiles WHERE user_id = rollup_archive.user_id)
+                     WHERE campus IS NULL AND education_level IS NULL
+                       AND education_type IS NULL""")
+        _aggregate(c, "temp.rollup_archive r", "r", "r")
+    finally:
+        c.execute("DROP TABLE temp.rollup_archive")
+    return len(df)
+
+
+def rebuild(c: sqlite3.Connection, archive_root: Optional[str] = None) -> int:
+    """Пересчёт rollup по всем строкам базы и архива (Archive.py, каталог
+    archive_root, по умолчанию ARCHIVE_DIR); вызывающий управляет транзакцией.
+    Строкам logs без снимка профиля ставит текущий профиль."""
+    c.execute("""UPDATE logs SET (campus, education_level, education_type) =
+                     (SELECT campus, education_level, education_type
+                      FROM user_profiles WHERE user_id = logs.user_id)
+                 WHERE campus IS NULL AND education_level IS NULL AND education_type IS NULL""")
+    c.execute("DELETE FROM rollup")
+    c.execute("DELETE FROM rollup_hist")
+    _aggregate(c, "logs l JOIN analysis a ON a.log_id = l.id", "a", "l")
+    _aggregate_archive(c, archive_root)
+    return c.execute("SELECT COUNT(*) FROM rollup").fetchone()[0]
+
+
+if __name__ == "__main__":
+    from Db import DB_PATH, connect, init_schema
+    ap = argparse.ArgumentParser(description="Пересборка предагрегатов rollup")
+    ap.add_argument("--db", default=DB_PATH)
+    ap.add_argument("--archive", default=None, help="каталог Archive.py (по умолчанию ARCHIVE_DIR)")
+    args = ap.parse_args()
+    init_schema(args.db)
+    conn = connect(args.db)
+    t0 = time.perf_counter()
+    with conn:               # одна транзакция: Dashboard не увидит пустой rollup
+        rows = rebuild(conn, args.archive)
+    print(f"rollup: {rows} строк за {time.perf_counter() - t0:.1f} с")
@@ -0,0 +1,106 @@
+# Rules.py  ────────────────────────────────────────────────────────────
+# Движок правил для Analysis: шаблонные фразы, отказы, «неуверенные» слова,
+# упоминания дат. Семейства шаблонов лежат в rules.json (RULES_PATH) —
+# новое правило добавляется правкой файла, без изменения кода; файл
+# перечитывается, если его обновили.
+#
+# Все семейства собраны в одно регулярное выражение, и текст (в нижнем
+# регистре) просматривается за один проход. Каждая альтернатива обёрнута
+# в lookahead, поэтому совпадения разных семейств могут перекрываться
+# («извините, но я не могу предоставить» — и отказ, и шаблон), а
+# перекрывающиеся совпадения одного семейства считаются один раз. Общее
+# выражение находит позиции, где совпало хоть одно семейство; на такой
+# позиции проверяются и остальные семейства (их выражения — по отдельности),
+# так что совпадения нескольких семейств с одного места засчитываются все.
+# Шаблоны пишутся в нижнем регистре. Относительный RULES_PATH — от каталога бота.
+import os, re, json
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          os.getenv("RULES_PATH", "rules.json"))
+
+# если файла нет — правила, с которыми бот работал раньше
+DEFAULT_RULES: dict[str, list[str]] = {
+    "template": [r"as an ai language model",
+                 r"как (?:модель|искусственный интеллект)",
+                 r"я не могу (?:ответить|предоставить)"],
+    "refusal": [r"извините[, ]+но я не могу",
+                r"i'?m sorry[, ]+but i cannot",
+                r"к сожалению[, ]+я не могу"],
+    "hedge": ["возможно", "может", "полагаю", "кажется", "вероятно",
+              "maybe", "probably", "perhaps", "i think"],
+    "reference": [r"\d{1,2}\s*[а-яa-z]{3,}"],
+}
+
+Span = tuple[int, int]
+
+
+class RuleEngine:
+    def __init__(self, families: dict[str, list[str]]):
+        self.rules = dict(families)
+        self.families = list(families)
+        self._group = {}                 # имя группы → семейство
+        self._single = {}                # семейство → выражение только для него
+        alts = []
+        for i, (family, patterns) in enumerate(families.items()):
+            if not patterns:
+                continue
+            name = f"_r{i}"
+            self._group[name] = family
+            body = '|'.join(f'(?:{p})' for p in patterns)
+            alts.append(f"(?P<{name}>{body})")
+            self._single[family] = re.compile(f"(?=(?P<m>{body}))")
+        self.regex = re.compile(f"(?=(?:{'|'.join(alts)}))") if alts else None
+
+    @classmethod
+    def load(cls, path: str = RULES_PATH) -> "RuleEngine":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def scan(self, text: str) -> dict[str, list[Span]]:
+        """{семейство: [(начало, конец), …]} — позиции в text.lower()."""
+        hits: dict[str, list[Span]] = {f: [] for f in self.families}
+        if self.regex is None:
+            return hits
+        low = text.lower()
+        end: dict[str, int] = {}
+        for m in self.regex.finditer(low):
+            first = self._group[m.lastgroup]
+            pos = m.start()
+            for family, single in self._single.items():
+                if family == first:
+                    s, e = m.span(m.lastgroup)
+                else:
+                    other = single.match(low, pos)
+                    if other is None:
+                        continue
+                    s, e = other.span("m")
+                if s < end.get(family, -1):
+                    continue             # то же совпадение, сдвинутое на символ
+                end[family] = e
+                hits[family].append((s, e))
+        return hits
+
+    def counts(self, text: str) -> dict[str, int]:
+        return {f: len(spans) for f, spans in self.scan(text).items()}
+
+
+# ── правила бота (перечитываются, если rules.json обновили) ─────
+_engine: Optional[RuleEngine] = None
+_engine_mtime: Optional[float] = None
+
+
+def current() -> RuleEngine:
+    global _engine, _engine_mtime
+    try:
+        mtime = os.stat(RULES_PATH).st_mtime
+    except OSError:
+        mtime = 0.0
+    if _engine is None or mtime != _engine_mtime:
+        _engine = RuleEngine.load(RULES_PATH) if mtime else RuleEngine(DEFAULT_RULES)
+        _engine_mtime = mtime
+    return _engine
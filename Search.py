@@ -0,0 +1,104 @@
+# Search.py  ───────────────────────────────────────────────────────────
+# Полнотекстовый индекс по вопросам и ответам для поиска в Dashboard.py.
+#
+#   logs_fts — FTS5 (external content) над logs.question / logs.answer:
+#              сам текст хранится только в logs, индекс — термы и rowid
+#              (= logs.id). Синхронизируется триггерами в той же
+#              транзакции, что и запись бота (вставка, правка текста,
+#              удаление при архивации).
+#
+# Поиск идёт от индекса по убыванию rowid, поэтому страница (keyset по
+# logs.id) читает только столько совпадений, сколько нужно для LIMIT,
+# а не все совпадения запроса.
+#
+#   python Search.py [--db bot_logs.db]     # пересобрать индекс с нуля
+import re, time, argparse, sqlite3
+
+VERSION = 1     # менять вместе с колонками / токенизатором: пересоздать индекс
+TOKENIZE = "unicode61 remove_diacritics 2"
+
+_TRIGGERS = {f"logs_fts_insert_v{VERSION}", f"logs_fts_delete_v{VERSION}",
+             f"logs_fts_update_v{VERSION}"}
+
+
+def ensure(c: sqlite3.Connection) -> bool:
+    """Индекс и триггеры (из Db.init_schema). True — индекс только что
+    создан (или другой версии): его надо заполнить rebuild()."""
+    current = {r[0] for r in c.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'logs_fts_%'")}
+    for name in current - _TRIGGERS:
+        c.execute(f"DROP TRIGGER {name}")
+    if not _TRIGGERS <= current:
+        c.execute("DROP TABLE IF EXISTS logs_fts")
+    c.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS logs_fts USING fts5(
+        question, answer, content='logs', content_rowid='id', tokenize='{TOKENIZE}')""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS logs_fts_insert_v{VERSION} AFTER INSERT ON logs
+        BEGIN
+            INSERT INTO logs_fts (rowid, question, answer)
+            VALUES (NEW.id, NEW.question, NEW.answer);
+        END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS logs_fts_delete_v{VERSION} AFTER DELETE ON logs
+        BEGIN
+            INSERT INTO logs_fts (logs_fts, rowid, question, answer)
+            VALUES ('delete', OLD.id, OLD.question, OLD.answer);
+        END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS logs_fts_update_v{VERSION}
+        AFTER UPDATE OF question, answer ON logs
+        BEGIN
+            INSERT INTO logs_fts (logs_fts, rowid, question, answer)
+            VALUES ('delete', OLD.id, OLD.question, OLD.answer);
+            INSERT INTO logs_fts (rowid, question, answer)
+            VALUES (NEW.id, NEW.question, NEW.answer);
+        END""")
+    return not _TRIGGERS <= current
+
+
+def rebuild(c: sqlite3.Connection) -> int:
+    """Индекс заново по всем строкам logs; вызывающий управляет транзакцией."""
+    c.execute("INSERT INTO logs_fts (logs_fts) VALUES ('rebuild')")
+    c.execute("INSERT INTO logs_fts (logs_fts) VALUES ('optimize')")
+    return c.execute("SELECT COUNT(*) FROM logs").fetchone()[0]
+
+
+def fts_query(text: str) -> str:
+    """Строка из поля поиска → запрос MATCH: "фраза в кавычках" ищется
+    целиком, остальные слова — по префиксу (учёт → учёта, учётом), все
+    условия через И. Спецсимволы FTS5 из ввода не проходят."""
+    parts = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text):
+        if phrase:
+            words = re.findall(r"\w+", phrase)
+            if words:
+                parts.append('"' + " ".join(words) + '"')
+        else:
+            parts.extend(f'"{w}"*' for w in re.findall(r"\w+", word))
+    return " ".join(parts)
+
+
+def highlight(rows: list[tuple], match: str, start: str, end: str) -> list[tuple]:
+    """(id, вопрос, ответ) строк страницы → то же с совпадениями в start…end.
+    Считается во временном индексе в памяти с тем же токенизатором:
+    highlight() по logs_fts читал бы списки документов термов целиком."""
+    m = sqlite3.connect(":memory:")
+    try:
+        m.execute(f"CREATE VIRTUAL TABLE t USING fts5(question, answer, tokenize='{TOKENIZE}')")
+        m.executemany("INSERT INTO t (rowid, question, answer) VALUES (?, ?, ?)", rows)
+        marked = {r[0]: r[1:] for r in m.execute(
+            "SELECT rowid, highlight(t, 0, ?, ?), highlight(t, 1, ?, ?) FROM t WHERE t MATCH ?",
+            (start, end, start, end, match))}
+    finally:
+        m.close()
+    return [(i, *marked.get(i, (q, a))) for i, q, a in rows]
+
+
+if __name__ == "__main__":
+    from Db import DB_PATH, connect, init_schema
+    ap = argparse.ArgumentParser(description="Пересборка полнотекстового индекса logs_fts")
+    ap.add_argument("--db", default=DB_PATH)
+    args = ap.parse_args()
+    init_schema(args.db)
+    conn = connect(args.db)
+    t0 = time.perf_counter()
+    with conn:
+        rows = rebuild(conn)
+    print(f"logs_fts: {rows} строк за {time.perf_counter() - t0:.1f} с")
@@ -0,0 +1,121 @@
+# Sentiment.py  ────────────────────────────────────────────────────────
+# Тональность ответа для поля analysis.sentiment (–1…+1).
+# TextBlob знает только английский, поэтому русские ответы почти всегда
+# получали 0.0 («Нейтрал» в Dashboard). SENTIMENT_BACKEND выбирает бэкенд:
+#   lexicon  — по умолчанию: словарь русских и английских основ;
+#   textblob — прежнее поведение.
+#
+# Словарный скоринг считается пачкой: все слова всех ответов собираются
+# в один массив NumPy, основа — усечение до STEM_LEN символов (приведение
+# к <U{STEM_LEN}), полярность ищется один раз на уникальную основу,
+# отрицание («не», «not», …) переворачивает знак следующего слова, сумма
+# по ответу нормируется как в VADER: s / sqrt(s² + ALPHA).
+# SENTIMENT_LEXICON — JSON {основа: полярность}, дополняет встроенный словарь.
+import os, re, json
+from typing import Sequence
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SENTIMENT_BACKEND = os.getenv("SENTIMENT_BACKEND", "lexicon")   # lexicon | textblob
+SENTIMENT_LEXICON = os.getenv("SENTIMENT_LEXICON")
+STEM_LEN = 5
+ALPHA = 1.0        # полярности словаря в −1…+1 (в VADER — ±4 и ALPHA=15)
+
+_WORD = re.compile(r"[a-zа-яё']+")
+
+NEGATIONS = ("не", "нет", "ни", "без", "not", "no", "never", "don't", "can't", "cannot")
+
+# основы (первые STEM_LEN букв; короткие слова — целиком) → полярность −1…+1
+LEXICON: dict[str, float] = {
+    # русский: позитив
+    "хорош": 0.6, "отлич": 0.8, "прекр": 0.8, "замеч": 0.7, "спаси": 0.5,
+    "благо": 0.5, "рады": 0.6, "рад": 0.5, "удобн": 0.4, "успеш": 0.6,
+    "помощ": 0.3, "помог": 0.3, "подде": 0.3, "довол": 0.5, "поздр": 0.7,
+    "легко": 0.3, "беспл": 0.3, "льгот": 0.2, "вовре": 0.3, "удало": 0.3,
+    "полез": 0.4, "лучш": 0.5, "верно": 0.3, "своев": 0.3,
+    "гаран": 0.3, "досту": 0.2, "прият": 0.6, "уважа": 0.4,
+    "надёж": 0.4, "надеж": 0.4, "ждём": 0.3, "добро": 0.5,
+    # русский: негатив
+    "плохо": -0.6, "ужас": -0.9, "ужасн": -0.9, "ошибк": -0.5, "ошибо": -0.5,
+    "пробл": -0.4, "сожал": -0.4, "извин": -0.3, "отказ": -0.5, "запре": -0.5,
+    "откло": -0.5,
+    "наруш": -0.6, "штраф": -0.6, "отчис": -0.6, "долг": -0.4, "долги": -0.4,
+    "задол": -0.5,
+    "сложн": -0.3, "трудн": -0.4, "невоз": -0.5, "нельз": -0.4, "недос": -0.4,
+    "опозд": -0.4, "сбой": -0.5, "сбои": -0.5, "неуда": -0.6, "жалоб": -0.5, "прете": -0.4,
+    "непра": -0.4, "потер": -0.4, "санкц": -0.5, "проср": -0.5, "аннул": -0.5,
+    "жаль": -0.4,
+    # английский
+    "good": 0.6, "great": 0.8, "excel": 0.8, "thank": 0.5, "happy": 0.7,
+    "glad": 0.6, "pleas": 0.3, "help": 0.3, "helpf": 0.4, "succe": 0.6, "easy": 0.4,
+    "welco": 0.5, "love": 0.7, "nice": 0.5, "best": 0.6, "benef": 0.4,
+    "bad": -0.6, "terri": -0.9, "error": -0.5, "probl": -0.4, "sorry": -0.3,
+    "unfor": -0.4, "fail": -0.6, "faile": -0.6, "denie": -0.5, "refus": -0.5, "penal": -0.6,
+    "diffi": -0.4, "impos": -0.5,
+    "wrong": -0.5, "issue": -0.3, "debt": -0.4, "expel": -0.7,
+}
+
+
+def _load_lexicon() -> dict[str, float]:
+    lex = dict(LEXICON)
+    if SENTIMENT_LEXICON:
+        with open(SENTIMENT_LEXICON, encoding="utf-8") as f:
+            lex.update({k.lower()[:STEM_LEN]: float(v) for k, v in json.load(f).items()})
+    return lex
+
+
+_lexicon = _load_lexicon()
+_negations = np.array(NEGATIONS)
+_NEG_LEN = max(STEM_LEN, max(len(w) for w in NEGATIONS))   # хватит для сравнения с отрицаниями
+
+
+# ── словарный бэкенд ───────────────────────────────────────────
+def lexicon_scores(texts: Sequence[str]) -> np.ndarray:
+    """Тональность пачки ответов, float64[len(texts)] в −1…+1."""
+    n = len(texts)
+    words = [_WORD.findall(t.lower()) for t in texts]
+    lengths = np.fromiter((len(w) for w in words), dtype=np.int64, count=n)
+    if not lengths.sum():
+        return np.zeros(n)
+    flat = np.array([w for ws in words for w in ws], dtype=f"<U{_NEG_LEN}")
+    doc = np.repeat(np.arange(n), lengths)
+
+    stems = flat.astype(f"<U{STEM_LEN}")
+    uniq, inverse = np.unique(stems, return_inverse=True)
+    polarity = np.array([_lexicon.get(s, 0.0) for s in uniq])[inverse]
+
+    # отрицание перед словом того же ответа переворачивает знак
+    neg = np.isin(flat, _negations)
+    flip = np.zeros_like(neg)
+    flip[1:] = neg[:-1] & (doc[1:] == doc[:-1])
+    polarity = np.where(flip, -polarity, polarity)
+
+    s = np.bincount(doc, weights=polarity, minlength=n)
+    return s / np.sqrt(s * s + ALPHA)
+
+
+# ── выбор бэкенда ──────────────────────────────────────────────
+def _textblob_scores(texts: Sequence[str]) -> list[float]:
+    from textblob import TextBlob
+    out = []
+    for t in texts:
+        try:
+            out.append(TextBlob(t).sentiment.polarity)
+        except Exception:
+            out.append(0.0)
+    return out
+
+
+def score_many(texts: Sequence[str], backend: str = SENTIMENT_BACKEND) -> list[float]:
+    if not texts:
+        return []
+    if backend == "textblob":
+        return _textblob_scores(texts)
+    return [round(float(x), 4) for x in lexicon_scores(texts)]
+
+
+def score(text: str, backend: str = SENTIMENT_BACKEND) -> float:
+    return score_many([text], backend)[0]
@@ -0,0 +1,65 @@
+# Storage.py  ──────────────────────────────────────────────────────────
+# Хранилище FSM (состояние опроса и промежуточные ответы) для aiogram.
+# FSM_STORAGE выбирает бэкенд:
+#   memory — по умолчанию, один процесс, теряется при перезапуске;
+#   sqlite — таблица fsm_state в bot_logs.db (общая для воркеров на одной машине);
+#   redis  — любой Redis-совместимый сервер по FSM_REDIS_URL (несколько машин).
+import os, json
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from Db import Database
+
+load_dotenv()
+
+FSM_STORAGE   = os.getenv("FSM_STORAGE", "memory")
+FSM_REDIS_URL = os.getenv("FSM_REDIS_URL", "redis://localhost:6379/0")
+
+
+def _key(key: StorageKey) -> str:
+    return ":".join(str(p) for p in (key.bot_id, key.chat_id, key.user_id,
+                                     key.thread_id, key.destiny))
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM поверх Db.Database: запись через поток-писатель, чтение — читателем."""
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self.db.execute(
+            "INSERT INTO fsm_state (key, state) VALUES (?,?) "
+            "ON CONFLICT(key) DO UPDATE SET state=excluded.state",
+            (_key(key), value))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = self.db.fetchone("SELECT state FROM fsm_state WHERE key=?", (_key(key),))
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self.db.execute(
+            "INSERT INTO fsm_state (key, data) VALUES (?,?) "
+            "ON CONFLICT(key) DO UPDATE SET data=excluded.data",
+            (_key(key), json.dumps(data, ensure_ascii=False)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = self.db.fetchone("SELECT data FROM fsm_state WHERE key=?", (_key(key),))
+        return json.loads(row[0]) if row and row[0] else {}
+
+    async def close(self) -> None:
+        pass        # соединения принадлежат Db.Database
+
+
+def make_storage(db: Database, backend: str = FSM_STORAGE) -> BaseStorage:
+    if backend == "sqlite":
+        return SQLiteStorage(db)
+    if backend == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage   # нужен пакет redis
+        return RedisStorage.from_url(FSM_REDIS_URL)
+    return MemoryStorage()
@@ -0,0 +1,104 @@
+# Streaming.py  ────────────────────────────────────────────────────────
+# Постепенный вывод ответа: сначала «заглушка», затем правки сообщения
+# по мере прихода дельт от модели. Правки не чаще STREAM_EDIT_INTERVAL,
+# при переполнении 4096 символов ответ продолжается в новом сообщении.
+import os, time, asyncio, logging
+from typing import Optional
+
+from aiogram.types import Message, InlineKeyboardMarkup
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))  # сек между правками
+TG_LIMIT    = 4096
+PLACEHOLDER = "⏳ Печатаю ответ…"
+
+
+class StreamingReply:
+    """Одно «живое» сообщение (или цепочка, если ответ длиннее лимита)."""
+
+    def __init__(self, msg: Message, *, interval: float = STREAM_EDIT_INTERVAL,
+                 limit: int = TG_LIMIT):
+        self.msg = msg
+        self.interval = interval
+        self.limit = limit
+        self.text = ""                 # весь накопленный ответ
+        self.offset = 0                # начало текста текущего сообщения
+        self.current: Optional[Message] = None
+        self.shown = ("", False)       # (текст, финальный ли) в current
+        self.next_edit = 0.0           # monotonic, раньше которого не правим
+        self.sent = 0                  # сколько сообщений отправлено
+
+    async def start(self) -> None:
+        self.current = await self.msg.answer(PLACEHOLDER, parse_mode=None)
+        self.sent = 1
+        self.next_edit = time.monotonic() + self.interval
+
+    async def update(self, text: str) -> None:
+        """Новый накопленный текст ответа; правка — только если пора."""
+        self.text = text
+        await self._rollover()
+        if time.monotonic() >= self.next_edit:
+            await self._edit(self.text[self.offset:], final=False)
+
+    async def finish(self, text: str,
+                     reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+        """Финальная правка: полный текст + кнопки на последнем сообщении."""
+        self.text = text
+        await self._rollover()
+        await self._edit(self.text[self.offset:] or "…", final=True,
+                         reply_markup=reply_markup)
+
+    # ── внутреннее ─────────────────────────────────────────────
+    async def _rollover(self) -> None:
+        # текст текущего сообщения не влезает → закрываем его по границе слова
+        while len(self.text) - self.offset > self.limit:
+            part = self.text[self.offset:self.offset + self.limit]
+            cut = max(part.rfind("\n"), part.rfind(" "))
+            if cut <= 0:
+                cut = self.limit
+            await self._edit(part[:cut], final=True)
+            self.offset += cut
+            self.current = await self.msg.answer(PLACEHOLDER, parse_mode=None)
+            self.shown = ("", False)
+            self.sent += 1
+
+    async def _edit(self, text: str, *, final: bool,
+                    reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+        text = text.strip() or PLACEHOLDER
+        if (text, final) == self.shown and reply_markup is None:
+            return
+        while True:
+            try:
+                if final:
+                    # финальный текст — с разметкой по умолчанию (HTML)
+                    await self._do_edit(text, reply_markup, default_parse=True)
+                else:
+                    # промежуточный текст может обрываться посреди тега
+                    await self._do_edit(text, None, default_parse=False)
+                self.shown = (text, final)
+                break
+            except TelegramRetryAfter as e:
+                self.next_edit = time.monotonic() + e.retry_after
+                if not final:
+                    return
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if "not modified" in str(e):
+                    break
+                if final:
+                    # разметка не разобралась — отправляем как обычный текст
+                    await self._do_edit(text, reply_markup, default_parse=False)
+                    self.shown = (text, final)
+                    break
+                logger.warning(f"Stream edit failed: {e}")
+                return
+        self.next_edit = time.monotonic() + self.interval
+
+    async def _do_edit(self, text: str, reply_markup, *, default_parse: bool) -> None:
+        kwargs = {} if default_parse else {"parse_mode": None}
+        await self.current.edit_text(text, reply_markup=reply_markup, **kwargs)
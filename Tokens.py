@@ -0,0 +1,142 @@
+# Tokens.py  ───────────────────────────────────────────────────────────
+# Учёт токенов и бюджет max_tokens.
+#   • Generation — результат одного вызова LLM: текст, usage (prompt /
+#     completion / cached), finish_reason и, если включено LLM_LOGPROBS,
+#     logprobs токенов ответа (их Analysis превращает в confidence).
+#   • TokenBudget — max_tokens по категории вопроса: квантиль
+#     TOKEN_BUDGET_QUANTILE длины ответов (completion_tokens) этой
+#     категории за TOKEN_BUDGET_DAYS × запас TOKEN_BUDGET_MARGIN, в пределах
+#     [LLM_MAX_TOKENS_MIN, LLM_MAX_TOKENS]. Длинный хвост генерации
+#     обрезается там, где ответы такой длины не нужны; если ответы
+#     категории заметно чаще упираются в лимит (finish_reason=length),
+#     бюджет возвращается к LLM_MAX_TOKENS.
+#   • Цены (за 1 млн токенов) — для панели стоимости в Dashboard.
+#   • estimate_tokens — грубая оценка длины текста в токенах до вызова
+#     (бюджет памяти диалога, Memory.py); с запасом, токенизатора нет.
+import os, math, time, asyncio, logging
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from Db import Database, connect
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_LOGPROBS       = os.getenv("LLM_LOGPROBS", "0") == "1"
+LLM_MAX_TOKENS     = int(os.getenv("LLM_MAX_TOKENS", "1024"))
+LLM_MAX_TOKENS_MIN = int(os.getenv("LLM_MAX_TOKENS_MIN", "256"))
+TOKEN_BUDGET       = os.getenv("TOKEN_BUDGET", "1") == "1"         # 0 — всегда LLM_MAX_TOKENS
+TOKEN_BUDGET_QUANTILE    = float(os.getenv("TOKEN_BUDGET_QUANTILE", "0.99"))
+TOKEN_BUDGET_MARGIN      = float(os.getenv("TOKEN_BUDGET_MARGIN", "1.2"))
+TOKEN_BUDGET_MIN_SAMPLES = int(os.getenv("TOKEN_BUDGET_MIN_SAMPLES", "50"))
+TOKEN_BUDGET_DAYS        = float(os.getenv("TOKEN_BUDGET_DAYS", "14"))
+TOKEN_BUDGET_REFRESH_SEC = float(os.getenv("TOKEN_BUDGET_REFRESH_SEC", "600"))
+
+# символов на токен для estimate_tokens (русский текст у deepseek-chat — ~3–4)
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "3"))
+
+# $ за 1 млн токенов (deepseek-chat): вход без кэша / вход из кэша / выход
+PRICE_INPUT  = float(os.getenv("LLM_PRICE_INPUT", "0.27"))
+PRICE_CACHED = float(os.getenv("LLM_PRICE_CACHED", "0.07"))
+PRICE_OUTPUT = float(os.getenv("LLM_PRICE_OUTPUT", "1.10"))
+
+
+def cost(prompt: float, completion: float, cached: float) -> float:
+    """Стоимость вызова в $; работает и со столбцами pandas."""
+    return ((prompt - cached) * PRICE_INPUT + cached * PRICE_CACHED
+            + completion * PRICE_OUTPUT) / 1e6
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+@dataclass
+class Generation:
+    answer: str = ""
+    first_token: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+    finish_reason: Optional[str] = None
+    max_tokens: Optional[int] = None
+    logprobs: Optional[list[float]] = None
+
+    def add_usage(self, usage) -> None:
+        """usage из ответа API. Кэш промпта: DeepSeek — prompt_cache_hit_tokens,
+        OpenAI — prompt_tokens_details.cached_tokens."""
+        if usage is None:
+            return
+        self.prompt_tokens = usage.prompt_tokens
+        self.completion_tokens = usage.completion_tokens
+        cached = getattr(usage, "prompt_cache_hit_tokens", None)
+        if cached is None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            cached = getattr(details, "cached_tokens", None)
+        self.cached_tokens = cached
+
+    def add_logprobs(self, choice_logprobs) -> None:
+        content = getattr(choice_logprobs, "content", None)
+        if content:
+            if self.logprobs is None:
+                self.logprobs = []
+            self.logprobs.extend(t.logprob for t in content)
+
+
+class TokenBudget:
+    def __init__(self, db: Database):
+        self.db = db
+        self.limits: dict[str, int] = {}
+        self.updated = 0.0
+
+    def max_tokens(self, category: Optional[str]) -> int:
+        if not TOKEN_BUDGET or not category:
+            return LLM_MAX_TOKENS
+        return self.limits.get(category, LLM_MAX_TOKENS)
+
+    def refresh(self) -> dict[str, int]:
+        """Пересчитывает лимиты по логам; отдельное соединение (вызывается в потоке)."""
+        since = (datetime.utcnow() - timedelta(days=TOKEN_BUDGET_DAYS)).isoformat()
+        c = connect(self.db.path)
+        try:
+            rows = c.execute("""
+                SELECT a.category, l.completion_tokens, l.finish_reason
+                FROM logs l JOIN analysis a ON a.log_id = l.id
+                WHERE l.timestamp >= ? AND l.completion_tokens IS NOT NULL
+                  AND a.category IS NOT NULL
+            """, (since,)).fetchall()
+        finally:
+            c.close()
+        lengths: dict[str, list[int]] = defaultdict(list)
+        cut: dict[str, int] = defaultdict(int)
+        for category, n, finish in rows:
+            lengths[category].append(n)
+            cut[category] += finish == "length"
+        limits = {}
+        for category, ns in lengths.items():
+            if len(ns) < TOKEN_BUDGET_MIN_SAMPLES:
+                continue
+            if cut[category] / len(ns) > 1 - TOKEN_BUDGET_QUANTILE:
+                limits[category] = LLM_MAX_TOKENS      # лимит режет нужные ответы
+                continue
+            ns.sort()
+            q = ns[min(len(ns) - 1, int(TOKEN_BUDGET_QUANTILE * len(ns)))]
+            limits[category] = max(LLM_MAX_TOKENS_MIN,
+                                   min(LLM_MAX_TOKENS, math.ceil(q * TOKEN_BUDGET_MARGIN)))
+        self.limits = limits
+        self.updated = time.time()
+        return limits
+
+    async def refresh_loop(self, interval: float = TOKEN_BUDGET_REFRESH_SEC) -> None:
+        while True:
+            try:
+                limits = await asyncio.to_thread(self.refresh)
+                logger.info(f"Token budget: {limits}")
+            except Exception as e:
+                logger.error(f"Token budget refresh error: {e}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,179 @@
+# Transport.py  ────────────────────────────────────────────────────────
+# HTTP-транспорт для DeepSeek: общий httpx.AsyncClient с явным пулом
+# соединений и таймаутами, повторы с «дрожащей» экспоненциальной паузой,
+# предохранитель (circuit breaker), который при нездоровом API сразу
+# отвечает ошибкой, и «хеджирование» коротких запросов (классификация).
+# Все параметры — из .env; LLM_BASE_URL позволяет подставить FakeLLM.py.
+import os, time, random, asyncio, logging
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+T = TypeVar("T")
+
+LLM_BASE_URL          = os.getenv("LLM_BASE_URL", "https://api.deepseek.com")
+HTTP_MAX_CONNECTIONS  = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE    = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT  = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT     = float(os.getenv("HTTP_READ_TIMEOUT", "60"))    # между байтами ответа
+LLM_RETRIES           = int(os.getenv("LLM_RETRIES", "2"))
+LLM_BACKOFF           = float(os.getenv("LLM_BACKOFF", "0.5"))         # база паузы, сек
+LLM_BACKOFF_MAX       = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+BREAKER_FAILURES      = int(os.getenv("BREAKER_FAILURES", "5"))        # подряд до размыкания
+BREAKER_RESET         = float(os.getenv("BREAKER_RESET", "30"))        # сек до пробного запроса
+CLASSIFY_HEDGE_MS     = float(os.getenv("CLASSIFY_HEDGE_MS", "0"))     # 0 — без хеджирования
+
+# ошибки, после которых имеет смысл повторить запрос
+RETRYABLE = (openai.APIConnectionError, openai.APITimeoutError,
+             openai.RateLimitError, openai.InternalServerError)
+
+
+class Unavailable(Exception):
+    """API признан нездоровым — запрос даже не отправляем."""
+
+
+def make_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY),
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+    )
+
+
+def make_client(api_key: Optional[str] = None,
+                base_url: str = LLM_BASE_URL) -> AsyncOpenAI:
+    # собственные повторы SDK выключены — ими управляет ResilientLLM
+    return AsyncOpenAI(api_key=api_key or os.getenv("DEEPSEEK_API_KEY"),
+                       base_url=base_url, http_client=make_http_client(),
+                       max_retries=0)
+
+
+# ── предохранитель ─────────────────────────────────────────────
+class CircuitBreaker:
+    """closed → (N ошибок подряд) → open → (reset сек) → half-open → …"""
+
+    def __init__(self, failures: int = BREAKER_FAILURES, reset: float = BREAKER_RESET):
+        self.failures = failures
+        self.reset = reset
+        self.errors = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.probing:
+            self.probing = True            # пропускаем один пробный запрос
+            return True
+        return False
+
+    def success(self) -> None:
+        if self.opened_at is not None:
+            logger.info("LLM circuit breaker: closed")
+        self.errors = 0
+        self.opened_at = None
+        self.probing = False
+
+    def release(self) -> None:
+        """Запрос закончился, не сказав ничего о здоровье API (отмена,
+        ошибка до отправки): пробный слот снова свободен."""
+        self.probing = False
+
+    def failure(self) -> None:
+        self.errors += 1
+        self.probing = False
+        if self.opened_at is not None or self.errors >= self.failures:
+            if self.opened_at is None:
+                logger.warning(f"LLM circuit breaker: open после {self.errors} ошибок")
+            self.opened_at = time.monotonic()
+
+
+# ── повторы и хеджирование ─────────────────────────────────────
+class ResilientLLM:
+    def __init__(self, breaker: Optional[CircuitBreaker] = None, *,
+                 retries: int = LLM_RETRIES, backoff: float = LLM_BACKOFF,
+                 backoff_max: float = LLM_BACKOFF_MAX):
+        self.breaker = breaker or CircuitBreaker()
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.retried = 0
+        self.hedged = 0
+
+    async def call(self, make: Callable[[], Awaitable[T]], *,
+                   hedge: Optional[float] = None) -> T:
+        """make() создаёт новый запрос на каждую попытку.
+        hedge — через сколько секунд без ответа отправить дубль."""
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                raise Unavailable()
+            try:
+                result = await (self._hedged(make, hedge) if hedge else make())
+            except RETRYABLE as e:
+                self.breaker.failure()
+                if attempt == self.retries:
+                    raise
+                self.retried += 1
+                # full jitter: случайная пауза от 0 до min(max, base·2^n)
+                delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+                if isinstance(e, openai.RateLimitError):
+                    delay = max(delay, _retry_after(e))
+                logger.warning(f"LLM: {type(e).__name__}, повтор через {delay:.1f} с")
+                await asyncio.sleep(delay)
+            except openai.APIStatusError:
+                # 400/401/422…: API ответил — он жив, а запрос повторять бессмысленно
+                self.breaker.success()
+                raise
+            except BaseException:
+                self.breaker.release()
+                raise
+            else:
+                self.breaker.success()
+                return result
+        raise AssertionError("unreachable")
+
+    async def _hedged(self, make: Callable[[], Awaitable[T]], delay: float) -> T:
+        first = asyncio.ensure_future(make())
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+            self.hedged += 1
+            pending.add(asyncio.ensure_future(make()))
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None:
+                        return t.result()
+                    error = t.exception()
+            raise error
+        finally:
+            # проигравший запрос — и оба, если отменили нас самих
+            for p in pending:
+                p.cancel()
+
+
+def _retry_after(e: openai.APIStatusError) -> float:
+    try:
+        return float(e.response.headers.get("retry-after", 0))
+    except (TypeError, ValueError, AttributeError):
+        return 0.0